@@ -23,6 +23,27 @@ class Config:
     
     # PushinPay
     PUSHINPAY_TOKEN = os.getenv('PUSHINPAY_TOKEN', '26627|5I0lOsq1yvn9R2R6PFn3EdwTUQjuer8NJNBkg8Cr09081214')
+    PUSHINPAY_TIMEOUT = float(os.getenv('PUSHINPAY_TIMEOUT', '15'))  # segundos por requisição
+    PUSHINPAY_CONNECT_TIMEOUT = float(os.getenv('PUSHINPAY_CONNECT_TIMEOUT', '5'))
+    PUSHINPAY_MAX_CONNECTIONS = int(os.getenv('PUSHINPAY_MAX_CONNECTIONS', '20'))  # por event loop
+    PUSHINPAY_KEEPALIVE = float(os.getenv('PUSHINPAY_KEEPALIVE', '30'))
+    PUSHINPAY_MAX_CONCURRENCY_PER_TOKEN = int(os.getenv('PUSHINPAY_MAX_CONCURRENCY_PER_TOKEN', '4'))
+    PUSHINPAY_CLIENT_IDLE_TTL = float(os.getenv('PUSHINPAY_CLIENT_IDLE_TTL', '600'))  # segundos
+
+    # Webhook da PushinPay (servido por user_bot_main.py; vazio desativa)
+    PUSHINPAY_WEBHOOK_URL = os.getenv('PUSHINPAY_WEBHOOK_URL', '')  # endereço público, ex.: https://meu.host
+    PUSHINPAY_WEBHOOK_PATH = os.getenv('PUSHINPAY_WEBHOOK_PATH', '/pushinpay/webhook')
+    PUSHINPAY_WEBHOOK_SECRET = os.getenv('PUSHINPAY_WEBHOOK_SECRET', '')
+    WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+
+    # Verificação automática dos pagamentos pendentes (reserva do webhook)
+    PAYMENT_POLL_INITIAL_INTERVAL = float(os.getenv('PAYMENT_POLL_INITIAL_INTERVAL', '5'))  # segundos
+    PAYMENT_POLL_BACKOFF = float(os.getenv('PAYMENT_POLL_BACKOFF', '1.5'))
+    PAYMENT_POLL_MAX_INTERVAL = float(os.getenv('PAYMENT_POLL_MAX_INTERVAL', '120'))
+    PAYMENT_POLL_MAX_INFLIGHT_PER_TOKEN = int(os.getenv('PAYMENT_POLL_MAX_INFLIGHT_PER_TOKEN', '2'))
+    PAYMENT_POLL_TIMEOUT = float(os.getenv('PAYMENT_POLL_TIMEOUT', '1800'))  # desiste após 30 minutos
+    PAYMENT_RECOVERY_BATCH = int(os.getenv('PAYMENT_RECOVERY_BATCH', '50'))  # atrasados retomados por intervalo
     
     # Configurações gerais
     COMMISSION_RATE = 0.20
@@ -35,7 +56,37 @@ class Config:
     REFERRAL_MIN_AMOUNT = 9.90
     WITHDRAWAL_INTERVAL_DAYS = 15
     REDIS_PREFIX = "zenyx"
-    
+
+    # Persistência
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'file').lower()  # file, redis, sqlite
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '50'))
+    SQLITE_PATH = os.getenv('SQLITE_PATH', 'data/bot_data.db')
+    FILE_STORE_MODE = os.getenv('FILE_STORE_MODE', 'snapshot').lower()  # snapshot, journal, write_behind
+    FILE_STORE_FORMAT = os.getenv('FILE_STORE_FORMAT', 'json').lower()  # json, msgpack
+    FILE_STORE_SHARDS = int(os.getenv('FILE_STORE_SHARDS', '16'))  # arquivos por namespace
+    JOURNAL_COMPACT_RECORDS = int(os.getenv('JOURNAL_COMPACT_RECORDS', '1000'))
+    WRITE_BEHIND_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL', '2.0'))
+    WRITE_BEHIND_MAX_DIRTY = int(os.getenv('WRITE_BEHIND_MAX_DIRTY', '100'))
+
+    # Expiração (segundos; 0 desativa)
+    STATE_TTL = int(os.getenv('STATE_TTL', '86400'))
+    CHANNEL_CODE_TTL = int(os.getenv('CHANNEL_CODE_TTL', '3600'))
+    PENDING_PAYMENT_TTL = int(os.getenv('PENDING_PAYMENT_TTL', '86400'))
+    EXPIRY_SWEEP_INTERVAL = float(os.getenv('EXPIRY_SWEEP_INTERVAL', '60'))
+
+    # Cache de configuração dos bots (backends redis e sqlite)
+    BOT_CACHE_SIZE = int(os.getenv('BOT_CACHE_SIZE', '1024'))
+    BOT_CACHE_TTL = float(os.getenv('BOT_CACHE_TTL', '30'))
+
+    # Notificação de alterações entre processos (pub/sub no Redis,
+    # verificação periódica no SQLite e nos shards em arquivo)
+    CHANGE_NOTIFICATIONS = os.getenv('CHANGE_NOTIFICATIONS', 'true').lower() == 'true'
+    CHANGE_POLL_INTERVAL = float(os.getenv('CHANGE_POLL_INTERVAL', '1.0'))
+
+    # Presença: acessos acumulados em memória e gravados a cada intervalo
+    ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', '30'))
+
     @classmethod
     def is_admin(cls, user_id: int) -> bool:
         return user_id in cls.ADMIN_IDS
@@ -12,10 +12,11 @@ from telegram.ext import ContextTypes
 from config.config import Config
 from utils.helpers import is_admin, log_user_action, log_error
 from utils.templates import MESSAGES, BUTTONS
-from services.redis_service import RedisService
+from services.redis_service import get_redis_service
+from services.activity import get_activity_tracker
 
 logger = logging.getLogger(__name__)
-redis_service = RedisService()
+redis_service = get_redis_service()
 
 async def admin_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handler para menu administrativo"""
@@ -42,6 +43,55 @@ async def admin_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     
     log_user_action(user_id, 'admin_menu_accessed')
 
+async def bot_lookup_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handler para /bot <id ou @username>: busca um bot pelos índices"""
+    user_id = update.effective_user.id
+    
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ Você não tem permissão para usar este comando.")
+        return
+    
+    if not context.args:
+        await update.message.reply_text("Uso: /bot <id ou @username>")
+        return
+    
+    try:
+        search = context.args[0]
+        if search.isdigit():
+            bot_id = int(search)
+        else:
+            bot_id = await redis_service.get_bot_id_by_username(search)
+        
+        token = await redis_service.get_bot_token_by_id(bot_id) if bot_id else None
+        bot_data = await redis_service.get_bot_data(token) if token else None
+        if not bot_data:
+            await update.message.reply_text("❌ Bot não encontrado.")
+            return
+        
+        owner_id = bot_data.get('owner_id')
+        owner_bots = await redis_service.get_owner_bots(owner_id) if owner_id else {}
+        config = bot_data.get('config', {})
+        
+        message = MESSAGES['bot_lookup'].format(
+            username=bot_data.get('username', ''),
+            bot_id=bot_id,
+            owner_id=owner_id,
+            active="✅" if bot_data.get('active', True) else "❌",
+            plans=len(config.get('plans', [])),
+            groups=len(config.get('linked_groups', [])),
+            created_at=bot_data.get('created_at', '-'),
+            owner_bot_count=len(owner_bots),
+            owner_bots=', '.join(f"`@{data.get('username', '')}`" for data in owner_bots.values())
+        )
+        
+        await update.message.reply_text(message, parse_mode='Markdown')
+        
+        log_user_action(user_id, 'admin_bot_lookup', {'bot_id': bot_id})
+    
+    except Exception as e:
+        log_error(e, {'handler': 'bot_lookup_handler', 'user_id': user_id})
+        await update.message.reply_text("❌ Erro ao buscar bot.")
+
 async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handler para callbacks administrativos"""
     query = update.callback_query
@@ -94,21 +144,10 @@ async def show_admin_menu(query, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def show_metrics(query, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Mostra métricas de vendas"""
     try:
-        # Buscar todos os usuários
-        all_users = await redis_service.get_all_users()
-        
-        # Calcular métricas
-        total_sales = 0
-        total_amount = 0.0
-        paying_users = 0
-        
-        for user_id, user_data in all_users.items():
-            sales = user_data.get('sales', [])
-            total_sales += len(sales)
-            total_amount += sum(sale.get('amount', 0) for sale in sales)
-            
-            if sales:
-                paying_users += 1
+        # Contadores mantidos pelo serviço a cada escrita
+        metrics = await redis_service.get_platform_metrics()
+        total_sales = metrics['sales']
+        total_amount = metrics['revenue']
         
         average = total_amount / total_sales if total_sales > 0 else 0
         
@@ -120,8 +159,9 @@ async def show_metrics(query, context: ContextTypes.DEFAULT_TYPE) -> None:
         )
         
         # Adicionar informações extras
-        message += f"\n\n👥 Total de usuários: {len(all_users)}"
-        message += f"\n💳 Usuários pagantes: {paying_users}"
+        message += f"\n\n👥 Total de usuários: {metrics['users']}"
+        message += f"\n🤖 Total de bots: {metrics['bots']}"
+        message += f"\n💳 Usuários pagantes: {metrics['paying_users']}"
         
         keyboard = [[InlineKeyboardButton(BUTTONS['back'], callback_data='admin_back')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -141,8 +181,7 @@ async def export_contacts(query, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
         await query.edit_message_text(MESSAGES['export_contacts'])
         
-        # Buscar todos os usuários
-        all_users = await redis_service.get_all_users()
+        sales_totals = await redis_service.get_sales_totals()
         
         # Criar CSV em memória
         output = io.StringIO()
@@ -151,10 +190,11 @@ async def export_contacts(query, context: ContextTypes.DEFAULT_TYPE) -> None:
         # Cabeçalhos
         writer.writerow(['ID', 'Username', 'Nome', 'Total Gasto', 'Última Atividade'])
         
-        # Dados
-        for user_id, user_data in all_users.items():
-            sales = user_data.get('sales', [])
-            total_spent = sum(sale.get('amount', 0) for sale in sales)
+        # Dados (usuários lidos em páginas, só com os campos exportados)
+        async for user_id, user_data in redis_service.iter_users(
+            fields=('username', 'first_name', 'last_activity')
+        ):
+            total_spent = sales_totals.get(user_id, 0.0)
             
             writer.writerow([
                 user_id,
@@ -214,8 +254,7 @@ async def show_system_status(query, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
         # Verificar status do Redis
         try:
-            await redis_service.get_all_users()
-            redis_status = "✅ Online"
+            redis_status = "✅ Online" if await redis_service.ping() else "❌ Offline"
         except:
             redis_status = "❌ Offline"
         
@@ -227,6 +266,13 @@ async def show_system_status(query, context: ContextTypes.DEFAULT_TYPE) -> None:
             pushinpay_status=pushinpay_status
         )
         
+        cache_stats = await redis_service.get_cache_stats()
+        if cache_stats:
+            message += (
+                f"\n\n🗂 Cache de bots: {cache_stats['size']}/{cache_stats['max_size']} "
+                f"({cache_stats['hit_rate']:.0%} acertos)"
+            )
+        
         keyboard = [[InlineKeyboardButton(BUTTONS['back'], callback_data='admin_back')]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
@@ -243,13 +289,14 @@ async def show_system_status(query, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def show_online_users(query, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Mostra usuários online"""
     try:
-        # Buscar usuários ativos
+        # Buscar usuários ativos (gravando antes os acessos acumulados)
+        await get_activity_tracker().flush()
         active_users = await redis_service.get_active_users(minutes=5)
-        all_users = await redis_service.get_all_users()
+        metrics = await redis_service.get_platform_metrics()
         
         message = MESSAGES['online_users'].format(
             active_users=len(active_users),
-            total_users=len(all_users)
+            total_users=metrics['users']
         )
         
         # Listar alguns usuários ativos
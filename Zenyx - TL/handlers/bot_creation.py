@@ -21,14 +21,16 @@ from utils.helpers import (
     create_back_button,
     log_user_action,
     log_error,
-    generate_code
+    generate_code,
+    get_bot_id
 )
 from utils.templates import MESSAGES, BUTTONS, ERROR_MESSAGES
-from services.redis_service import RedisService
+from services.redis_service import get_redis_service
 from services.botfather_service import BotFatherService
+from services.bot_config import append_bot_config
 
 logger = logging.getLogger(__name__)
-redis_service = RedisService()
+redis_service = get_redis_service()
 botfather_service = BotFatherService()
 
 async def create_bot_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -39,9 +41,9 @@ async def create_bot_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     try:
         user_id = update.effective_user.id
         
-        # Verificar se usuário pode criar mais bots
-        user_data = await redis_service.get_user_data(user_id)
-        can_create, message = can_create_bot(user_data)
+        # Verificar se usuário pode criar mais bots (contagem pelo índice de bots do dono)
+        bot_ids = await redis_service.get_owner_bot_ids(user_id)
+        can_create, message = can_create_bot(None, len(bot_ids))
         
         if not can_create:
             await query.edit_message_text(
@@ -94,6 +96,13 @@ async def handle_token_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
             )
             return
         
+        # O limite pode ter sido atingido depois do início da criação
+        can_create, _ = can_create_bot(None, len(await redis_service.get_owner_bot_ids(user_id)))
+        if not can_create:
+            await update.message.reply_text(ERROR_MESSAGES['bot_limit_reached'])
+            await redis_service.clear_user_state(user_id)
+            return
+        
         # Mostrar mensagem de processamento
         processing_message = await update.message.reply_text(
             MESSAGES['bot_starting']
@@ -111,6 +120,7 @@ async def handle_token_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # Salvar dados do bot
         bot_data = {
             'token': message_text,
+            'bot_id': get_bot_id(message_text),
             'owner_id': user_id,
             'username': bot_info.get('username'),
             'config': {
@@ -477,13 +487,16 @@ async def handle_add_channel(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         # Gerar código único
         code = generate_code()
-        expiry = datetime.now() + timedelta(hours=1)
+        # CHANNEL_CODE_TTL=0: código sem expiração
+        expiry = None
+        if Config.CHANNEL_CODE_TTL:
+            expiry = (datetime.now() + timedelta(seconds=Config.CHANNEL_CODE_TTL)).isoformat()
         
-        # Salvar código no Redis
+        # Salvar código no Redis (removido automaticamente ao expirar)
         await redis_service.save_channel_code(code, {
             'bot_token': bot_token,
             'user_id': user_id,
-            'expiry': expiry.isoformat()
+            'expiry': expiry
         })
         
         keyboard = [[InlineKeyboardButton(BUTTONS['back'], callback_data='config_channel')]]
@@ -511,8 +524,8 @@ async def handle_channel_code(update: Update, context: ContextTypes.DEFAULT_TYPE
             return
         
         # Verificar se código não expirou
-        expiry = datetime.fromisoformat(code_data['expiry'])
-        if datetime.now() > expiry:
+        expiry = code_data.get('expiry')
+        if expiry and datetime.now() > datetime.fromisoformat(expiry):
             await update.message.reply_text("❌ Código expirado.")
             return
         
@@ -538,27 +551,28 @@ async def handle_channel_code(update: Update, context: ContextTypes.DEFAULT_TYPE
         bot_data = await redis_service.get_bot_data(bot_token)
         
         if bot_data:
-            config = bot_data.get('config', {})
-            linked_groups = config.get('linked_groups', [])
+            # Adicionar novo grupo sem sobrescrever outras alterações do bot
+            linked = await append_bot_config(
+                bot_token,
+                'linked_groups',
+                {
+                    'id': chat_id,
+                    'title': chat.title,
+                    'type': chat.type,
+                    'username': chat.username
+                },
+                is_duplicate=lambda group: group.get('id') == chat_id
+            )
             
             # Verificar se grupo já está vinculado
-            if any(group.get('id') == chat_id for group in linked_groups):
+            if linked is False:
                 await update.message.reply_text(
                     "⚠️ Este grupo/canal já está vinculado."
                 )
                 return
-            
-            # Adicionar novo grupo
-            linked_groups.append({
-                'id': chat_id,
-                'title': chat.title,
-                'type': chat.type,
-                'username': chat.username
-            })
-            
-            config['linked_groups'] = linked_groups
-            bot_data['config'] = config
-            await redis_service.save_bot_data(bot_token, bot_data)
+            if linked is None:
+                await update.message.reply_text(MESSAGES['error_generic'])
+                return
             
             await update.message.reply_text(
                 f"✅ {chat.title} vinculado com sucesso!"
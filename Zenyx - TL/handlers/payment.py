@@ -18,12 +18,11 @@ from utils.helpers import (
     log_error
 )
 from utils.templates import MESSAGES, BUTTONS
-from services.redis_service import RedisService
-from services.payment_service import PaymentService
+from services.redis_service import get_redis_service
+from services.payment_service import get_payment_client
 
 logger = logging.getLogger(__name__)
-redis_service = RedisService()
-payment_service = PaymentService()
+redis_service = get_redis_service()
 
 async def balance_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handler para verificar saldo"""
@@ -261,7 +260,7 @@ async def request_withdrawal_handler(update: Update, context: ContextTypes.DEFAU
             return
         
         # Processar saque
-        success = await payment_service.process_withdrawal(user_id, balance)
+        success = await get_payment_client(Config.PUSHINPAY_TOKEN).process_withdrawal(user_id, balance)
         
         if success:
             # Atualizar saldo e data do último saque
@@ -16,10 +16,10 @@ from utils.helpers import (
     log_error
 )
 from utils.templates import MESSAGES, BUTTONS
-from services.redis_service import RedisService
+from services.redis_service import get_redis_service
 
 logger = logging.getLogger(__name__)
-redis_service = RedisService()
+redis_service = get_redis_service()
 
 async def start_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handler para comando /start"""
@@ -138,22 +138,26 @@ async def process_referral(user_id: int, referrer_id: int, username: str = None)
         if user_id == referrer_id:
             return False
         
+        # Buscar referrer e usuário em uma única leitura
+        users = await redis_service.get_many('users', [referrer_id, user_id])
+        referrer_data = users[referrer_id]
+        user_data = users[user_id]
+        
         # Verificar se referrer existe
-        referrer_data = await redis_service.get_user_data(referrer_id)
         if not referrer_data:
             return False
         
         # Verificar se usuário já foi indicado
-        user_data = await redis_service.get_user_data(user_id)
         if user_data and user_data.get('referred_by'):
             return False
         
         # Adicionar referral
+        updates = {}
         referrals = referrer_data.get('referrals', [])
         if user_id not in referrals:
             referrals.append(user_id)
             referrer_data['referrals'] = referrals
-            await redis_service.save_user_data(referrer_id, referrer_data)
+            updates[referrer_id] = referrer_data
         
         # Marcar usuário como indicado
         if not user_data:
@@ -161,7 +165,10 @@ async def process_referral(user_id: int, referrer_id: int, username: str = None)
         
         user_data['referred_by'] = referrer_id
         user_data['referral_date'] = Update.message.date.isoformat() if hasattr(Update, 'message') else None
-        await redis_service.save_user_data(user_id, user_data)
+        updates[user_id] = user_data
+        
+        # Gravar os dois registros juntos
+        await redis_service.save_many('users', updates)
         
         # Notificar referrer
         try:
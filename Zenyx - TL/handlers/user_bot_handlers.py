@@ -4,9 +4,11 @@ Handlers para os bots criados pelos usuários
 
 import logging
 import asyncio
+import threading
+import weakref
 from datetime import datetime, timedelta
-from typing import Dict, Any, List
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from typing import Dict, Any, List, Optional, Iterable
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
 from config.config import Config, BOT_STATES
@@ -20,12 +22,24 @@ from utils.helpers import (
     replace_placeholders
 )
 from utils.templates import MESSAGES, BUTTONS, ERROR_MESSAGES
-from services.redis_service import RedisService
-from services.payment_service import PaymentService
+from services.redis_service import get_redis_service
+from services.payment_service import get_payment_client
+from services.bot_config import append_bot_config
+from services.payment_webhook import payment_webhook_url
+from services.payment_poller import PaymentPoller
+from services.sales_ledger import timestamp_score
 
 logger = logging.getLogger(__name__)
-redis_service = RedisService()
-payment_service = PaymentService()
+redis_service = get_redis_service()
+
+# Pagamentos sendo confirmados agora (webhook, verificação manual e automática)
+_confirming = set()
+_payments_lock = threading.Lock()
+# Bots usados fora dos handlers (webhook e verificação automática), por
+# event loop e token
+_loop_bots: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Bot]]' = weakref.WeakKeyDictionary()
+# Agendador das verificações automáticas
+_payment_poller = None
 
 async def handle_start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handler para comando /start nos bots dos usuários"""
@@ -180,13 +194,8 @@ async def handle_media_message(update: Update, context: ContextTypes.DEFAULT_TYP
             )
             return
         
-        # Salvar mídia na configuração
-        config = bot_data.get('config', {})
-        config['media_type'] = media_type
-        config['media_id'] = media_id
-        bot_data['config'] = config
-        
-        await redis_service.save_bot_data(bot_token, bot_data)
+        # Salvar mídia na configuração (tipo e id juntos, em uma só versão)
+        await redis_service.update_bot_config_many(bot_token, {'media_type': media_type, 'media_id': media_id})
         
         # Limpar estado
         await redis_service.clear_user_state(user_id)
@@ -395,11 +404,7 @@ async def handle_pushinpay_token(update: Update, context: ContextTypes.DEFAULT_T
             return
         
         # Salvar token na configuração
-        config = bot_data.get('config', {})
-        config['pushinpay_token'] = token
-        bot_data['config'] = config
-        
-        await redis_service.save_bot_data(bot_data['token'], bot_data)
+        await redis_service.update_bot_config(bot_data['token'], 'pushinpay_token', token)
         
         # Limpar estado
         await redis_service.clear_user_state(user_id)
@@ -423,11 +428,7 @@ async def handle_welcome_message(update: Update, context: ContextTypes.DEFAULT_T
         text = update.message.text
         
         # Salvar mensagem na configuração
-        config = bot_data.get('config', {})
-        config['welcome_message'] = text
-        bot_data['config'] = config
-        
-        await redis_service.save_bot_data(bot_data['token'], bot_data)
+        await redis_service.update_bot_config(bot_data['token'], 'welcome_message', text)
         
         # Limpar estado
         await redis_service.clear_user_state(user_id)
@@ -461,14 +462,9 @@ async def handle_plan_creation(update: Update, context: ContextTypes.DEFAULT_TYP
             return
         
         # Adicionar plano à configuração
-        config = bot_data.get('config', {})
-        if 'plans' not in config:
-            config['plans'] = []
-        
-        config['plans'].append(plan_data)
-        bot_data['config'] = config
-        
-        await redis_service.save_bot_data(bot_data['token'], bot_data)
+        if await append_bot_config(bot_data['token'], 'plans', plan_data) is None:
+            await update.message.reply_text(MESSAGES['error_generic'])
+            return
         
         # Limpar estado
         await redis_service.clear_user_state(user_id)
@@ -525,27 +521,28 @@ async def handle_channel_code(update: Update, context: ContextTypes.DEFAULT_TYPE
         bot_data = await redis_service.get_bot_data(bot_token)
         
         if bot_data:
-            config = bot_data.get('config', {})
-            linked_groups = config.get('linked_groups', [])
+            # Adicionar novo grupo sem sobrescrever outras alterações do bot
+            linked = await append_bot_config(
+                bot_token,
+                'linked_groups',
+                {
+                    'id': chat_id,
+                    'title': chat.title,
+                    'type': chat.type,
+                    'username': chat.username
+                },
+                is_duplicate=lambda group: group.get('id') == chat_id
+            )
             
             # Verificar se grupo já está vinculado
-            if any(group.get('id') == chat_id for group in linked_groups):
+            if linked is False:
                 await update.message.reply_text(
                     "⚠️ Este grupo/canal já está vinculado."
                 )
                 return
-            
-            # Adicionar novo grupo
-            linked_groups.append({
-                'id': chat_id,
-                'title': chat.title,
-                'type': chat.type,
-                'username': chat.username
-            })
-            
-            config['linked_groups'] = linked_groups
-            bot_data['config'] = config
-            await redis_service.save_bot_data(bot_token, bot_data)
+            if linked is None:
+                await update.message.reply_text(MESSAGES['error_generic'])
+                return
             
             await update.message.reply_text(
                 f"✅ {chat.title} vinculado com sucesso!"
@@ -740,13 +737,11 @@ async def handle_plan_purchase(update: Update, context: ContextTypes.DEFAULT_TYP
             )
             return
         
-        # Criar um PaymentService com o token do usuário
-        user_payment_service = PaymentService()
-        user_payment_service.token = pushinpay_token
-        user_payment_service.headers['Authorization'] = f'Bearer {pushinpay_token}'
+        # Cliente compartilhado do token PushinPay do dono do bot
+        user_payment_service = get_payment_client(pushinpay_token)
         
         # Criar pagamento
-        payment_result = await user_payment_service.create_pix_payment(plan_price)
+        payment_result = await user_payment_service.create_pix_payment(plan_price, webhook_url=payment_webhook_url())
         
         if not payment_result['success']:
             await query.edit_message_text(
@@ -773,6 +768,10 @@ async def handle_plan_purchase(update: Update, context: ContextTypes.DEFAULT_TYP
         
         await redis_service.save_payment_data(user_id, payment_data)
         
+        # Verificação automática em background (cancelada pelo webhook),
+        # registrada antes das mensagens para não se perder se o envio falhar
+        get_payment_poller().add(payment_id, user_id, pushinpay_token)
+        
         # Decodificar imagem do QR Code
         qr_image = user_payment_service.decode_base64_to_image(qr_code_base64)
         
@@ -816,9 +815,6 @@ async def handle_plan_purchase(update: Update, context: ContextTypes.DEFAULT_TYP
             reply_markup=reply_markup
         )
         
-        # Iniciar verificação automática em background
-        asyncio.create_task(auto_check_payment(context, user_id, payment_id, bot_data))
-        
     except Exception as e:
         log_error(e, {'handler': 'handle_plan_purchase'})
         await query.answer("Erro ao processar pagamento", show_alert=True)
@@ -840,23 +836,36 @@ async def check_payment_status(update: Update, context: ContextTypes.DEFAULT_TYP
             await query.answer("Pagamento não encontrado", show_alert=True)
             return
         
+        if payment_data.get('status') == 'paid':
+            await query.answer("Pagamento já confirmado", show_alert=True)
+            return
+        
         # Obter token do bot para PushinPay
         bot_token = payment_data.get('bot_token')
         bot_data = await redis_service.get_bot_data(bot_token)
-        config = bot_data.get('config', {})
+        config = (bot_data or {}).get('config', {})
         pushinpay_token = config.get('pushinpay_token')
         
-        # Criar PaymentService com token do usuário
-        user_payment_service = PaymentService()
-        user_payment_service.token = pushinpay_token
-        user_payment_service.headers['Authorization'] = f'Bearer {pushinpay_token}'
+        if not pushinpay_token:
+            # Sem token do dono não há como consultar a cobrança
+            await query.answer("Este bot não está configurado para receber pagamentos", show_alert=True)
+            return
+        
+        # Cliente compartilhado do token PushinPay do dono do bot
+        user_payment_service = get_payment_client(pushinpay_token)
         
         # Verificar status
         result = await user_payment_service.check_payment_status(payment_id)
         
         if result['success'] and result['paid']:
             # Pagamento confirmado
-            await process_successful_payment(update, context, payment_data, bot_data)
+            if not await confirm_payment(context.bot, payment_data, bot_data):
+                # Webhook ou verificação automática chegou antes
+                current = await redis_service.get_payment_data(user_id, payment_id)
+                if current and current.get('status') == 'paid':
+                    await query.answer("Pagamento já confirmado", show_alert=True)
+                else:
+                    await query.answer("Pagamento em processamento, aguarde", show_alert=True)
         else:
             await query.answer("Pagamento ainda não confirmado", show_alert=True)
     
@@ -864,64 +873,124 @@ async def check_payment_status(update: Update, context: ContextTypes.DEFAULT_TYP
         log_error(e, {'handler': 'check_payment_status'})
         await query.answer("Erro ao verificar pagamento", show_alert=True)
 
-async def auto_check_payment(context: ContextTypes.DEFAULT_TYPE, user_id: int, payment_id: str, bot_data: Dict[str, Any]) -> None:
-    """Verifica automaticamente o status do pagamento em intervalos"""
-    try:
-        config = bot_data.get('config', {})
-        pushinpay_token = config.get('pushinpay_token')
-        
-        # Criar PaymentService com token do usuário
-        user_payment_service = PaymentService()
-        user_payment_service.token = pushinpay_token
-        user_payment_service.headers['Authorization'] = f'Bearer {pushinpay_token}'
-        
-        # Verificar por até 30 minutos
-        max_attempts = 60  # 30 minutos (30 segundos * 60)
-        attempts = 0
-        
-        while attempts < max_attempts:
-            attempts += 1
-            
-            # Verificar status
-            result = await user_payment_service.check_payment_status(payment_id)
-            
-            if result['success'] and result['paid']:
-                # Pagamento confirmado
-                payment_data = await redis_service.get_payment_data(user_id, payment_id)
-                if payment_data:
-                    # Criar um update fake para processar o pagamento
-                    class FakeUpdate:
-                        class effective_user:
-                            id = user_id
-                    
-                    fake_update = FakeUpdate()
-                    await process_successful_payment(fake_update, context, payment_data, bot_data)
-                break
-            
-            # Aguardar 30 segundos antes da próxima verificação
-            await asyncio.sleep(30)
+def get_payment_poller() -> PaymentPoller:
+    """Agendador único que verifica os pagamentos pendentes de todos os bots"""
+    global _payment_poller
+    with _payments_lock:
+        if _payment_poller is None:
+            _payment_poller = PaymentPoller(check_pending_payment)
+        return _payment_poller
+
+async def recover_pending_payments(bot_tokens: Optional[Iterable[str]] = None) -> int:
+    """Devolve ao agendador os pagamentos pendentes gravados antes de um
+    reinício (só os dos bots em bot_tokens, se informado)"""
+    bot_tokens = set(bot_tokens) if bot_tokens is not None else None
+    pushinpay_tokens: Dict[str, Optional[str]] = {}
+    entries = []
+    for payment_data in await redis_service.get_payments_by_status('pending'):
+        bot_token = payment_data.get('bot_token')
+        if bot_tokens is not None and bot_token not in bot_tokens:
+            continue
+        if bot_token not in pushinpay_tokens:
+            bot_data = await redis_service.get_bot_data(bot_token)
+            pushinpay_tokens[bot_token] = bot_data and bot_data.get('config', {}).get('pushinpay_token')
+        if not pushinpay_tokens[bot_token]:
+            continue
+        entries.append({
+            'payment_id': payment_data['payment_id'],
+            'user_id': payment_data['user_id'],
+            'token': pushinpay_tokens[bot_token],
+            'created_at': timestamp_score(payment_data.get('created_at')),
+            'next_check_at': payment_data.get('next_check_at'),
+            'attempts': payment_data.get('check_attempts', 0)
+        })
+    restored = get_payment_poller().restore(entries)
+    logger.info(f"{restored} pagamentos pendentes retomados")
+    return restored
+
+async def check_pending_payment(payment_id: str, user_id: int) -> bool:
+    """Uma verificação automática; retorna True quando não há mais o que verificar"""
+    # Já confirmado (webhook ou outro processo) ou expirado
+    payment_data = await redis_service.get_payment_data(user_id, payment_id)
+    if not payment_data or payment_data.get('status') != 'pending':
+        return True
     
-    except Exception as e:
-        log_error(e, {'function': 'auto_check_payment'})
+    bot_data = await redis_service.get_bot_data(payment_data.get('bot_token'))
+    if not bot_data:
+        return True
+    
+    pushinpay_token = bot_data.get('config', {}).get('pushinpay_token')
+    if not pushinpay_token:
+        # A cobrança foi feita com um token que o dono removeu do bot
+        logger.warning(f"Bot sem token PushinPay, verificação do pagamento {payment_id} encerrada")
+        return True
+    result = await get_payment_client(pushinpay_token).check_payment_status(payment_id)
+    if not result['success']:
+        return False
+    
+    if result['paid']:
+        bot = await _get_loop_bot(bot_data['token'])
+        return await confirm_payment(bot, payment_data, bot_data)
+    
+    if result.get('status') == 'canceled':
+        payment_data['status'] = 'canceled'
+        await redis_service.save_payment_data(user_id, payment_data)
+        return True
+    return False
 
-async def process_successful_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, payment_data: Dict[str, Any], bot_data: Dict[str, Any]) -> None:
-    """Processa um pagamento bem-sucedido"""
+async def confirm_payment(bot: Bot, payment_data: Dict[str, Any], bot_data: Dict[str, Any]) -> bool:
+    """Confirma um pagamento: registra a venda e libera o acesso ao comprador
+
+    Webhook, verificação manual e automática podem chegar juntos; só a
+    primeira confirmação de cada pagamento é processada. A venda usa o id
+    do pagamento como sale_key e a comissão só é creditada quando ela é
+    registrada, então nem outro processo confirma duas vezes. Retorna
+    False se o pagamento já estava confirmado.
+    """
+    payment_id = payment_data.get('payment_id')
+    user_id = payment_data.get('user_id')
+    with _payments_lock:
+        if payment_id in _confirming:
+            return False
+        _confirming.add(payment_id)
     try:
-        user_id = update.effective_user.id
+        current = await redis_service.get_payment_data(user_id, payment_id)
+        if current and current.get('status') == 'paid':
+            return False
+        
         plan_name = payment_data.get('plan_name')
         plan_price = payment_data.get('plan_price')
         
-        # Atualizar status do pagamento
+        # Atualizar status do pagamento e registrar a venda para o dono do
+        # bot em um único lote
         payment_data['status'] = 'paid'
         payment_data['paid_at'] = datetime.now().isoformat()
-        await redis_service.save_payment_data(user_id, payment_data['payment_id'])
+        owner_id = bot_data.get('owner_id')
+        commission = plan_price * Config.COMMISSION_RATE
+        
+        async with redis_service.pipeline() as pipe:
+            pipe.save_payment_data(user_id, payment_data)
+            if owner_id:
+                pipe.add_user_sale(owner_id, {
+                    'owner_id': owner_id,
+                    'bot_token': bot_data.get('token'),
+                    'user_id': user_id,
+                    'plan_name': plan_name,
+                    'amount': plan_price,
+                    'timestamp': payment_data['paid_at'],
+                    'sale_key': payment_id
+                }, credit=commission)
+        
+        if owner_id and not pipe.results[1]:
+            logger.info(f"Payment {payment_id} was already confirmed")
+            return False
         
         # Obter grupos vinculados
         config = bot_data.get('config', {})
         linked_groups = config.get('linked_groups', [])
         
         # Enviar confirmação ao usuário
-        await context.bot.send_message(
+        await bot.send_message(
             chat_id=user_id,
             text=f"✅ Pagamento confirmado!\n\n"
                  f"Plano: {plan_name}\n"
@@ -933,38 +1002,24 @@ async def process_successful_payment(update: Update, context: ContextTypes.DEFAU
         for group in linked_groups:
             try:
                 # Gerar link de convite
-                invite_link = await context.bot.create_chat_invite_link(
+                invite_link = await bot.create_chat_invite_link(
                     chat_id=group['id'],
                     member_limit=1,
                     expire_date=int((datetime.now() + timedelta(days=1)).timestamp())
                 )
                 
                 # Enviar link ao usuário
-                await context.bot.send_message(
+                await bot.send_message(
                     chat_id=user_id,
                     text=f"🎉 Acesso ao grupo {group['title']}:\n{invite_link.invite_link}"
                 )
             except Exception as e:
                 logger.error(f"Failed to create invite link for group {group['id']}: {e}")
         
-        # Registrar venda para o dono do bot
-        owner_id = bot_data.get('owner_id')
+        # Notificar o dono do bot
         if owner_id:
-            sale_data = {
-                'user_id': user_id,
-                'plan_name': plan_name,
-                'amount': plan_price,
-                'timestamp': datetime.now().isoformat()
-            }
-            await redis_service.add_user_sale(owner_id, sale_data)
-            
-            # Calcular e adicionar comissão
-            commission = plan_price * Config.COMMISSION_RATE
-            await redis_service.increment_user_stats(owner_id, 'balance', commission)
-            
-            # Notificar o dono do bot
             try:
-                await context.bot.send_message(
+                await bot.send_message(
                     chat_id=owner_id,
                     text=f"💰 Nova venda realizada!\n\n"
                          f"Plano: {plan_name}\n"
@@ -973,6 +1028,60 @@ async def process_successful_payment(update: Update, context: ContextTypes.DEFAU
                 )
             except Exception:
                 pass
+        return True
     
     except Exception as e:
-        log_error(e, {'handler': 'process_successful_payment'})
\ No newline at end of file
+        log_error(e, {'handler': 'confirm_payment', 'payment_id': payment_id})
+        return False
+    finally:
+        with _payments_lock:
+            _confirming.discard(payment_id)
+
+async def _get_loop_bot(token: str) -> Bot:
+    """Bot inicializado no event loop atual (webhook ou agendador)"""
+    bots = _loop_bots.setdefault(asyncio.get_running_loop(), {})
+    bot = bots.get(token)
+    if bot is None:
+        bot = Bot(token)
+        await bot.initialize()
+        bots[token] = bot
+    return bot
+
+async def handle_payment_webhook(data: Dict[str, Any]) -> bool:
+    """Processa a notificação da PushinPay: localiza o pagamento pelo id,
+    confirma na hora e cancela a verificação por polling"""
+    payment_id = data.get('id')
+    status = data.get('status')
+    payment_data = await redis_service.get_payment_by_id(payment_id)
+    if not payment_data:
+        logger.warning(f"Webhook de pagamento desconhecido: {payment_id}")
+        return False
+    if payment_data.get('status') != 'pending' or status not in ('paid', 'canceled'):
+        return False
+    
+    if status == 'canceled':
+        get_payment_poller().discard(payment_id)
+        payment_data['status'] = 'canceled'
+        await redis_service.save_payment_data(payment_data['user_id'], payment_data)
+        return True
+    
+    bot_data = await redis_service.get_bot_data(payment_data.get('bot_token'))
+    if not bot_data:
+        return False
+    
+    # Sem segredo na URL, o webhook não é confiável: confirmar o status na API
+    if not Config.PUSHINPAY_WEBHOOK_SECRET:
+        pushinpay_token = bot_data.get('config', {}).get('pushinpay_token')
+        if not pushinpay_token:
+            logger.warning(f"Bot sem token PushinPay, webhook do pagamento {payment_id} não verificado")
+            return False
+        result = await get_payment_client(pushinpay_token).check_payment_status(payment_id)
+        if not (result['success'] and result['paid']):
+            return False
+    
+    bot = await _get_loop_bot(bot_data['token'])
+    confirmed = await confirm_payment(bot, payment_data, bot_data)
+    if confirmed:
+        # Se a confirmação falhar, a verificação por polling continua
+        get_payment_poller().discard(payment_id)
+    return confirmed
\ No newline at end of file
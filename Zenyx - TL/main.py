@@ -15,6 +15,7 @@ from telegram.ext import (
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
     ContextTypes,
     filters
 )
@@ -23,7 +24,9 @@ from telegram.ext import (
 from handlers.start import start_handler, verify_channel_handler
 from handlers.bot_creation import handle_token_input, create_bot_handler
 from handlers.payment import balance_handler, referral_handler, admin_vip_handler, how_it_works_handler
-from handlers.admin import admin_menu_handler, admin_callback_handler
+from handlers.admin import admin_menu_handler, admin_callback_handler, bot_lookup_handler
+from services.activity import get_activity_tracker
+from services.payment_service import close_http_session
 from utils.helpers import is_user_in_channel, get_user_balance
 from utils.templates import MESSAGES
 
@@ -57,6 +60,16 @@ class BotZenyx:
         if not self.admin_ids:
             logger.warning("ADMIN_IDS não configurado - funções admin desabilitadas")
     
+    async def track_activity(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Registra o acesso do usuário antes dos demais handlers"""
+        if update.effective_user:
+            await get_activity_tracker().touch(update.effective_user.id)
+    
+    async def on_shutdown(self, application: Application) -> None:
+        """Grava os acessos pendentes e fecha as conexões HTTP no encerramento"""
+        await get_activity_tracker().flush()
+        await close_http_session()
+    
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Handler para comando /start"""
         user_id = update.effective_user.id
@@ -146,11 +159,15 @@ class BotZenyx:
     def run(self) -> None:
         """Iniciar o bot"""
         # Criar a aplicação
-        application = Application.builder().token(self.token).build()
+        application = Application.builder().token(self.token).post_shutdown(self.on_shutdown).build()
+        
+        # Presença dos usuários (grupo -1: roda antes e não interrompe os demais)
+        application.add_handler(TypeHandler(Update, self.track_activity), group=-1)
         
         # Adicionar handlers
         application.add_handler(CommandHandler("start", self.start_command))
         application.add_handler(CommandHandler("admin", self.admin_command))
+        application.add_handler(CommandHandler("bot", bot_lookup_handler))
         application.add_handler(CallbackQueryHandler(self.handle_callback))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Migra data/bot_data.json (ou os shards do serviço em arquivo) para Redis ou SQLite
+
+    python migrate_store.py --to sqlite
+    python migrate_store.py --to redis --source data/bot_data.json --batch-size 2000
+
+Pare os bots antes de migrar. A migração pode ser interrompida e executada
+de novo: ela continua a partir do checkpoint <origem>.migration.json.
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+
+from config.config import Config
+from services.migration import StoreMigrator
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+def create_target(backend: str):
+    """Cria o serviço de destino sem depender de STORAGE_BACKEND"""
+    if backend == 'redis':
+        from services.async_redis_service import AsyncRedisService
+        return AsyncRedisService()
+    from services.sqlite_service import SQLiteService
+    return SQLiteService()
+
+async def migrate(args) -> int:
+    migrator = StoreMigrator(create_target(args.to), args.source, batch_size=args.batch_size)
+    if args.restart:
+        migrator.reset()
+
+    if not args.verify_only:
+        await migrator.run()
+
+    report = await migrator.verify()
+    if any(entry['mismatches'] for entry in report.values()):
+        logger.error("Verificação encontrou registros divergentes")
+        return 1
+    logger.info("Verificação concluída sem divergências")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra o armazenamento em arquivo para Redis ou SQLite")
+    parser.add_argument('--to', choices=('redis', 'sqlite'), required=True,
+                        help="backend de destino (REDIS_URL / SQLITE_PATH)")
+    parser.add_argument('--source', default='data/bot_data.json',
+                        help="bot_data.json ou diretório de shards")
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help="registros por pipeline/transação")
+    parser.add_argument('--restart', action='store_true',
+                        help="ignora o checkpoint e migra do início")
+    parser.add_argument('--verify-only', action='store_true',
+                        help="só compara origem e destino")
+    args = parser.parse_args()
+
+    logger.info(f"Migrando {args.source} para {args.to} "
+                f"({Config.REDIS_URL if args.to == 'redis' else Config.SQLITE_PATH})")
+    sys.exit(asyncio.run(migrate(args)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Registro de presença (último acesso) dos usuários
+"""
+
+import logging
+import time
+from typing import Dict, Optional
+
+from config.config import Config
+from services.redis_service import get_redis_service
+
+logger = logging.getLogger(__name__)
+
+class ActivityTracker:
+    """Acumula o último acesso de cada usuário e grava em lote
+
+    Cada update só atualiza um dicionário em memória; a cada
+    ACTIVITY_FLUSH_INTERVAL segundos os acessos acumulados vão para o
+    índice de presença com uma única escrita (record_activity), então um
+    usuário ativo gera no máximo uma gravação por intervalo.
+    """
+
+    def __init__(self, store=None, flush_interval: Optional[float] = None):
+        self._store = store
+        self.flush_interval = Config.ACTIVITY_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._pending: Dict[int, float] = {}
+        self._last_flush = time.monotonic()
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = get_redis_service()
+        return self._store
+
+    async def touch(self, user_id: int) -> None:
+        """Registra um acesso do usuário agora"""
+        self._pending[user_id] = time.time()
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Grava os acessos acumulados e retorna quantos usuários foram atualizados"""
+        pending, self._pending = self._pending, {}
+        self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+        try:
+            return await self.store.record_activity(pending)
+        except Exception as e:
+            logger.error(f"Erro ao gravar presença de {len(pending)} usuários: {e}")
+            # Devolver para a próxima gravação, sem sobrescrever acessos mais novos
+            for user_id, seen in pending.items():
+                if seen > self._pending.get(user_id, 0):
+                    self._pending[user_id] = seen
+            return 0
+
+# Instância global
+_activity_tracker = None
+
+def get_activity_tracker() -> ActivityTracker:
+    """Obtém a instância global do registro de presença"""
+    global _activity_tracker
+    if _activity_tracker is None:
+        _activity_tracker = ActivityTracker()
+    return _activity_tracker
@@ -0,0 +1,828 @@
+"""
+Serviço Redis assíncrono (redis.asyncio) com pool de conexões
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+import weakref
+from datetime import datetime
+from typing import Dict, Any, Optional, List, AsyncIterator, Iterable, Tuple
+
+import redis.asyncio as redis
+from redis.exceptions import WatchError
+
+from config.config import Config
+from services.cache import LRUCache
+from services.change_feed import CHANGES_CHANNEL, RedisChangeListener, encode_change, new_origin
+from services.expiry import payment_ttl
+from services.pipeline import SAVE_METHODS, StorePipeline
+from services.sales_ledger import sale_score, timestamp_score
+from utils.helpers import get_cache_key, get_bot_id, normalize_username, set_config_path
+
+logger = logging.getLogger(__name__)
+
+# Campos de um bot lidos antes de regravá-lo (índices e versão)
+BOT_INDEX_FIELDS = ['owner_id', 'username', 'version']
+
+# Incremento/anexação só acontecem se o usuário existir, como no serviço em arquivo
+INCREMENT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return false end
+return redis.call('HINCRBYFLOAT', KEYS[1], ARGV[1], ARGV[2])
+"""
+
+# Último acesso: campo last_activity do usuário e sorted set de presença
+ACTIVITY_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return false end
+redis.call('HSET', KEYS[1], 'last_activity', ARGV[2])
+return redis.call('ZADD', KEYS[2], ARGV[1], ARGV[3])
+"""
+
+# Próxima verificação de um pagamento, só se ainda estiver pendente (mantém o TTL)
+PAYMENT_CHECK_SCRIPT = """
+local raw = redis.call('GET', KEYS[1])
+if not raw then return false end
+local payment = cjson.decode(raw)
+if payment['status'] ~= 'pending' then return false end
+payment['next_check_at'] = tonumber(ARGV[1])
+payment['check_attempts'] = tonumber(ARGV[2])
+return redis.call('SET', KEYS[1], cjson.encode(payment), 'KEEPTTL')
+"""
+
+# Livro de vendas: dados em um hash por id e índices em sorted sets por tempo.
+# Com sale_key (ARGV[6]), uma venda já registrada com a mesma chave é ignorada;
+# o crédito (ARGV[7]) só vai para o saldo do usuário quando a venda é nova
+RECORD_SALE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return false end
+if ARGV[6] ~= '' and redis.call('HEXISTS', KEYS[9], ARGV[6]) == 1 then return false end
+local id = redis.call('INCR', KEYS[2])
+if ARGV[6] ~= '' then redis.call('HSET', KEYS[9], ARGV[6], id) end
+redis.call('HSET', KEYS[3], id, ARGV[1])
+redis.call('ZADD', KEYS[4], ARGV[2], id)
+redis.call('ZADD', KEYS[5], ARGV[2], id)
+if ARGV[5] == '1' then redis.call('ZADD', KEYS[6], ARGV[2], id) end
+redis.call('HINCRBYFLOAT', KEYS[7], ARGV[3], ARGV[4])
+redis.call('HINCRBYFLOAT', KEYS[8], 'revenue', ARGV[4])
+if tonumber(ARGV[7]) ~= 0 then redis.call('HINCRBYFLOAT', KEYS[1], 'balance', ARGV[7]) end
+return id
+"""
+
+class AsyncRedisService:
+    """Implementação Redis da mesma interface do RedisService
+
+    Usuários e bots são gravados como hashes (um campo JSON por chave do
+    dicionário); estados, códigos e pagamentos como strings JSON. As vendas
+    ficam em um livro separado (zenyx:ledger:*), fora do registro do usuário.
+    Estados, códigos e pagamentos pendentes expiram com o EXPIRE nativo.
+    O último acesso de cada usuário fica no sorted set zenyx:index:activity
+    (score = timestamp), consultado por faixa em get_active_users.
+    Leituras de bots passam por um cache LRU local (bot_cache); cada
+    gravação de bot é publicada em zenyx:channel:changes para que os outros
+    processos invalidem apenas aquele token.
+    """
+
+    def __init__(self, url: Optional[str] = None, max_connections: Optional[int] = None):
+        self.url = url or Config.REDIS_URL
+        self.max_connections = max_connections or Config.REDIS_MAX_CONNECTIONS
+        # Cada bot de usuário roda em uma thread com seu próprio event loop,
+        # e conexões asyncio não podem ser compartilhadas entre loops
+        self._pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, redis.ConnectionPool]" = weakref.WeakKeyDictionary()
+        self._pools_lock = threading.Lock()
+        self.bot_cache = LRUCache(Config.BOT_CACHE_SIZE, Config.BOT_CACHE_TTL)
+        self._origin = new_origin()
+        self._bot_indexes_ready = False
+        self._payment_indexes_ready = False
+        self._listener = None
+        if Config.CHANGE_NOTIFICATIONS:
+            self._listener = RedisChangeListener(self.url, self._origin, self._on_change)
+            self._listener.start()
+
+    def _on_change(self, namespace: Optional[str], key: Optional[str]) -> None:
+        """Alteração feita por outro processo"""
+        if namespace is None or namespace == 'bot':
+            self.bot_cache.invalidate(key)
+
+    def _client(self) -> redis.Redis:
+        """Retorna um cliente ligado ao pool do event loop atual"""
+        loop = asyncio.get_running_loop()
+        with self._pools_lock:
+            pool = self._pools.get(loop)
+            if pool is None:
+                pool = redis.ConnectionPool.from_url(
+                    self.url,
+                    max_connections=self.max_connections,
+                    decode_responses=True
+                )
+                self._pools[loop] = pool
+        return redis.Redis(connection_pool=pool)
+
+    async def close(self) -> None:
+        """Fecha o pool de conexões do event loop atual"""
+        if self._listener is not None:
+            self._listener.stop()
+        loop = asyncio.get_running_loop()
+        with self._pools_lock:
+            pool = self._pools.pop(loop, None)
+        if pool is not None:
+            await pool.disconnect()
+
+    async def ping(self) -> bool:
+        """Verifica conexão com o Redis"""
+        return bool(await self._client().ping())
+
+    async def get_platform_metrics(self) -> Dict[str, Any]:
+        """Obtém os contadores da plataforma (usuários, bots, vendas, receita)"""
+        # Apenas leituras O(1): cardinalidade dos índices e o contador de receita
+        async with self._client().pipeline(transaction=False) as pipe:
+            pipe.scard(get_cache_key('index', 'users'))
+            pipe.scard(get_cache_key('index', 'bots'))
+            pipe.zcard(get_cache_key('ledger', 'all'))
+            pipe.hget(get_cache_key('metrics', 'platform'), 'revenue')
+            pipe.hlen(get_cache_key('ledger', 'totals'))
+            users, bots, sales, revenue, paying_users = await pipe.execute()
+        return {
+            'users': users,
+            'bots': bots,
+            'sales': sales,
+            'revenue': float(revenue or 0),
+            'paying_users': paying_users
+        }
+
+    async def get_cache_stats(self) -> Dict[str, Any]:
+        """Obtém os contadores do cache de bots"""
+        return self.bot_cache.stats()
+
+    # Serialização
+    @staticmethod
+    def _encode_hash(data: Dict[str, Any]) -> Dict[str, str]:
+        return {field: json.dumps(value) for field, value in data.items()}
+
+    @staticmethod
+    def _decode_hash(raw: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        if not raw:
+            return None
+        return {field: json.loads(value) for field, value in raw.items()}
+
+    def _queue_replace_hash(self, pipe, key: str, index_key: str, member: str, data: Dict[str, Any],
+                            notify: Optional[str] = None) -> None:
+        """Enfileira a substituição de um hash inteiro, o registro da chave no
+        índice e, com `notify`, a publicação da alteração para os outros processos"""
+        pipe.delete(key)
+        if data:
+            pipe.hset(key, mapping=self._encode_hash(data))
+        pipe.sadd(index_key, member)
+        if notify and self._listener is not None:
+            pipe.publish(CHANGES_CHANNEL, encode_change(self._origin, notify, member))
+
+    async def _replace_hash(self, key: str, index_key: str, member: str, data: Dict[str, Any],
+                            notify: Optional[str] = None) -> None:
+        """Substitui um hash inteiro em uma transação"""
+        async with self._client().pipeline(transaction=True) as pipe:
+            self._queue_replace_hash(pipe, key, index_key, member, data, notify)
+            await pipe.execute()
+
+    # Índices de bots
+    @staticmethod
+    def _decode_fields(fields: List[str], raw: List[Optional[str]]) -> Dict[str, Any]:
+        return {field: json.loads(value) for field, value in zip(fields, raw) if value is not None}
+
+    async def _bot_index_fields(self, tokens: List[str]) -> List[Dict[str, Any]]:
+        """owner_id, username e version gravados de cada bot (vazio se não existe)"""
+        async with self._client().pipeline(transaction=False) as pipe:
+            for token in tokens:
+                pipe.hmget(get_cache_key('bot', token), BOT_INDEX_FIELDS)
+            results = await pipe.execute()
+        return [self._decode_fields(BOT_INDEX_FIELDS, raw) for raw in results]
+
+    def _queue_bot_indexes(self, pipe, token: str, data: Dict[str, Any], previous: Dict[str, Any]) -> None:
+        """Enfileira a atualização de id -> token, dono -> ids e username -> id"""
+        bot_id = get_bot_id(token)
+        if bot_id is None:
+            return
+        pipe.hset(get_cache_key('index', 'bot_ids'), str(bot_id), token)
+
+        owner_id, old_owner_id = data.get('owner_id'), previous.get('owner_id')
+        if old_owner_id is not None and old_owner_id != owner_id:
+            pipe.zrem(get_cache_key('index', f"owner_bots:{old_owner_id}"), str(bot_id))
+        if owner_id is not None:
+            # Score = momento do cadastro; NX mantém o da primeira gravação
+            pipe.zadd(get_cache_key('index', f"owner_bots:{owner_id}"), {str(bot_id): time.time()}, nx=True)
+
+        username = normalize_username(data.get('username'))
+        old_username = normalize_username(previous.get('username'))
+        if old_username and old_username != username:
+            pipe.hdel(get_cache_key('index', 'bot_usernames'), old_username)
+        if username:
+            pipe.hset(get_cache_key('index', 'bot_usernames'), username, str(bot_id))
+
+    async def _ensure_bot_indexes(self) -> None:
+        """Monta os índices a partir dos bots gravados, se ainda não existirem"""
+        if self._bot_indexes_ready:
+            return
+        client = self._client()
+        if not await client.exists(get_cache_key('meta', 'bot_indexes')):
+            cursor = 0
+            while True:
+                cursor, tokens = await client.sscan(get_cache_key('index', 'bots'), cursor, count=500)
+                if tokens:
+                    current = await self._bot_index_fields(tokens)
+                    async with client.pipeline(transaction=False) as pipe:
+                        for token, data in zip(tokens, current):
+                            if data:
+                                self._queue_bot_indexes(pipe, token, data, {})
+                        await pipe.execute()
+                if cursor == 0:
+                    break
+            await client.set(get_cache_key('meta', 'bot_indexes'), 1)
+        self._bot_indexes_ready = True
+
+    # Lotes
+    def pipeline(self) -> StorePipeline:
+        """Agrupa escritas em uma única transação (MULTI/EXEC)"""
+        return StorePipeline(self)
+
+    async def _execute_pipeline(self, ops: List[Tuple[str, tuple, Dict[str, Any]]]) -> List[Any]:
+        """Executa as operações de um StorePipeline em um round trip"""
+        client = self._client()
+        positions = []
+        bot_tokens = [args[0] for method, args, _ in ops if method == 'save_bot_data']
+        previous = dict(zip(bot_tokens, await self._bot_index_fields(bot_tokens))) if bot_tokens else {}
+        payment_names = [self._payment_name(*args[:2]) for method, args, _ in ops if method == 'save_payment_data']
+        payment_statuses = dict(zip(payment_names, await self._payment_statuses(payment_names)))
+        async with client.pipeline(transaction=True) as pipe:
+            for method, args, kwargs in ops:
+                if method == 'save_user_data':
+                    user_id, data = args
+                    self._queue_replace_hash(
+                        pipe,
+                        get_cache_key('user', str(user_id)),
+                        get_cache_key('index', 'users'),
+                        str(user_id),
+                        {k: v for k, v in data.items() if k != 'sales'}
+                    )
+                elif method == 'save_bot_data':
+                    token, data = args
+                    data['version'] = previous[token].get('version', 0) + 1
+                    self._queue_replace_hash(
+                        pipe,
+                        get_cache_key('bot', token),
+                        get_cache_key('index', 'bots'),
+                        token,
+                        data,
+                        notify='bot'
+                    )
+                    self._queue_bot_indexes(pipe, token, data, previous[token])
+                elif method == 'set_user_state':
+                    user_id, state = args
+                    ttl = kwargs.get('ttl')
+                    ttl = Config.STATE_TTL if ttl is None else ttl
+                    pipe.set(get_cache_key('state', str(user_id)), state, ex=ttl or None)
+                elif method == 'save_channel_code':
+                    code, data = args
+                    ttl = kwargs.get('ttl')
+                    ttl = Config.CHANNEL_CODE_TTL if ttl is None else ttl
+                    pipe.set(get_cache_key('code', code), json.dumps(data), ex=ttl or None)
+                elif method == 'save_payment_data':
+                    key, value, ttl = self._payment_entry(*args, **kwargs)
+                    pipe.set(key, value, ex=ttl)
+                    name = self._payment_name(*args[:2])
+                    self._queue_payment_indexes(pipe, name, args[1], payment_statuses[name])
+                elif method == 'add_user_sale':
+                    keys, script_args = self._sale_script_args(*args, **kwargs)
+                    await client.register_script(RECORD_SALE_SCRIPT)(keys=keys, args=script_args, client=pipe)
+                elif method == 'increment_user_stats':
+                    keys, script_args = self._increment_script_args(*args)
+                    await client.register_script(INCREMENT_SCRIPT)(keys=keys, args=script_args, client=pipe)
+                else:
+                    raise ValueError(f"Operação não suportada em lote: {method}")
+                positions.append(len(pipe.command_stack) - 1)
+            raw = await pipe.execute()
+
+        for token in bot_tokens:
+            self.bot_cache.invalidate(token)
+        return [
+            raw[position] is not None if method in ('add_user_sale', 'increment_user_stats') else True
+            for (method, _, _), position in zip(ops, positions)
+        ]
+
+    async def get_many(self, namespace: str, keys: Iterable) -> Dict[Any, Optional[Dict[str, Any]]]:
+        """Lê vários usuários ('users') ou bots ('bots') em um round trip"""
+        if namespace not in SAVE_METHODS:
+            raise ValueError(f"Namespace não suportado: {namespace}")
+        keys = list(keys)
+        prefix = 'user' if namespace == 'users' else 'bot'
+        async with self._client().pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.hgetall(get_cache_key(prefix, str(key)))
+            results = await pipe.execute()
+        return {key: self._decode_hash(raw) for key, raw in zip(keys, results)}
+
+    async def save_many(self, namespace: str, items: Dict[Any, Dict[str, Any]]) -> bool:
+        """Grava vários usuários ('users') ou bots ('bots') em uma transação"""
+        if namespace not in SAVE_METHODS:
+            raise ValueError(f"Namespace não suportado: {namespace}")
+        async with self.pipeline() as pipe:
+            for key, data in items.items():
+                getattr(pipe, SAVE_METHODS[namespace])(key, data)
+        return True
+
+    # Usuários
+    async def get_user_data(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Obtém dados do usuário"""
+        raw = await self._client().hgetall(get_cache_key('user', str(user_id)))
+        return self._decode_hash(raw)
+
+    async def save_user_data(self, user_id: int, data: Dict[str, Any]) -> bool:
+        """Salva dados do usuário"""
+        # Vendas são gravadas somente no livro de vendas (add_user_sale)
+        record = {k: v for k, v in data.items() if k != 'sales'}
+        await self._replace_hash(
+            get_cache_key('user', str(user_id)),
+            get_cache_key('index', 'users'),
+            str(user_id),
+            record
+        )
+        return True
+
+    async def get_all_users(self) -> Dict[int, Dict[str, Any]]:
+        """Obtém todos os usuários"""
+        client = self._client()
+        user_ids = await client.smembers(get_cache_key('index', 'users'))
+        if not user_ids:
+            return {}
+
+        async with client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.hgetall(get_cache_key('user', user_id))
+            results = await pipe.execute()
+
+        users = {}
+        for user_id, raw in zip(user_ids, results):
+            data = self._decode_hash(raw)
+            if data is not None:
+                users[int(user_id)] = data
+        return users
+
+    async def iter_users(self, page_size: int = 500,
+                         fields: Optional[Iterable[str]] = None) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """Percorre os usuários em páginas (SSCAN), com projeção opcional de campos
+
+        Como no SSCAN, um usuário adicionado ou removido durante a varredura
+        pode ou não aparecer, e um mesmo id pode ser retornado mais de uma vez.
+        """
+        fields = list(fields) if fields else None
+        client = self._client()
+        cursor = 0
+        while True:
+            cursor, user_ids = await client.sscan(get_cache_key('index', 'users'), cursor, count=page_size)
+            if user_ids:
+                async with client.pipeline(transaction=False) as pipe:
+                    for user_id in user_ids:
+                        key = get_cache_key('user', user_id)
+                        if fields:
+                            pipe.hmget(key, fields)
+                        else:
+                            pipe.hgetall(key)
+                    results = await pipe.execute()
+
+                for user_id, raw in zip(user_ids, results):
+                    if fields:
+                        raw = {field: value for field, value in zip(fields, raw) if value is not None}
+                        user_data = self._decode_hash(raw) or {}
+                    else:
+                        user_data = self._decode_hash(raw)
+                        if user_data is None:
+                            continue
+                    yield int(user_id), user_data
+            if cursor == 0:
+                return
+
+    async def record_activity(self, last_seen: Dict[int, float]) -> int:
+        """Grava o último acesso (timestamp) de vários usuários em um round trip"""
+        if not last_seen:
+            return 0
+        client = self._client()
+        script = client.register_script(ACTIVITY_SCRIPT)
+        async with client.pipeline(transaction=False) as pipe:
+            for user_id, seen in last_seen.items():
+                await script(
+                    keys=[get_cache_key('user', str(user_id)), get_cache_key('index', 'activity')],
+                    args=[seen, json.dumps(datetime.fromtimestamp(seen).isoformat()), str(user_id)],
+                    client=pipe
+                )
+            results = await pipe.execute()
+        return sum(1 for result in results if result is not None)
+
+    async def get_active_users(self, minutes: int = 5) -> List[Dict[str, Any]]:
+        """Obtém usuários ativos nos últimos X minutos, do mais recente ao mais antigo"""
+        client = self._client()
+        user_ids = await client.zrevrangebyscore(
+            get_cache_key('index', 'activity'), '+inf', time.time() - minutes * 60
+        )
+        if not user_ids:
+            return []
+
+        async with client.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.hgetall(get_cache_key('user', user_id))
+            results = await pipe.execute()
+        return [data for data in map(self._decode_hash, results) if data is not None]
+
+    async def add_user_sale(self, user_id: int, sale_data: Dict[str, Any], credit: float = 0.0) -> bool:
+        """Registra uma venda do usuário no livro de vendas
+
+        `credit` vai para o saldo do usuário no mesmo script, só se a venda
+        foi registrada.
+        """
+        keys, args = self._sale_script_args(user_id, sale_data, credit)
+        script = self._client().register_script(RECORD_SALE_SCRIPT)
+        result = await script(keys=keys, args=args)
+        return result is not None
+
+    @staticmethod
+    def _sale_script_args(user_id: int, sale_data: Dict[str, Any],
+                          credit: float = 0.0) -> Tuple[List[str], List[Any]]:
+        """Chaves e argumentos de RECORD_SALE_SCRIPT"""
+        sale_data = dict(sale_data, owner_id=sale_data.get('owner_id', user_id))
+        bot_token = sale_data.get('bot_token') or ''
+        return (
+            [
+                get_cache_key('user', str(user_id)),
+                get_cache_key('ledger', 'seq'),
+                get_cache_key('ledger', 'data'),
+                get_cache_key('ledger', 'all'),
+                get_cache_key('ledger', f"owner:{user_id}"),
+                get_cache_key('ledger', f"bot:{bot_token}"),
+                get_cache_key('ledger', 'totals'),
+                get_cache_key('metrics', 'platform'),
+                get_cache_key('ledger', 'keys')
+            ],
+            [
+                json.dumps(sale_data),
+                sale_score(sale_data),
+                str(user_id),
+                float(sale_data.get('amount', 0) or 0),
+                '1' if bot_token else '0',
+                sale_data.get('sale_key') or '',
+                float(credit or 0)
+            ]
+        )
+
+    async def get_sales(self, owner_id: Optional[int] = None, bot_token: Optional[str] = None,
+                        start: Optional[datetime] = None, end: Optional[datetime] = None,
+                        limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Obtém vendas em ordem cronológica, filtradas por dono, bot e período"""
+        if bot_token is not None:
+            index_key = get_cache_key('ledger', f"bot:{bot_token}")
+        elif owner_id is not None:
+            index_key = get_cache_key('ledger', f"owner:{owner_id}")
+        else:
+            index_key = get_cache_key('ledger', 'all')
+
+        client = self._client()
+        sale_ids = await client.zrangebyscore(
+            index_key,
+            start.timestamp() if start else '-inf',
+            end.timestamp() if end else '+inf',
+            start=0 if limit and bot_token is None else None,
+            num=limit if limit and bot_token is None else None
+        )
+        if not sale_ids:
+            return []
+
+        sales = []
+        for raw in await client.hmget(get_cache_key('ledger', 'data'), sale_ids):
+            if raw is None:
+                continue
+            sale_data = json.loads(raw)
+            if owner_id is not None and sale_data.get('owner_id') != owner_id:
+                continue
+            sales.append(sale_data)
+            if limit and len(sales) >= limit:
+                break
+        return sales
+
+    async def get_sales_totals(self) -> Dict[int, float]:
+        """Obtém o total vendido por dono de bot"""
+        totals = await self._client().hgetall(get_cache_key('ledger', 'totals'))
+        return {int(owner_id): float(total) for owner_id, total in totals.items()}
+
+    async def increment_user_stats(self, user_id: int, field: str, amount: float = 1.0) -> bool:
+        """Incrementa estatísticas do usuário"""
+        keys, args = self._increment_script_args(user_id, field, amount)
+        script = self._client().register_script(INCREMENT_SCRIPT)
+        result = await script(keys=keys, args=args)
+        return result is not None
+
+    @staticmethod
+    def _increment_script_args(user_id: int, field: str, amount: float = 1.0) -> Tuple[List[str], List[Any]]:
+        """Chaves e argumentos de INCREMENT_SCRIPT"""
+        return [get_cache_key('user', str(user_id))], [field, amount]
+
+    # Bots
+    async def get_bot_data(self, token: str) -> Optional[Dict[str, Any]]:
+        """Obtém dados do bot"""
+        data = self.bot_cache.get(token)
+        if data is not None:
+            return data
+
+        generation = self.bot_cache.generation()
+        data = self._decode_hash(await self._client().hgetall(get_cache_key('bot', token)))
+        if data is not None:
+            self.bot_cache.set(token, data, generation)
+        return data
+
+    async def save_bot_data(self, token: str, data: Dict[str, Any],
+                            expected_version: Optional[int] = None) -> bool:
+        """Salva dados do bot e atualiza os índices na mesma transação
+
+        data['version'] é incrementada; com expected_version, só grava se a
+        versão atual for essa (compare-and-set com WATCH)
+        """
+        key = get_cache_key('bot', token)
+        saved = False
+        async with self._client().pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    previous = self._decode_fields(BOT_INDEX_FIELDS, await pipe.hmget(key, BOT_INDEX_FIELDS))
+                    version = previous.get('version', 0)
+                    if expected_version is not None and version != expected_version:
+                        break
+                    data['version'] = version + 1
+                    pipe.multi()
+                    self._queue_replace_hash(pipe, key, get_cache_key('index', 'bots'), token, data, notify='bot')
+                    self._queue_bot_indexes(pipe, token, data, previous)
+                    await pipe.execute()
+                    saved = True
+                    break
+                except WatchError:
+                    # Outro cliente gravou o bot entre a leitura e o EXEC
+                    continue
+        # Depois da escrita (ou de um conflito, que indica cache desatualizado):
+        # leituras iniciadas antes não repovoam o cache
+        self.bot_cache.invalidate(token)
+        return saved
+
+    async def update_bot_config(self, token: str, path: str, value: Any,
+                                expected_version: Optional[int] = None) -> bool:
+        """Altera um campo de config (path 'plans' ou 'a.b') regravando só config e version"""
+        return await self.update_bot_config_many(token, {path: value}, expected_version)
+
+    async def update_bot_config_many(self, token: str, values: Dict[str, Any],
+                                     expected_version: Optional[int] = None) -> bool:
+        """Altera vários campos de config ({path: valor}) com um só incremento de versão"""
+        key = get_cache_key('bot', token)
+        saved = False
+        async with self._client().pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    if not await pipe.exists(key):
+                        break
+                    current = self._decode_fields(['config', 'version'], await pipe.hmget(key, ['config', 'version']))
+                    version = current.get('version', 0)
+                    if expected_version is not None and version != expected_version:
+                        break
+                    config = current.get('config')
+                    for path, value in values.items():
+                        config = set_config_path(config, path, value)
+                    pipe.multi()
+                    pipe.hset(key, mapping=self._encode_hash({'config': config, 'version': version + 1}))
+                    if self._listener is not None:
+                        pipe.publish(CHANGES_CHANNEL, encode_change(self._origin, 'bot', token))
+                    await pipe.execute()
+                    saved = True
+                    break
+                except WatchError:
+                    continue
+        self.bot_cache.invalidate(token)
+        return saved
+
+    async def get_bot_by_token(self, token: str) -> Optional[Dict[str, Any]]:
+        """Busca bot pelo token"""
+        return await self.get_bot_data(token)
+
+    async def get_all_bots(self) -> Dict[str, Dict[str, Any]]:
+        """Obtém todos os bots"""
+        client = self._client()
+        tokens = await client.smembers(get_cache_key('index', 'bots'))
+        if not tokens:
+            return {}
+
+        async with client.pipeline(transaction=False) as pipe:
+            for token in tokens:
+                pipe.hgetall(get_cache_key('bot', token))
+            results = await pipe.execute()
+
+        bots = {}
+        for token, raw in zip(tokens, results):
+            data = self._decode_hash(raw)
+            if data is not None:
+                bots[token] = data
+        return bots
+
+    async def get_bot_token_by_id(self, bot_id: int) -> Optional[str]:
+        """Busca o token de um bot pelo id numérico"""
+        await self._ensure_bot_indexes()
+        return await self._client().hget(get_cache_key('index', 'bot_ids'), str(bot_id))
+
+    async def get_bot_id_by_username(self, username: str) -> Optional[int]:
+        """Busca o id de um bot pelo username (com ou sem '@')"""
+        await self._ensure_bot_indexes()
+        bot_id = await self._client().hget(get_cache_key('index', 'bot_usernames'), normalize_username(username))
+        return int(bot_id) if bot_id else None
+
+    async def get_owner_bot_ids(self, owner_id: int) -> List[int]:
+        """Ids dos bots de um dono, em ordem de cadastro"""
+        await self._ensure_bot_indexes()
+        bot_ids = await self._client().zrange(get_cache_key('index', f"owner_bots:{owner_id}"), 0, -1)
+        return [int(bot_id) for bot_id in bot_ids]
+
+    async def get_owner_bots(self, owner_id: int) -> Dict[str, Dict[str, Any]]:
+        """Bots de um dono (token -> dados)"""
+        bot_ids = await self.get_owner_bot_ids(owner_id)
+        if not bot_ids:
+            return {}
+        tokens = await self._client().hmget(get_cache_key('index', 'bot_ids'), [str(bot_id) for bot_id in bot_ids])
+        bots = await self.get_many('bots', [token for token in tokens if token])
+        return {token: data for token, data in bots.items() if data is not None}
+    # Estados
+    async def get_user_state(self, user_id: int) -> Optional[str]:
+        """Obtém estado do usuário"""
+        return await self._client().get(get_cache_key('state', str(user_id)))
+
+    async def set_user_state(self, user_id: int, state: str, ttl: Optional[int] = None) -> bool:
+        """Define estado do usuário (expira em STATE_TTL por padrão)"""
+        ttl = Config.STATE_TTL if ttl is None else ttl
+        await self._client().set(get_cache_key('state', str(user_id)), state, ex=ttl or None)
+        return True
+
+    async def clear_user_state(self, user_id: int) -> bool:
+        """Limpa estado do usuário"""
+        await self._client().delete(get_cache_key('state', str(user_id)))
+        return True
+
+    # Códigos de canal
+    async def get_channel_code(self, code: str) -> Optional[Dict[str, Any]]:
+        """Obtém código de canal"""
+        raw = await self._client().get(get_cache_key('code', code))
+        return json.loads(raw) if raw else None
+
+    async def save_channel_code(self, code: str, data: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """Salva código de canal (expira em CHANNEL_CODE_TTL por padrão)"""
+        ttl = Config.CHANNEL_CODE_TTL if ttl is None else ttl
+        await self._client().set(get_cache_key('code', code), json.dumps(data), ex=ttl or None)
+        return True
+
+    async def delete_channel_code(self, code: str) -> bool:
+        """Remove código de canal"""
+        await self._client().delete(get_cache_key('code', code))
+        return True
+
+    # Pagamentos
+    async def get_payment_data(self, user_id: int, payment_id: str) -> Optional[Dict[str, Any]]:
+        """Obtém dados de pagamento"""
+        raw = await self._client().get(get_cache_key('payment', f"{user_id}:{payment_id}"))
+        return json.loads(raw) if raw else None
+
+    async def save_payment_data(self, user_id: int, payment_data: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """Salva dados de pagamento (pendentes expiram em PENDING_PAYMENT_TTL)"""
+        key, value, ttl = self._payment_entry(user_id, payment_data, ttl)
+        name = self._payment_name(user_id, payment_data)
+        old_status = (await self._payment_statuses([name]))[0]
+        async with self._client().pipeline(transaction=True) as pipe:
+            pipe.set(key, value, ex=ttl)
+            self._queue_payment_indexes(pipe, name, payment_data, old_status)
+            await pipe.execute()
+        return True
+
+    @staticmethod
+    def _payment_name(user_id: int, payment_data: Dict[str, Any]) -> str:
+        """Identificador "user_id:payment_id" usado na chave e nos índices"""
+        return f"{user_id}:{payment_data.get('payment_id', '')}"
+
+    async def _payment_statuses(self, names: List[str]) -> List[Optional[str]]:
+        """Status indexado de cada pagamento (None se ainda não existe)"""
+        if not names:
+            return []
+        return await self._client().hmget(get_cache_key('index', 'payment_status'), names)
+
+    def _queue_payment_indexes(self, pipe, name: str, payment_data: Dict[str, Any],
+                               old_status: Optional[str]) -> None:
+        """Enfileira payment_id -> pagamento e a troca de status (sorted set por created_at)"""
+        status = payment_data.get('status')
+        pipe.hset(get_cache_key('index', 'payment_ids'), payment_data.get('payment_id', ''), name)
+        if old_status and old_status != status:
+            pipe.zrem(get_cache_key('index', f"payments:{old_status}"), name)
+        if status:
+            pipe.zadd(
+                get_cache_key('index', f"payments:{status}"),
+                {name: timestamp_score(payment_data.get('created_at'))}
+            )
+            pipe.hset(get_cache_key('index', 'payment_status'), name, status)
+
+    async def _prune_payments(self, names: List[str]) -> None:
+        """Remove dos índices pagamentos cujo registro já expirou (TTL)"""
+        statuses = await self._payment_statuses(names)
+        async with self._client().pipeline(transaction=False) as pipe:
+            for name, status in zip(names, statuses):
+                if status:
+                    pipe.zrem(get_cache_key('index', f"payments:{status}"), name)
+                pipe.hdel(get_cache_key('index', 'payment_status'), name)
+                pipe.hdel(get_cache_key('index', 'payment_ids'), name.split(':', 1)[1])
+            await pipe.execute()
+
+    async def _ensure_payment_indexes(self) -> None:
+        """Indexa os pagamentos gravados antes dos índices existirem"""
+        if self._payment_indexes_ready:
+            return
+        client = self._client()
+        if not await client.exists(get_cache_key('meta', 'payment_indexes')):
+            prefix = get_cache_key('payment', '')
+            cursor = 0
+            while True:
+                cursor, keys = await client.scan(cursor, match=f"{prefix}*", count=500)
+                if keys:
+                    raws = await client.mget(keys)
+                    async with client.pipeline(transaction=False) as pipe:
+                        for key, raw in zip(keys, raws):
+                            if raw is not None:
+                                self._queue_payment_indexes(pipe, key[len(prefix):], json.loads(raw), None)
+                        await pipe.execute()
+                if cursor == 0:
+                    break
+            await client.set(get_cache_key('meta', 'payment_indexes'), 1)
+        self._payment_indexes_ready = True
+
+    async def get_payment_by_id(self, payment_id: str) -> Optional[Dict[str, Any]]:
+        """Busca um pagamento só pelo payment_id (webhooks e verificações em lote)"""
+        await self._ensure_payment_indexes()
+        client = self._client()
+        name = await client.hget(get_cache_key('index', 'payment_ids'), payment_id)
+        if not name:
+            return None
+        raw = await client.get(get_cache_key('payment', name))
+        if raw is None:
+            await self._prune_payments([name])
+            return None
+        return dict(json.loads(raw), user_id=int(name.split(':', 1)[0]))
+
+    async def get_payments_by_status(self, status: str, limit: Optional[int] = None,
+                                     created_before: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Pagamentos com um status, do mais antigo ao mais recente (created_at)"""
+        await self._ensure_payment_indexes()
+        client = self._client()
+        index_key = get_cache_key('index', f"payments:{status}")
+        high = f"({created_before.timestamp()}" if created_before else '+inf'
+        page_size = min(limit or 500, 500)
+        payments = []
+        offset = 0
+        while limit is None or len(payments) < limit:
+            names = await client.zrangebyscore(index_key, '-inf', high, start=offset, num=page_size)
+            if not names:
+                break
+            raws = await client.mget([get_cache_key('payment', name) for name in names])
+            expired = []
+            for name, raw in zip(names, raws):
+                if raw is None:
+                    expired.append(name)
+                else:
+                    payments.append(dict(json.loads(raw), user_id=int(name.split(':', 1)[0])))
+            if expired:
+                await self._prune_payments(expired)
+            # Os removidos deslocam os seguintes para trás
+            offset += len(names) - len(expired)
+            if len(names) < page_size:
+                break
+        return payments[:limit] if limit is not None else payments
+
+    async def record_payment_checks(self, checks: List[Dict[str, Any]]) -> int:
+        """Grava next_check_at/check_attempts dos pagamentos ainda pendentes em um round trip"""
+        if not checks:
+            return 0
+        client = self._client()
+        script = client.register_script(PAYMENT_CHECK_SCRIPT)
+        async with client.pipeline(transaction=False) as pipe:
+            for check in checks:
+                await script(
+                    keys=[get_cache_key('payment', f"{check['user_id']}:{check['payment_id']}")],
+                    args=[check['next_check_at'], check['attempts']],
+                    client=pipe
+                )
+            results = await pipe.execute()
+        return sum(1 for result in results if result is not None)
+
+    @staticmethod
+    def _payment_entry(user_id: int, payment_data: Dict[str, Any],
+                       ttl: Optional[int] = None) -> Tuple[str, str, Optional[int]]:
+        """Chave, valor e TTL do SET de um pagamento"""
+        payment_id = payment_data.get('payment_id', '')
+        # SET sem ex remove o TTL anterior, então um pagamento confirmado não expira
+        return (
+            get_cache_key('payment', f"{user_id}:{payment_id}"),
+            json.dumps(payment_data),
+            payment_ttl(payment_data, ttl) or None
+        )
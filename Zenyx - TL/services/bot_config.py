@@ -0,0 +1,45 @@
+"""
+Alterações concorrentes na configuração dos bots
+"""
+
+import logging
+from typing import Dict, Any, Optional, Callable
+
+from services.redis_service import get_redis_service
+
+logger = logging.getLogger(__name__)
+
+# Tentativas de compare-and-set antes de desistir
+CAS_RETRIES = 5
+
+def get_config_path(config: Optional[Dict[str, Any]], path: str) -> Any:
+    """Valor em `path` ('plans' ou 'a.b') de config, ou None"""
+    value = config or {}
+    for part in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+async def append_bot_config(token: str, path: str, item: Any,
+                            is_duplicate: Optional[Callable[[Any], bool]] = None) -> Optional[bool]:
+    """Anexa `item` à lista em config[path] sem perder anexações concorrentes
+
+    Lê o bot, monta a nova lista e grava com update_bot_config na versão
+    lida; se outro processo alterou o bot no meio, lê de novo e repete.
+    Retorna True se anexou, False se `is_duplicate` encontrou um item igual
+    e None se o bot não existe ou as tentativas se esgotaram.
+    """
+    redis_service = get_redis_service()
+    for _ in range(CAS_RETRIES):
+        bot_data = await redis_service.get_bot_data(token)
+        if not bot_data:
+            return None
+        items = list(get_config_path(bot_data.get('config'), path) or [])
+        if is_duplicate and any(is_duplicate(existing) for existing in items):
+            return False
+        items.append(item)
+        if await redis_service.update_bot_config(token, path, items, expected_version=bot_data.get('version', 0)):
+            return True
+    logger.warning(f"Conflito ao alterar {path} do bot {token[:10]}...")
+    return None
@@ -0,0 +1,98 @@
+"""
+Notificação de alterações entre processos (main.py e user_bot_main.py)
+"""
+
+import json
+import logging
+import threading
+import uuid
+from typing import Callable, Optional
+
+import redis
+
+from config.config import Config
+from utils.helpers import get_cache_key
+
+logger = logging.getLogger(__name__)
+
+CHANGES_CHANNEL = get_cache_key('channel', 'changes')
+
+def new_origin() -> str:
+    """Identificador do processo, para ignorar as próprias notificações"""
+    return uuid.uuid4().hex
+
+def encode_change(origin: str, namespace: str, key: str) -> str:
+    return json.dumps({'origin': origin, 'ns': namespace, 'key': key})
+
+class PollingWatcher:
+    """Executa `poll` periodicamente em uma thread daemon"""
+
+    def __init__(self, poll: Callable[[], None], interval: Optional[float] = None):
+        self.poll = poll
+        self.interval = interval or Config.CHANGE_POLL_INTERVAL
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Erro ao verificar alterações externas: {e}")
+
+class RedisChangeListener:
+    """Assina o canal de alterações e repassa as de outros processos
+
+    `on_change(namespace, key)` é chamado a cada alteração; com
+    namespace e key None após uma reconexão, quando mensagens podem ter
+    sido perdidas e tudo deve ser invalidado.
+    """
+
+    def __init__(self, url: str, origin: str, on_change: Callable[[Optional[str], Optional[str]], None]):
+        self.url = url
+        self.origin = origin
+        self.on_change = on_change
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _client(self) -> redis.Redis:
+        return redis.Redis.from_url(self.url, decode_responses=True)
+
+    def _run(self):
+        delay = 1.0
+        connected_before = False
+        while not self._stop.is_set():
+            try:
+                pubsub = self._client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANGES_CHANNEL)
+                if connected_before:
+                    self.on_change(None, None)
+                connected_before = True
+                delay = 1.0
+
+                while not self._stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is None:
+                        continue
+                    change = json.loads(message['data'])
+                    if change.get('origin') != self.origin:
+                        self.on_change(change.get('ns'), change.get('key'))
+                pubsub.close()
+            except Exception as e:
+                logger.warning(f"Canal de alterações indisponível, nova tentativa em {delay:.0f}s: {e}")
+                self._stop.wait(delay)
+                delay = min(delay * 2, 30.0)
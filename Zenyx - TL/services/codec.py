@@ -0,0 +1,64 @@
+"""
+Serialização dos dados persistidos em arquivo
+
+JSON usa a biblioteca mais rápida disponível (orjson, ujson ou json) e é
+gravado sem indentação; msgpack é opcional para snapshots binários.
+"""
+
+import json
+import logging
+from typing import Any
+
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+def json_dumps(obj: Any) -> str:
+    """Serializa em JSON compacto"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    if ujson is not None:
+        return ujson.dumps(obj, ensure_ascii=False)
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+def json_loads(raw) -> Any:
+    """Desserializa JSON (str ou bytes)"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    if ujson is not None:
+        return ujson.loads(raw)
+    return json.loads(raw)
+
+def dumps(obj: Any, fmt: str = None) -> bytes:
+    """Serializa um snapshot no formato configurado (json ou msgpack)"""
+    fmt = fmt or Config.FILE_STORE_FORMAT
+    if fmt == 'msgpack':
+        if msgpack is not None:
+            return msgpack.packb(obj, use_bin_type=True)
+        logger.warning("msgpack não instalado, gravando snapshot em JSON")
+    return json_dumps(obj).encode('utf-8')
+
+def loads(raw: bytes) -> Any:
+    """Desserializa um snapshot detectando o formato pelo conteúdo"""
+    # Documento JSON começa com '{' (após espaços); mapa msgpack nunca
+    stripped = raw.lstrip()
+    if not stripped or stripped[:1] in (b'{', b'['):
+        return json_loads(stripped or b'{}')
+    if msgpack is None:
+        raise ValueError("Snapshot em msgpack, mas msgpack não está instalado")
+    return msgpack.unpackb(raw, raw=False, strict_map_key=False)
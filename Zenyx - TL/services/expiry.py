@@ -0,0 +1,58 @@
+"""
+Suporte a expiração (TTL) de estados, códigos de canal e pagamentos
+"""
+
+import logging
+import threading
+from typing import Dict, Any, Optional, Callable
+
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+def payment_ttl(payment_data: Dict[str, Any], ttl: Optional[int] = None) -> Optional[int]:
+    """TTL de um pagamento: só pagamentos pendentes expiram por padrão"""
+    if ttl is not None:
+        return ttl
+    if payment_data.get('status') == 'pending':
+        return Config.PENDING_PAYMENT_TTL
+    return None
+
+class ExpirySweeper:
+    """Executa a limpeza de chaves expiradas em intervalos regulares"""
+
+    def __init__(self, sweep: Callable[[], int], interval: Optional[float] = None):
+        self.sweep = sweep
+        self.interval = interval or Config.EXPIRY_SWEEP_INTERVAL
+        self._lock = threading.Lock()
+        self._timer = None
+        self._running = False
+
+    def start(self):
+        with self._lock:
+            self._running = True
+            self._schedule()
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _schedule(self):
+        self._timer = threading.Timer(self.interval, self._run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run(self):
+        try:
+            removed = self.sweep()
+            if removed:
+                logger.info(f"{removed} chaves expiradas removidas")
+        except Exception as e:
+            logger.error(f"Erro ao remover chaves expiradas: {e}")
+
+        with self._lock:
+            if self._running:
+                self._schedule()
@@ -0,0 +1,505 @@
+"""
+Migração dos dados em arquivo (bot_data.json ou shards) para Redis/SQLite
+"""
+
+import json
+import logging
+import os
+import re
+import time
+import zlib
+from typing import Dict, Any, Optional, List, Iterator, Tuple
+
+from services import codec
+
+logger = logging.getLogger(__name__)
+
+# Namespaces gravados no destino, na ordem em que são lidos dos shards
+NAMESPACES = ('users', 'bots', 'states', 'codes', 'payments')
+
+# Namespaces cujos registros podem ter vencimento em 'expires'
+EXPIRING_NAMESPACES = ('states', 'codes', 'payments')
+
+_WHITESPACE = re.compile(r'\s*')
+_DELIMITERS = ' \t\r\n,:}]'
+
+Record = Tuple[str, str, Any]
+
+class _JSONStream:
+    """Leitor incremental de um documento JSON usando raw_decode
+
+    Só o trecho ainda não consumido fica em memória, então cada valor é
+    decodificado sem carregar o arquivo inteiro.
+    """
+
+    def __init__(self, f, chunk_size: int):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Próximo caractere que não é espaço"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Fim inesperado do arquivo")
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Esperado '{char}', encontrado '{found}'")
+        self.pos += 1
+
+    def separator(self) -> bool:
+        """Consome ',' ou '}'; retorna True se o objeto terminou"""
+        found = self.peek()
+        if found not in ',}':
+            raise ValueError(f"Esperado ',' ou '}}', encontrado '{found}'")
+        self.pos += 1
+        return found == '}'
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # Um número cortado no fim do bloco ('1' de '1.5') também é
+                # decodificado; só aceita o valor se vier um delimitador depois
+                if (end < len(self.buffer) and self.buffer[end] in _DELIMITERS) or \
+                        (end == len(self.buffer) and self.eof):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+def iter_json_file(path: str, chunk_size: int = 1 << 20) -> Iterator[Record]:
+    """Percorre um arquivo {namespace: {chave: valor}} registro a registro"""
+    with open(path, 'rb') as f:
+        head = f.read(64).lstrip()
+    if head[:1] != b'{':
+        # Snapshot em msgpack não tem leitura incremental
+        logger.warning(f"{path} não está em JSON, carregando o arquivo inteiro")
+        with open(path, 'rb') as f:
+            data = codec.loads(f.read())
+        for namespace, items in data.items():
+            for key, value in items.items():
+                yield namespace, key, value
+        return
+
+    with open(path, 'r', encoding='utf-8') as f:
+        stream = _JSONStream(f, chunk_size)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+        while True:
+            namespace = stream.value()
+            stream.expect(':')
+            if stream.peek() != '{':
+                logger.warning(f"Namespace '{namespace}' ignorado: não é um objeto")
+                stream.value()
+            else:
+                stream.expect('{')
+                if stream.peek() == '}':
+                    stream.pos += 1
+                else:
+                    while True:
+                        key = stream.value()
+                        stream.expect(':')
+                        yield namespace, key, stream.value()
+                        if stream.separator():
+                            break
+            if stream.separator():
+                return
+
+def iter_shards(data_dir: str) -> Iterator[Record]:
+    """Percorre os shards do serviço em arquivo, um shard por vez
+
+    'expires' vem primeiro, para que os vencimentos sejam conhecidos antes
+    dos registros a que se referem.
+    """
+    journal_file = f"{data_dir}.json.journal"
+    if os.path.exists(journal_file) and os.path.getsize(journal_file):
+        raise ValueError(
+            f"{journal_file} tem alterações não compactadas; inicie o serviço "
+            f"em arquivo uma vez com FILE_STORE_MODE=snapshot antes de migrar"
+        )
+    with open(os.path.join(data_dir, 'manifest.json'), 'rb') as f:
+        shard_count = codec.json_loads(f.read())['shards']
+
+    namespaces = sorted(
+        name for name in os.listdir(data_dir)
+        if os.path.isdir(os.path.join(data_dir, name))
+    )
+    namespaces.sort(key=lambda name: name != 'expires')
+    for namespace in namespaces:
+        for bucket in range(shard_count):
+            path = os.path.join(data_dir, namespace, f"{bucket:03d}")
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                shard = codec.loads(f.read())
+            for key, value in shard.items():
+                yield namespace, key, value
+
+def iter_sales(path: str) -> Iterator[Record]:
+    """Percorre o livro de vendas do serviço em arquivo"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            try:
+                sale_data = codec.json_loads(line)
+            except ValueError:
+                logger.warning(f"Venda inválida ignorada na linha {line_number}")
+                continue
+            yield 'sales', str(line_number), sale_data
+
+def iter_source(source: str) -> Iterator[Record]:
+    """Registros de bot_data.json ou, se já convertido, dos shards e do livro de vendas"""
+    data_dir = os.path.splitext(source)[0] if source.endswith('.json') else source
+    if os.path.isfile(source):
+        yield from iter_json_file(source)
+    elif os.path.exists(os.path.join(data_dir, 'manifest.json')):
+        yield from iter_shards(data_dir)
+        yield from iter_sales(data_dir + '.sales.jsonl')
+    else:
+        raise FileNotFoundError(f"Nada para migrar em {source}")
+
+def migrated_sale_key(owner_id: int, ordinal: Any) -> str:
+    """Chave estável de uma venda migrada (dono e posição na origem)
+
+    Com ela o destino ignora a venda se a migração for repetida (--restart
+    ou queda entre o lote e o checkpoint).
+    """
+    return f"migration:{owner_id}:{ordinal}"
+
+def record_checksum(namespace: str, key: str, value: Any) -> int:
+    """CRC32 de um registro em forma canônica"""
+    if namespace == 'bots' and isinstance(value, dict):
+        # A versão é do destino: cada gravação de bot a incrementa
+        value = {field: item for field, item in value.items() if field != 'version'}
+    raw = json.dumps([namespace, key, value], sort_keys=True, separators=(',', ':'))
+    return zlib.crc32(raw.encode('utf-8'))
+
+class StoreMigrator:
+    """Copia os registros da origem para o serviço de destino em lotes
+
+    Cada lote é gravado em um pipeline do destino (MULTI/EXEC no Redis, uma
+    transação no SQLite) e só depois a posição é salva no checkpoint; uma
+    migração interrompida continua do último lote gravado.
+
+    Vencimentos só são aplicados quando 'expires' aparece antes dos
+    registros (sempre nos shards); sem vencimento, vale o TTL padrão do
+    destino. Vendas são gravadas com o sale_key da origem ou, sem ele, com
+    migrated_sale_key, então repetir um lote não as duplica.
+    """
+
+    def __init__(self, store, source: str, batch_size: int = 1000,
+                 checkpoint_file: Optional[str] = None):
+        self.store = store
+        self.source = source
+        self.batch_size = batch_size
+        self.checkpoint_file = checkpoint_file or f"{source}.migration.json"
+        self._expires: Dict[str, float] = {}
+
+    # Checkpoint
+    def _source_files(self) -> List[str]:
+        """Arquivos lidos pela migração (bot_data.json ou shards e livro de vendas)"""
+        if os.path.isfile(self.source):
+            return [self.source]
+        data_dir = os.path.splitext(self.source)[0] if self.source.endswith('.json') else self.source
+        files = []
+        for root, _, names in os.walk(data_dir):
+            files.extend(os.path.join(root, name) for name in names if not name.endswith('.tmp'))
+        if os.path.exists(data_dir + '.sales.jsonl'):
+            files.append(data_dir + '.sales.jsonl')
+        return sorted(files)
+
+    def _source_signature(self) -> List[Any]:
+        """Caminho, quantidade de arquivos e CRC32 de tamanho/mtime de cada um
+
+        Os arquivos são verificados um a um: regravar um shard não altera o
+        mtime do diretório.
+        """
+        files = self._source_files()
+        stats = []
+        for path in files:
+            stat = os.stat(path)
+            stats.append([os.path.relpath(path), stat.st_size, stat.st_mtime_ns])
+        raw = json.dumps(stats, separators=(',', ':'))
+        return [os.path.abspath(self.source), len(files), zlib.crc32(raw.encode('utf-8'))]
+
+    def load_checkpoint(self) -> Dict[str, Any]:
+        """Checkpoint da migração em andamento (vazio se não houver)"""
+        if not os.path.exists(self.checkpoint_file):
+            return {}
+        with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('source') != self._source_signature():
+            raise ValueError(
+                f"A origem mudou desde o checkpoint {self.checkpoint_file}; "
+                f"use --restart para migrar do início"
+            )
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint: Dict[str, Any]):
+        tmp_file = f"{self.checkpoint_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def reset(self):
+        """Descarta o checkpoint para migrar do início"""
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+    # Registros
+    def _prepare(self, namespace: str, key: str, value: Any, now: float) -> Optional[Tuple[Any, Optional[int]]]:
+        """Valor a gravar e TTL restante; None se o registro não é migrado"""
+        if namespace == 'users' and isinstance(value, dict):
+            # Vendas antigas dentro do usuário vão para o livro de vendas
+            value = {k: v for k, v in value.items() if k != 'sales'}
+        elif namespace == 'payments':
+            value = dict(value, payment_id=value.get('payment_id') or key.split(':', 1)[1])
+
+        ttl = None
+        if namespace in EXPIRING_NAMESPACES:
+            expires_at = self._expires.get(f"{namespace}:{key}")
+            if expires_at is not None:
+                ttl = int(expires_at - now)
+                if ttl <= 0:
+                    return None
+        return value, ttl
+
+    def _queue(self, pipe, namespace: str, key: str, raw: Any, value: Any, ttl: Optional[int]):
+        """Enfileira as escritas de um registro"""
+        if namespace == 'users':
+            user_id = int(key)
+            pipe.save_user_data(user_id, value)
+            for ordinal, sale_data in enumerate(raw.get('sales') or []):
+                pipe.add_user_sale(user_id, self._sale(user_id, f"user{ordinal}", sale_data))
+        elif namespace == 'bots':
+            pipe.save_bot_data(key, value)
+        elif namespace == 'states':
+            pipe.set_user_state(int(key), value, ttl=ttl)
+        elif namespace == 'codes':
+            pipe.save_channel_code(key, value, ttl=ttl)
+        elif namespace == 'payments':
+            pipe.save_payment_data(int(key.split(':', 1)[0]), value, ttl=ttl)
+        elif namespace == 'sales':
+            owner_id = int(value['owner_id'])
+            pipe.add_user_sale(owner_id, self._sale(owner_id, key, value))
+
+    @staticmethod
+    def _sale(owner_id: int, ordinal: Any, sale_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Venda como gravada no destino, com dono e chave (a da origem, se houver)"""
+        return dict(
+            sale_data,
+            owner_id=sale_data.get('owner_id', owner_id),
+            sale_key=sale_data.get('sale_key') or migrated_sale_key(owner_id, ordinal)
+        )
+
+    @staticmethod
+    def _source_sales(namespace: str, key: str, value: Any) -> List[Tuple[int, Dict[str, Any]]]:
+        """(dono, venda) de um registro da origem (livro ou lista antiga do usuário)"""
+        if namespace == 'sales':
+            return [(int(value['owner_id']), value)]
+        if namespace == 'users' and isinstance(value, dict):
+            return [(int(key), sale_data) for sale_data in value.get('sales') or []]
+        return []
+
+    async def _read_back(self, records: List[Tuple[str, str, Any]]) -> List[Any]:
+        """Lê do destino os registros de um lote, na mesma ordem"""
+        values = []
+        users = await self.store.get_many('users', [int(key) for ns, key, _ in records if ns == 'users'])
+        bots = await self.store.get_many('bots', [key for ns, key, _ in records if ns == 'bots'])
+        for namespace, key, _ in records:
+            if namespace == 'users':
+                values.append(users.get(int(key)))
+            elif namespace == 'bots':
+                values.append(bots.get(key))
+            elif namespace == 'states':
+                values.append(await self.store.get_user_state(int(key)))
+            elif namespace == 'codes':
+                values.append(await self.store.get_channel_code(key))
+            elif namespace == 'payments':
+                user_id, payment_id = key.split(':', 1)
+                values.append(await self.store.get_payment_data(int(user_id), payment_id))
+        return values
+
+    def _records(self) -> Iterator[Tuple[int, str, str, Any]]:
+        """Registros da origem numerados; 'expires' só alimenta os vencimentos"""
+        for position, (namespace, key, value) in enumerate(iter_source(self.source)):
+            if namespace == 'expires':
+                self._expires[key] = value
+                continue
+            if namespace not in NAMESPACES and namespace != 'sales':
+                continue
+            yield position, namespace, key, value
+
+    # Migração
+    async def run(self) -> Dict[str, Any]:
+        """Migra a partir do último checkpoint e retorna os contadores"""
+        checkpoint = self.load_checkpoint() or {
+            'source': self._source_signature(),
+            'position': 0,
+            'counts': {},
+            'checksums': {},
+            'skipped': 0,
+            'done': False
+        }
+        if checkpoint['done']:
+            logger.info("Migração já concluída segundo o checkpoint")
+            return checkpoint
+
+        counts, checksums = checkpoint['counts'], checkpoint['checksums']
+        resume_from = checkpoint['position']
+        if resume_from:
+            logger.info(f"Retomando a migração na posição {resume_from}")
+
+        started = time.monotonic()
+        written = 0
+        batch: List[Tuple[int, str, str, Any, Any, Optional[int]]] = []
+
+        async def flush():
+            nonlocal written
+            async with self.store.pipeline() as pipe:
+                for _, namespace, key, raw, value, ttl in batch:
+                    self._queue(pipe, namespace, key, raw, value, ttl)
+            for _, namespace, key, raw, value, ttl in batch:
+                counts[namespace] = counts.get(namespace, 0) + 1
+                if namespace == 'users' and raw.get('sales'):
+                    counts['sales'] = counts.get('sales', 0) + len(raw['sales'])
+                if namespace != 'sales':
+                    checksums[namespace] = (checksums.get(namespace, 0) + record_checksum(namespace, key, value)) & 0xffffffff
+            checkpoint['position'] = batch[-1][0] + 1
+            self._save_checkpoint(checkpoint)
+            written += len(batch)
+            elapsed = time.monotonic() - started
+            logger.info(f"{checkpoint['position']} registros lidos, {written} gravados ({written / elapsed:.0f}/s)")
+            batch.clear()
+
+        now = time.time()
+        for position, namespace, key, value in self._records():
+            if position < resume_from:
+                continue
+            prepared = self._prepare(namespace, key, value, now)
+            if prepared is None:
+                checkpoint['skipped'] += 1
+                continue
+            batch.append((position, namespace, key, value, *prepared))
+            if len(batch) >= self.batch_size:
+                await flush()
+        if batch:
+            await flush()
+
+        checkpoint['done'] = True
+        self._save_checkpoint(checkpoint)
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Migração concluída: {written} registros em {elapsed:.1f}s "
+            f"({written / elapsed if elapsed else 0:.0f}/s), {checkpoint['skipped']} expirados ignorados"
+        )
+        return checkpoint
+
+    async def verify(self) -> Dict[str, Dict[str, Any]]:
+        """Relê cada registro no destino e compara contagens e checksums
+
+        Vendas não têm chave de leitura no destino: são comparados a
+        quantidade, a receita e o total de cada dono.
+        """
+        report: Dict[str, Dict[str, Any]] = {}
+        batch: List[Tuple[str, str, Any]] = []
+        sales_count = 0
+        owner_totals: Dict[int, float] = {}
+
+        async def compare():
+            targets = await self._read_back(batch)
+            for (namespace, key, value), target in zip(batch, targets):
+                entry = report.setdefault(namespace, {
+                    'source': 0, 'target': 0, 'source_checksum': 0, 'target_checksum': 0, 'mismatches': []
+                })
+                entry['source'] += 1
+                entry['source_checksum'] = (entry['source_checksum'] + record_checksum(namespace, key, value)) & 0xffffffff
+                if target is None:
+                    entry['mismatches'].append(key)
+                    continue
+                entry['target'] += 1
+                checksum = record_checksum(namespace, key, target)
+                entry['target_checksum'] = (entry['target_checksum'] + checksum) & 0xffffffff
+                if checksum != record_checksum(namespace, key, value):
+                    entry['mismatches'].append(key)
+            batch.clear()
+
+        now = time.time()
+        for _, namespace, key, value in self._records():
+            for owner_id, sale_data in self._source_sales(namespace, key, value):
+                owner_totals[owner_id] = owner_totals.get(owner_id, 0.0) + float(sale_data.get('amount', 0) or 0)
+                sales_count += 1
+            if namespace == 'sales':
+                continue
+            prepared = self._prepare(namespace, key, value, now)
+            if prepared is None:
+                continue
+            batch.append((namespace, key, prepared[0]))
+            if len(batch) >= self.batch_size:
+                await compare()
+        if batch:
+            await compare()
+
+        for namespace, entry in report.items():
+            status = 'OK' if not entry['mismatches'] else f"{len(entry['mismatches'])} divergentes"
+            logger.info(
+                f"{namespace}: origem {entry['source']} / destino {entry['target']}, "
+                f"checksum {entry['source_checksum']:08x} / {entry['target_checksum']:08x} - {status}"
+            )
+
+        if sales_count:
+            report['sales'] = await self._compare_sales(sales_count, owner_totals)
+        return report
+
+    async def _compare_sales(self, source_count: int, owner_totals: Dict[int, float]) -> Dict[str, Any]:
+        """Compara quantidade, receita e total por dono das vendas"""
+        metrics = await self.store.get_platform_metrics()
+        target_totals = await self.store.get_sales_totals()
+        entry = {
+            'source': source_count,
+            'target': int(metrics.get('sales', 0)),
+            'source_revenue': round(sum(owner_totals.values()), 2),
+            'target_revenue': round(float(metrics.get('revenue', 0) or 0), 2),
+            'mismatches': []
+        }
+        if entry['source'] != entry['target']:
+            entry['mismatches'].append('count')
+        if entry['source_revenue'] != entry['target_revenue']:
+            entry['mismatches'].append('revenue')
+        for owner_id in sorted(set(owner_totals) | set(target_totals)):
+            source_total = round(owner_totals.get(owner_id, 0.0), 2)
+            target_total = round(float(target_totals.get(owner_id) or 0), 2)
+            if source_total != target_total:
+                entry['mismatches'].append(str(owner_id))
+
+        status = 'OK' if not entry['mismatches'] else f"divergências: {', '.join(entry['mismatches'][:10])}"
+        logger.info(
+            f"sales: origem {entry['source']} / destino {entry['target']}, "
+            f"receita {entry['source_revenue']:.2f} / {entry['target_revenue']:.2f} - {status}"
+        )
+        return entry
@@ -0,0 +1,258 @@
+"""
+Agendador único das verificações de pagamentos pendentes
+"""
+
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Dict, Any, Optional, Callable, Awaitable, List, Tuple
+
+from config.config import Config
+from services.payment_service import close_http_session
+from services.redis_service import get_redis_service
+
+logger = logging.getLogger(__name__)
+
+class PaymentPoller:
+    """Verifica todos os pagamentos pendentes do processo em um só event loop
+
+    Em vez de uma task por compra, os pagamentos ficam em um min-heap
+    ordenado pela próxima verificação. O intervalo começa em
+    PAYMENT_POLL_INITIAL_INTERVAL e cresce por PAYMENT_POLL_BACKOFF até
+    PAYMENT_POLL_MAX_INTERVAL; cada token PushinPay tem no máximo
+    PAYMENT_POLL_MAX_INFLIGHT_PER_TOKEN verificações em andamento, e
+    pagamentos mais velhos que PAYMENT_POLL_TIMEOUT são descartados.
+
+    `check(payment_id, user_id)` retorna True quando o pagamento não precisa
+    mais ser verificado (confirmado, cancelado ou removido).
+
+    A próxima verificação de cada pagamento é gravada no próprio pagamento
+    (next_check_at/check_attempts, em lote a cada volta do agendador), e
+    `restore` retoma os pendentes depois de um reinício.
+    """
+
+    def __init__(self, check: Callable[[str, int], Awaitable[bool]], store=None):
+        self.check = check
+        self._store = store
+        self.initial_interval = Config.PAYMENT_POLL_INITIAL_INTERVAL
+        self.max_interval = Config.PAYMENT_POLL_MAX_INTERVAL
+        self.backoff = Config.PAYMENT_POLL_BACKOFF
+        self.max_inflight = Config.PAYMENT_POLL_MAX_INFLIGHT_PER_TOKEN
+        self.timeout = Config.PAYMENT_POLL_TIMEOUT
+        self.recovery_batch = Config.PAYMENT_RECOVERY_BATCH
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[float, int, str]] = []
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._inflight: Dict[str, int] = {}
+        self._waiting: Dict[str, List[Dict[str, Any]]] = {}
+        # Agendamentos ainda não gravados no store
+        self._unsaved: Dict[str, Dict[str, Any]] = {}
+        self._counter = itertools.count()
+        self._thread = None
+        self._loop = None
+        self._wakeup = None
+        self._stopping = False
+        self._ready = threading.Event()
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = get_redis_service()
+        return self._store
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='payment-poller', daemon=True)
+            self._thread.start()
+        self._ready.wait(timeout=10)
+
+    def stop(self):
+        """Encerra o event loop do agendador (grava os agendamentos pendentes antes)"""
+        if self._stopping:
+            return
+        self._stopping = True
+        self._wake()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def submit(self, coro: Awaitable[Any]) -> concurrent.futures.Future:
+        """Executa uma corrotina no event loop do agendador (de qualquer thread)"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def _run(self):
+        try:
+            asyncio.run(self._serve())
+        except Exception as e:
+            logger.error(f"Erro no agendador de pagamentos: {e}")
+
+    def _interval(self, attempts: int) -> float:
+        return min(self.max_interval, self.initial_interval * self.backoff ** attempts)
+
+    def _push(self, entry: Dict[str, Any]):
+        heapq.heappush(self._heap, (entry['next_check_at'], next(self._counter), entry['payment_id']))
+
+    def _wake(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def add(self, payment_id: str, user_id: int, merchant_token: str,
+            created_at: Optional[float] = None, next_check_at: Optional[float] = None,
+            attempts: int = 0) -> None:
+        """Passa a verificar um pagamento (de qualquer thread)"""
+        now = time.time()
+        entry = {
+            'payment_id': payment_id,
+            'user_id': user_id,
+            'token': merchant_token,
+            'created_at': created_at or now,
+            'attempts': attempts,
+            'next_check_at': next_check_at or now + self._interval(attempts)
+        }
+        with self._lock:
+            self._entries[payment_id] = entry
+            self._unsaved[payment_id] = entry
+            self._push(entry)
+        self.start()
+        self._wake()
+
+    def restore(self, entries: List[Dict[str, Any]]) -> int:
+        """Retoma pagamentos gravados antes de um reinício
+
+        Cada entrada tem payment_id, user_id, token, created_at, next_check_at
+        e attempts. As verificações atrasadas são escalonadas em lotes de
+        PAYMENT_RECOVERY_BATCH a cada PAYMENT_POLL_INITIAL_INTERVAL, para que
+        a retomada não dispare todas de uma vez.
+        """
+        now = time.time()
+        overdue = 0
+        restored = 0
+        with self._lock:
+            for entry in sorted(entries, key=lambda entry: entry.get('next_check_at') or 0):
+                if entry['payment_id'] in self._entries or now - entry['created_at'] >= self.timeout:
+                    continue
+                entry = dict(entry, attempts=entry.get('attempts') or 0)
+                if not entry.get('next_check_at') or entry['next_check_at'] <= now:
+                    entry['next_check_at'] = now + (overdue // self.recovery_batch) * self.initial_interval
+                    overdue += 1
+                self._entries[entry['payment_id']] = entry
+                self._push(entry)
+                restored += 1
+        if restored:
+            self.start()
+            self._wake()
+        return restored
+
+    def discard(self, payment_id: str) -> bool:
+        """Para de verificar um pagamento (confirmado pelo webhook, por exemplo)"""
+        with self._lock:
+            # A entrada no heap é ignorada quando chegar ao topo
+            self._unsaved.pop(payment_id, None)
+            return self._entries.pop(payment_id, None) is not None
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def _due(self, now: float) -> Tuple[List[Dict[str, Any]], Optional[float]]:
+        """Retira do heap as verificações vencidas que cabem no limite por token"""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, payment_id = heapq.heappop(self._heap)
+                entry = self._entries.get(payment_id)
+                if entry is None or entry['next_check_at'] > now or entry.get('state'):
+                    continue
+                if now - entry['created_at'] >= self.timeout:
+                    del self._entries[payment_id]
+                    self._unsaved.pop(payment_id, None)
+                    logger.info(f"Pagamento {payment_id} expirado, verificação encerrada")
+                    continue
+                token = entry['token']
+                if self._inflight.get(token, 0) >= self.max_inflight:
+                    # Espera uma verificação do mesmo token terminar
+                    entry['state'] = 'waiting'
+                    self._waiting.setdefault(token, []).append(entry)
+                    continue
+                self._inflight[token] = self._inflight.get(token, 0) + 1
+                entry['state'] = 'running'
+                due.append(entry)
+            next_at = self._heap[0][0] if self._heap else None
+        return due, next_at
+
+    async def _check(self, entry: Dict[str, Any]):
+        done = False
+        try:
+            done = await self.check(entry['payment_id'], entry['user_id'])
+        except Exception as e:
+            logger.error(f"Erro ao verificar pagamento {entry['payment_id']}: {e}")
+        finally:
+            with self._lock:
+                token = entry['token']
+                self._inflight[token] -= 1
+                if not self._inflight[token]:
+                    del self._inflight[token]
+                for waiting in self._waiting.pop(token, []):
+                    waiting['state'] = None
+                    self._push(waiting)
+                entry['state'] = None
+                if self._entries.get(entry['payment_id']) is entry:
+                    if done:
+                        del self._entries[entry['payment_id']]
+                        self._unsaved.pop(entry['payment_id'], None)
+                    else:
+                        entry['attempts'] += 1
+                        entry['next_check_at'] = time.time() + self._interval(entry['attempts'])
+                        self._unsaved[entry['payment_id']] = entry
+                        self._push(entry)
+            self._wakeup.set()
+
+    async def _save_schedule(self):
+        """Grava a próxima verificação dos pagamentos reagendados desde a última volta"""
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, {}
+            checks = [
+                {key: entry[key] for key in ('payment_id', 'user_id', 'next_check_at', 'attempts')}
+                for entry in unsaved.values()
+            ]
+        if not checks:
+            return
+        try:
+            await self.store.record_payment_checks(checks)
+        except Exception as e:
+            logger.error(f"Erro ao gravar agendamento de {len(checks)} pagamentos: {e}")
+            # Tentar de novo na próxima volta, sem sobrescrever agendamentos mais novos
+            with self._lock:
+                for payment_id, entry in unsaved.items():
+                    if self._entries.get(payment_id) is entry:
+                        self._unsaved.setdefault(payment_id, entry)
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._ready.set()
+        try:
+            while not self._stopping:
+                self._wakeup.clear()
+                due, next_at = self._due(time.time())
+                for entry in due:
+                    asyncio.create_task(self._check(entry))
+                if self._unsaved:
+                    await self._save_schedule()
+                timeout = None if next_at is None else max(0.0, next_at - time.time())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            # Reagendamentos da última volta ficam gravados para a retomada
+            if self._unsaved:
+                await self._save_schedule()
+        finally:
+            # Fecha as conexões HTTP abertas pelas verificações neste loop
+            await close_http_session()
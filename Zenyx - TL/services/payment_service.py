@@ -2,29 +2,100 @@
 Serviço de pagamentos PushinPay
 """
 
+import asyncio
 import logging
-import requests
 import json
 import base64
-from typing import Dict, Any, Optional
+import threading
+import time
+import weakref
+from typing import Dict, Any, Optional, Tuple
 from datetime import datetime
 
+import aiohttp
+
 from config.config import Config
 from utils.helpers import log_error
 
 logger = logging.getLogger(__name__)
 
+# Uma sessão por event loop: cada bot de usuário roda em uma thread com seu
+# próprio loop, e sessões aiohttp não podem ser compartilhadas entre loops
+_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = weakref.WeakKeyDictionary()
+_sessions_lock = threading.Lock()
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Sessão HTTP do event loop atual (keep-alive, limite de conexões e timeout)"""
+    loop = asyncio.get_running_loop()
+    with _sessions_lock:
+        session = _sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=Config.PUSHINPAY_MAX_CONNECTIONS,
+                    keepalive_timeout=Config.PUSHINPAY_KEEPALIVE
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    total=Config.PUSHINPAY_TIMEOUT,
+                    connect=Config.PUSHINPAY_CONNECT_TIMEOUT
+                )
+            )
+            _sessions[loop] = session
+    return session
+
+async def close_http_session() -> None:
+    """Fecha a sessão HTTP do event loop atual"""
+    with _sessions_lock:
+        session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
 class PaymentService:
-    """Serviço para integração com PushinPay"""
+    """Serviço para integração com PushinPay
+
+    As requisições são feitas com aiohttp na sessão compartilhada do event
+    loop (get_http_session), então uma resposta lenta não bloqueia os
+    outros bots e as conexões são reaproveitadas entre chamadas.
+
+    Cada instância usa um token PushinPay e limita as próprias requisições
+    simultâneas (max_concurrency, por event loop). Use get_payment_client
+    para obter a instância compartilhada de um token.
+    """
     
-    def __init__(self):
+    def __init__(self, token: Optional[str] = None, max_concurrency: Optional[int] = None):
         self.base_url = "https://api.pushinpay.com.br"
-        self.token = Config.PUSHINPAY_TOKEN
+        self.token = token or Config.PUSHINPAY_TOKEN
         self.headers = {
             'Authorization': f'Bearer {self.token}',
             'Content-Type': 'application/json',
             'Accept': 'application/json'
         }
+        self.max_concurrency = max_concurrency or Config.PUSHINPAY_MAX_CONCURRENCY_PER_TOKEN
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+    
+    def _semaphore(self) -> asyncio.Semaphore:
+        """Limite de requisições simultâneas deste token no event loop atual"""
+        loop = asyncio.get_running_loop()
+        with _sessions_lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+    
+    async def _request(self, method: str, path: str,
+                       payload: Optional[Dict[str, Any]] = None) -> Tuple[int, str]:
+        """Executa uma requisição na API e retorna (status, corpo)"""
+        try:
+            async with self._semaphore(), get_http_session().request(
+                method,
+                f"{self.base_url}{path}",
+                headers=self.headers,
+                json=payload
+            ) as response:
+                return response.status, await response.text()
+        except asyncio.TimeoutError:
+            # TimeoutError não tem mensagem; os métodos devolvem str(e) em 'error'
+            raise aiohttp.ServerTimeoutError(f"Tempo esgotado em {method} {path}")
     
     async def create_pix_payment(self, amount: float, webhook_url: Optional[str] = None) -> Dict[str, Any]:
         """Cria um pagamento PIX com QR Code"""
@@ -36,15 +107,10 @@ class PaymentService:
             if webhook_url:
                 payload['webhook_url'] = webhook_url
             
-            response = requests.post(
-                f"{self.base_url}/api/pix/cashIn",
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
+            status_code, text = await self._request('POST', '/api/pix/cashIn', payload)
             
-            if response.status_code == 200:
-                result = response.json()
+            if status_code == 200:
+                result = json.loads(text)
                 return {
                     'success': True,
                     'payment_id': result.get('id'),
@@ -53,11 +119,11 @@ class PaymentService:
                     'status': result.get('status')
                 }
             else:
-                logger.error(f"Payment creation failed: {response.status_code} - {response.text}")
+                logger.error(f"Payment creation failed: {status_code} - {text}")
                 return {
                     'success': False,
-                    'error': f"Erro ao criar pagamento: {response.status_code}",
-                    'details': response.text
+                    'error': f"Erro ao criar pagamento: {status_code}",
+                    'details': text
                 }
                 
         except Exception as e:
@@ -70,14 +136,10 @@ class PaymentService:
     async def check_payment_status(self, payment_id: str) -> Dict[str, Any]:
         """Verifica status de um pagamento"""
         try:
-            response = requests.get(
-                f"{self.base_url}/api/transactions/{payment_id}",
-                headers=self.headers,
-                timeout=30
-            )
+            status_code, text = await self._request('GET', f"/api/transactions/{payment_id}")
             
-            if response.status_code == 200:
-                result = response.json()
+            if status_code == 200:
+                result = json.loads(text)
                 return {
                     'success': True,
                     'payment_id': result.get('id'),
@@ -87,8 +149,8 @@ class PaymentService:
             else:
                 return {
                     'success': False,
-                    'error': f"Erro ao verificar pagamento: {response.status_code}",
-                    'details': response.text
+                    'error': f"Erro ao verificar pagamento: {status_code}",
+                    'details': text
                 }
                 
         except Exception as e:
@@ -110,15 +172,10 @@ class PaymentService:
             if webhook_url:
                 payload['webhook_url'] = webhook_url
             
-            response = requests.post(
-                f"{self.base_url}/api/pix/cashOut",
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
+            status_code, text = await self._request('POST', '/api/pix/cashOut', payload)
             
-            if response.status_code == 200:
-                result = response.json()
+            if status_code == 200:
+                result = json.loads(text)
                 return {
                     'success': True,
                     'transfer_id': result.get('id'),
@@ -128,8 +185,8 @@ class PaymentService:
             else:
                 return {
                     'success': False,
-                    'error': f"Erro ao criar transferência: {response.status_code}",
-                    'details': response.text
+                    'error': f"Erro ao criar transferência: {status_code}",
+                    'details': text
                 }
                 
         except Exception as e:
@@ -142,14 +199,10 @@ class PaymentService:
     async def check_transfer_status(self, transfer_id: str) -> Dict[str, Any]:
         """Verifica status de uma transferência"""
         try:
-            response = requests.get(
-                f"{self.base_url}/api/transfers/{transfer_id}",
-                headers=self.headers,
-                timeout=30
-            )
+            status_code, text = await self._request('GET', f"/api/transfers/{transfer_id}")
             
-            if response.status_code == 200:
-                result = response.json()
+            if status_code == 200:
+                result = json.loads(text)
                 return {
                     'success': True,
                     'transfer_id': result.get('id'),
@@ -161,8 +214,8 @@ class PaymentService:
             else:
                 return {
                     'success': False,
-                    'error': f"Erro ao verificar transferência: {response.status_code}",
-                    'details': response.text
+                    'error': f"Erro ao verificar transferência: {status_code}",
+                    'details': text
                 }
                 
         except Exception as e:
@@ -175,22 +228,18 @@ class PaymentService:
     async def refund_transaction(self, transaction_id: str) -> Dict[str, Any]:
         """Realiza estorno de uma transação"""
         try:
-            response = requests.post(
-                f"{self.base_url}/api/transactions/{transaction_id}/refund",
-                headers=self.headers,
-                timeout=30
-            )
+            status_code, text = await self._request('POST', f"/api/transactions/{transaction_id}/refund")
             
-            if response.status_code == 200:
+            if status_code == 200:
                 return {
                     'success': True,
                     'message': 'Transação sendo processada para estorno'
                 }
             else:
-                error_data = response.json() if response.text else {}
+                error_data = json.loads(text) if text else {}
                 return {
                     'success': False,
-                    'error': error_data.get('error', f"Erro ao estornar: {response.status_code}")
+                    'error': error_data.get('error', f"Erro ao estornar: {status_code}")
                 }
                 
         except Exception as e:
@@ -267,4 +316,60 @@ class PaymentService:
             
         except Exception as e:
             log_error(e, {'method': 'process_withdrawal', 'user_id': user_id, 'amount': amount})
-            return False
\ No newline at end of file
+            return False
+
+class PaymentClientRegistry:
+    """Um PaymentService por token PushinPay, compartilhado pelos bots do processo
+
+    Clientes sem uso há mais de `idle_ttl` segundos são descartados na
+    próxima consulta ao registro (as conexões ficam na sessão do event
+    loop, então descartar um cliente não fecha nada).
+    """
+
+    def __init__(self, idle_ttl: Optional[float] = None):
+        self.idle_ttl = Config.PUSHINPAY_CLIENT_IDLE_TTL if idle_ttl is None else idle_ttl
+        self._clients: Dict[str, Tuple[PaymentService, float]] = {}
+        self._lock = threading.Lock()
+        self._last_eviction = time.monotonic()
+
+    def get(self, token: str) -> PaymentService:
+        """Cliente do token, criado no primeiro uso"""
+        if not token:
+            # Sem token, o cliente usaria as credenciais da plataforma
+            raise ValueError("Token PushinPay não informado")
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_eviction >= self.idle_ttl:
+                self._evict_idle(now)
+            entry = self._clients.get(token)
+            client = entry[0] if entry else PaymentService(token)
+            self._clients[token] = (client, now)
+        return client
+
+    def _evict_idle(self, now: float) -> int:
+        idle = [token for token, (_, last_used) in self._clients.items() if now - last_used >= self.idle_ttl]
+        for token in idle:
+            del self._clients[token]
+        self._last_eviction = now
+        return len(idle)
+
+    def evict_idle(self) -> int:
+        """Descarta os clientes ociosos e retorna quantos foram removidos"""
+        with self._lock:
+            return self._evict_idle(time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+# Instância global
+_payment_clients = None
+_payment_clients_lock = threading.Lock()
+
+def get_payment_client(token: str) -> PaymentService:
+    """PaymentService compartilhado de um token PushinPay (ValueError se vazio)"""
+    global _payment_clients
+    if _payment_clients is None:
+        with _payment_clients_lock:
+            if _payment_clients is None:
+                _payment_clients = PaymentClientRegistry()
+    return _payment_clients.get(token)
@@ -0,0 +1,102 @@
+"""
+Receptor dos webhooks de pagamento da PushinPay
+"""
+
+import asyncio
+import hmac
+import logging
+import threading
+from typing import Dict, Any, Optional, Callable, Awaitable
+from urllib.parse import urlencode
+
+from aiohttp import web
+
+from config.config import Config
+from services.payment_service import close_http_session
+
+logger = logging.getLogger(__name__)
+
+def payment_webhook_url() -> Optional[str]:
+    """URL pública enviada à PushinPay em cada cobrança (None sem PUSHINPAY_WEBHOOK_URL)"""
+    if not Config.PUSHINPAY_WEBHOOK_URL:
+        return None
+    url = Config.PUSHINPAY_WEBHOOK_URL.rstrip('/') + Config.PUSHINPAY_WEBHOOK_PATH
+    if Config.PUSHINPAY_WEBHOOK_SECRET:
+        url += '?' + urlencode({'secret': Config.PUSHINPAY_WEBHOOK_SECRET})
+    return url
+
+class PaymentWebhookServer:
+    """Servidor aiohttp dos webhooks, em uma thread com event loop próprio
+
+    Cada POST em PUSHINPAY_WEBHOOK_PATH é repassado a `on_payment` com os
+    dados da transação (id, status, value). Se `on_payment` falhar, a
+    resposta é 500 para que a PushinPay reenvie a notificação.
+    """
+
+    def __init__(self, on_payment: Callable[[Dict[str, Any]], Awaitable[Any]],
+                 host: Optional[str] = None, port: Optional[int] = None):
+        self.on_payment = on_payment
+        self.host = host or Config.WEBHOOK_HOST
+        self.port = port or Config.WEBHOOK_PORT
+        self.path = Config.PUSHINPAY_WEBHOOK_PATH
+        self.secret = Config.PUSHINPAY_WEBHOOK_SECRET
+        self._thread = None
+        self._loop = None
+        self._stopped = None
+        self._ready = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='payment-webhook', daemon=True)
+        self._thread.start()
+        self._ready.wait(timeout=10)
+
+    def stop(self):
+        if self._loop is not None and self._stopped is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        try:
+            asyncio.run(self._serve())
+        except Exception as e:
+            logger.error(f"Erro no servidor de webhooks: {e}")
+        finally:
+            self._ready.set()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.host, self.port).start()
+            logger.info(f"Webhooks da PushinPay em http://{self.host}:{self.port}{self.path}")
+            self._ready.set()
+            await self._stopped.wait()
+        finally:
+            await runner.cleanup()
+            # Fecha as conexões HTTP abertas pelas confirmações neste loop
+            await close_http_session()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Valida o segredo, lê a transação e executa a confirmação"""
+        if self.secret and not hmac.compare_digest(request.query.get('secret', ''), self.secret):
+            return web.Response(status=403)
+
+        # A PushinPay envia formulário; JSON também é aceito
+        if request.content_type == 'application/json':
+            data = await request.json()
+        else:
+            data = dict(await request.post())
+        if not isinstance(data, dict) or not data.get('id'):
+            return web.Response(status=400)
+
+        try:
+            await self.on_payment(data)
+        except Exception as e:
+            logger.error(f"Erro ao processar webhook do pagamento {data.get('id')}: {e}")
+            return web.Response(status=500)
+        return web.Response(text='ok')
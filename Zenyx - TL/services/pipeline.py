@@ -0,0 +1,71 @@
+"""
+Escritas em lote no serviço de persistência
+"""
+
+from typing import Dict, Any, Optional, List, Tuple
+
+# Namespace aceito por get_many/save_many -> método de escrita individual
+SAVE_METHODS = {
+    'users': 'save_user_data',
+    'bots': 'save_bot_data'
+}
+
+class StorePipeline:
+    """Acumula escritas e as executa juntas ao sair do bloco
+
+        async with redis_service.pipeline() as pipe:
+            pipe.save_payment_data(user_id, payment_data)
+            pipe.add_user_sale(owner_id, sale_data)
+
+    Cada backend executa o lote da forma mais barata que tiver (MULTI/EXEC
+    no Redis, uma transação no SQLite, uma gravação no arquivo). Depois do
+    bloco, `results` tem o retorno de cada operação, na ordem.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._ops: List[Tuple[str, tuple, Dict[str, Any]]] = []
+        self.results: List[Any] = []
+
+    def _queue(self, method: str, *args, **kwargs) -> 'StorePipeline':
+        self._ops.append((method, args, kwargs))
+        return self
+
+    def save_user_data(self, user_id: int, data: Dict[str, Any]) -> 'StorePipeline':
+        return self._queue('save_user_data', user_id, data)
+
+    def save_bot_data(self, token: str, data: Dict[str, Any]) -> 'StorePipeline':
+        return self._queue('save_bot_data', token, data)
+
+    def set_user_state(self, user_id: int, state: str, ttl: Optional[int] = None) -> 'StorePipeline':
+        return self._queue('set_user_state', user_id, state, ttl=ttl)
+
+    def save_channel_code(self, code: str, data: Dict[str, Any],
+                          ttl: Optional[int] = None) -> 'StorePipeline':
+        return self._queue('save_channel_code', code, data, ttl=ttl)
+
+    def save_payment_data(self, user_id: int, payment_data: Dict[str, Any],
+                          ttl: Optional[int] = None) -> 'StorePipeline':
+        return self._queue('save_payment_data', user_id, payment_data, ttl=ttl)
+
+    def add_user_sale(self, user_id: int, sale_data: Dict[str, Any],
+                      credit: float = 0.0) -> 'StorePipeline':
+        return self._queue('add_user_sale', user_id, sale_data, credit=credit)
+
+    def increment_user_stats(self, user_id: int, field: str, amount: float = 1.0) -> 'StorePipeline':
+        return self._queue('increment_user_stats', user_id, field, amount)
+
+    async def execute(self) -> List[Any]:
+        """Executa as operações acumuladas"""
+        ops, self._ops = self._ops, []
+        if ops:
+            self.results = await self._store._execute_pipeline(ops)
+        return self.results
+
+    async def __aenter__(self) -> 'StorePipeline':
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        # Em caso de erro dentro do bloco, nada é gravado
+        if exc_type is None:
+            await self.execute()
@@ -2,158 +2,976 @@
 Serviço Redis simplificado para testes
 """
 
-import json
+import asyncio
+import atexit
+import heapq
+import logging
 import os
-from typing import Dict, Any, Optional, List
+import threading
+import time
+import zlib
+from typing import Dict, Any, Optional, List, AsyncIterator, Iterable, Set, Tuple
 from datetime import datetime
 
+from config.config import Config
+from services import codec
+from services.change_feed import PollingWatcher
+from services.expiry import ExpirySweeper, payment_ttl
+from services.pipeline import SAVE_METHODS, StorePipeline
+from services.sales_ledger import SalesLedger, timestamp_score
+from utils.helpers import get_bot_id, normalize_username, set_config_path
+
+logger = logging.getLogger(__name__)
+
 class RedisService:
-    """Serviço simplificado para testes"""
-    
-    def __init__(self):
-        self.data_file = "data/bot_data.json"
-        self.data = {}
+    """Serviço simplificado para testes
+
+    Os dados ficam em shards: data/bot_data/<namespace>/<bucket>, em que o
+    bucket é o hash da chave. Cada shard é carregado na primeira vez que é
+    acessado e só os shards alterados são regravados.
+
+    Modos de persistência (FILE_STORE_MODE):
+    - snapshot: regrava o shard alterado a cada alteração
+    - journal: anexa cada alteração em um journal e, ao compactar, regrava
+      os shards alterados desde a compactação anterior
+    - write_behind: acumula alterações e grava os shards alterados uma vez
+      por intervalo ou ao atingir o limite de chaves pendentes
+
+    Chaves com TTL têm o vencimento gravado no namespace 'expires' e indexado
+    em um min-heap; a leitura ignora chaves vencidas e um sweeper periódico
+    as remove.
+
+    Outro processo pode regravar um shard (main.py e user_bot_main.py usam
+    os mesmos arquivos): um watcher compara inode/mtime dos shards carregados
+    e descarta os alterados, que são relidos no próximo acesso; antes de cada
+    alteração os shards da chave passam pela mesma verificação. Isso só vale
+    no modo snapshot; nos modos journal e write_behind as alterações ficam
+    no journal/memória do processo até a compactação, então só um processo
+    pode usar o armazenamento (o watcher acompanha apenas o livro de vendas).
+
+    Os índices de bots são namespaces comuns: 'bot_ids' (id -> token),
+    'owner_bots' (dono -> ids) e 'bot_usernames' (username -> id). Os de
+    pagamentos (payment_id e status) ficam só em memória: são montados dos
+    shards na primeira consulta e refeitos quando outro processo regrava
+    um shard de pagamentos.
+
+    O índice de presença também fica em memória: último acesso de cada
+    usuário (last_activity) agrupado em buckets de um minuto, para que
+    get_active_users percorra só os minutos pedidos.
+    """
+
+    def __init__(self, data_file: str = "data/bot_data.json", mode: Optional[str] = None):
+        self.data_file = data_file
+        self.data_dir = os.path.splitext(data_file)[0]
+        self.manifest_file = os.path.join(self.data_dir, 'manifest.json')
+        self.journal_file = f"{data_file}.journal"
+        self.mode = mode or Config.FILE_STORE_MODE
+        self.shard_count = Config.FILE_STORE_SHARDS
+        self._manifest: Dict[str, Any] = {}
+        self.compact_every = Config.JOURNAL_COMPACT_RECORDS
+        self.flush_interval = Config.WRITE_BEHIND_INTERVAL
+        self.max_dirty = Config.WRITE_BEHIND_MAX_DIRTY
+        self._shards: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        self._dirty_shards = set()
+        self._shard_stats: Dict[Tuple[str, int], Optional[Tuple[int, int]]] = {}
+        self._lock = threading.RLock()
+        self._journal = None
+        self._journal_records = 0
+        self._dirty = set()
+        self._flush_timer = None
+        self._batch = None
+        self._expiry_heap = []
+        self._payment_ids: Optional[Dict[str, str]] = None
+        self._payment_status: Dict[str, Dict[str, float]] = {}
+        self._activity: Optional[Dict[str, float]] = None
+        self._activity_buckets: Dict[int, Set[str]] = {}
+        self.sales = SalesLedger(self.data_dir + '.sales.jsonl')
         self._load_data()
-    
+        self._sweeper = ExpirySweeper(self.sweep_expired)
+        self._sweeper.start()
+        self._watcher = None
+        if Config.CHANGE_NOTIFICATIONS:
+            self._watcher = PollingWatcher(self.check_external_changes)
+            self._watcher.start()
+
+        if self.mode in ('journal', 'write_behind'):
+            # Garante que nada pendente se perca no encerramento do processo
+            atexit.register(self.close)
+            logger.info(f"Modo {self.mode}: os shards em {self.data_dir} não podem ser compartilhados com outro processo")
+
     def _load_data(self):
-        """Carrega dados do arquivo"""
-        if os.path.exists(self.data_file):
+        """Abre os shards, migrando o arquivo único antigo se existir"""
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, 'rb') as f:
+                self._manifest = codec.json_loads(f.read())
+            self.shard_count = self._manifest['shards']
+            # Reaplicar alterações que ainda não foram compactadas
+            self._replay_journal()
+        else:
+            # Sem manifesto a conversão não terminou: é refeita desde o início
+            os.makedirs(self.data_dir, exist_ok=True)
+            self._convert_single_file()
+
+        if self.mode == 'journal' and self._journal is None:
+            self._journal = open(self.journal_file, 'a', encoding='utf-8')
+
+        if not self._manifest.get('bot_indexes'):
+            self._rebuild_bot_indexes()
+
+        self._build_expiry_index()
+        self.sweep_expired()
+
+    def _convert_single_file(self):
+        """Converte o arquivo único antigo (e seu journal) em shards
+
+        O manifesto é gravado por último, depois dos shards e das vendas
+        migradas; o journal só é zerado depois dele. Uma queda em qualquer
+        ponto anterior refaz a conversão na próxima abertura: os registros
+        do journal gravam valores absolutos e as vendas migradas têm
+        sale_key, então repetir não duplica nada.
+        """
+        imported = os.path.exists(self.data_file) and self._import_single_file()
+        self._replay_journal(compact=False)
+        if imported:
+            self._migrate_sales()
+        if not self._save_data():
+            raise RuntimeError(f"Erro ao gravar os shards em {self.data_dir}")
+        if imported:
+            os.replace(self.data_file, f"{self.data_file}.migrated")
+            logger.info(f"{self.data_file} convertido em shards ({self.shard_count} por namespace)")
+
+        self._manifest = {'shards': self.shard_count}
+        self._write_manifest()
+        if os.path.exists(self.journal_file):
+            self._compact()
+
+    def _write_manifest(self):
+        tmp_file = f"{self.manifest_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(codec.json_dumps(self._manifest))
+        os.replace(tmp_file, self.manifest_file)
+
+    def _rebuild_bot_indexes(self):
+        """Monta os índices de bots a partir dos bots gravados (uma única vez)"""
+        with self._lock:
+            self._batch = []
             try:
-                with open(self.data_file, 'r') as f:
-                    self.data = json.load(f)
-            except:
-                self.data = {}
+                for token, bot_data in self._items('bots'):
+                    self._index_bot(token, bot_data, None)
+            finally:
+                records, self._batch = self._batch, None
+                self._persist_many(records)
+            self.flush()
+            self._manifest['bot_indexes'] = 1
+            self._write_manifest()
+
+    def _import_single_file(self) -> bool:
+        """Distribui o conteúdo do arquivo único antigo pelos shards"""
+        try:
+            with open(self.data_file, 'rb') as f:
+                data = codec.loads(f.read())
+        except Exception as e:
+            logger.error(f"Erro ao importar {self.data_file}: {e}")
+            return False
+
+        for namespace, items in data.items():
+            for key, value in items.items():
+                shard_id = (namespace, self._bucket(key))
+                self._load_shard(*shard_id)[key] = value
+                self._dirty_shards.add(shard_id)
+                if namespace == 'expires':
+                    expired_ns, expired_key = key.split(':', 1)
+                    heapq.heappush(self._expiry_heap, (value, expired_ns, expired_key))
+        return True
+
+    def _migrate_sales(self):
+        """Move listas user['sales'] antigas para o livro de vendas
+
+        Cada venda recebe um sale_key estável: se o processo cair antes de
+        gravar os usuários sem a lista, a próxima abertura não a duplica.
+        """
+        migrated = 0
+        for user_id, user_data in self._items('users'):
+            if 'sales' not in user_data:
+                continue
+            for index, sale_data in enumerate(user_data.pop('sales') or []):
+                sale_data.setdefault('owner_id', int(user_id))
+                sale_data.setdefault('sale_key', f"{user_id}:{index}:{sale_data.get('timestamp')}")
+                if self.sales.append(sale_data):
+                    migrated += 1
+            self._dirty_shards.add(('users', self._bucket(user_id)))
+
+        if migrated:
+            logger.info(f"{migrated} vendas migradas para o livro de vendas")
+
+    # Shards
+    def _bucket(self, key: str) -> int:
+        return zlib.crc32(key.encode('utf-8')) % self.shard_count
+
+    def _shard_path(self, namespace: str, bucket: int) -> str:
+        return os.path.join(self.data_dir, namespace, f"{bucket:03d}")
+
+    def _shard_stat(self, namespace: str, bucket: int) -> Optional[Tuple[int, int]]:
+        """Inode e mtime do arquivo do shard (os.replace sempre troca o inode)"""
+        try:
+            stat = os.stat(self._shard_path(namespace, bucket))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load_shard(self, namespace: str, bucket: int) -> Dict[str, Any]:
+        """Retorna um shard, lendo o arquivo no primeiro acesso"""
+        shard = self._shards.get((namespace, bucket))
+        if shard is None:
+            shard = {}
+            path = self._shard_path(namespace, bucket)
+            self._shard_stats[(namespace, bucket)] = self._shard_stat(namespace, bucket)
+            if os.path.exists(path):
+                try:
+                    with open(path, 'rb') as f:
+                        shard = codec.loads(f.read())
+                except Exception as e:
+                    logger.error(f"Erro ao carregar shard {namespace}/{bucket}: {e}")
+            self._shards[(namespace, bucket)] = shard
+
+            if namespace == 'expires':
+                # Entradas repetidas no heap são descartadas pelo sweep
+                for name, expires_at in shard.items():
+                    expired_ns, key = name.split(':', 1)
+                    heapq.heappush(self._expiry_heap, (expires_at, expired_ns, key))
+        return shard
+
+    def _shard(self, namespace: str, key: str) -> Dict[str, Any]:
+        return self._load_shard(namespace, self._bucket(key))
+
+    def _items(self, namespace: str) -> List[Tuple[str, Any]]:
+        """Itens de um namespace inteiro (carrega todos os seus shards)"""
+        items = []
+        for bucket in range(self.shard_count):
+            items.extend(self._load_shard(namespace, bucket).items())
+        return items
+
+    def _count(self, namespace: str) -> int:
+        return sum(len(self._load_shard(namespace, bucket)) for bucket in range(self.shard_count))
+
+    def _build_expiry_index(self):
+        """Carrega os shards de vencimento, alimentando o min-heap"""
+        for bucket in range(self.shard_count):
+            self._load_shard('expires', bucket)
+
+    def _refresh_shard(self, shard_id: Tuple[str, int]):
+        """Descarta um shard carregado se outro processo o regravou"""
+        # Alterações locais pendentes prevalecem
+        if shard_id not in self._shards or shard_id in self._dirty_shards:
+            return
+        if self._shard_stat(*shard_id) != self._shard_stats.get(shard_id):
+            del self._shards[shard_id]
+            if shard_id[0] == 'payments':
+                self._payment_ids = None
+            if shard_id[0] == 'users':
+                self._activity = None
+            if shard_id[0] == 'expires':
+                self._load_shard(*shard_id)
+
+    def _refresh_key(self, namespace: str, key: str):
+        """Relê os shards de uma chave antes de alterá-la (modo snapshot)
+
+        O shard inteiro é regravado: sem reler, a gravação apagaria o que
+        outro processo gravou nele desde a última leitura.
+        """
+        if self.mode != 'snapshot':
+            return
+        name = f"{namespace}:{key}"
+        self._refresh_shard((namespace, self._bucket(key)))
+        self._refresh_shard(('expires', self._bucket(name)))
+
+    def check_external_changes(self):
+        """Descarta os shards carregados que outro processo regravou"""
+        self.sales.refresh()
+        if self.mode != 'snapshot':
+            # Shards ficam pendentes até a compactação; ver docstring da classe
+            return
+        with self._lock:
+            for shard_id in list(self._shards):
+                self._refresh_shard(shard_id)
+
+    def _expires_at(self, namespace: str, key: str) -> Optional[float]:
+        name = f"{namespace}:{key}"
+        return self._shard('expires', name).get(name)
+
+    def _set_expiry(self, namespace: str, key: str, expires_at: Optional[float]):
+        """Define ou remove o vencimento de uma chave"""
+        name = f"{namespace}:{key}"
+        shard_id = ('expires', self._bucket(name))
+        expires = self._load_shard(*shard_id)
+        if expires_at:
+            expires[name] = expires_at
+            heapq.heappush(self._expiry_heap, (expires_at, namespace, key))
+        elif name in expires:
+            # Entrada antiga no heap é descartada quando chegar ao topo
+            del expires[name]
         else:
-            os.makedirs("data", exist_ok=True)
-            self.data = {
-                'users': {},
-                'bots': {},
-                'codes': {},
-                'states': {}
-            }
+            return
+        self._dirty_shards.add(shard_id)
+
+    def _replay_journal(self, compact: bool = True):
+        """Aplica os registros do journal sobre os shards gravados"""
+        if not os.path.exists(self.journal_file):
+            return
+
+        corrupted = False
+        with open(self.journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = codec.json_loads(line)
+                except ValueError:
+                    # Última linha incompleta (queda durante a escrita)
+                    logger.warning("Registro inválido ignorado no journal")
+                    corrupted = True
+                    continue
+                self._apply_record(record)
+                self._journal_records += 1
+
+        # Compactar para não anexar depois de uma linha truncada ou deixar
+        # para trás o journal de uma execução anterior em modo journal
+        if compact and (corrupted or (self.mode != 'journal' and self._journal_records)):
+            self._compact()
+
+    def _apply_record(self, record: Dict[str, Any]):
+        """Aplica um registro do journal em memória"""
+        shard_id = (record['ns'], self._bucket(record['key']))
+        namespace = self._load_shard(*shard_id)
+        self._dirty_shards.add(shard_id)
+        op = record['op']
+        if op == 'set':
+            namespace[record['key']] = record['value']
+            self._set_expiry(record['ns'], record['key'], record.get('expires_at'))
+            if record['ns'] == 'payments':
+                self._index_payment(record['key'], record['value'])
+            elif record['ns'] == 'users':
+                self._index_activity(record['key'], record['value'])
+        elif op == 'del':
+            namespace.pop(record['key'], None)
+            self._set_expiry(record['ns'], record['key'], None)
+            if record['ns'] == 'payments':
+                self._index_payment(record['key'], None)
+            elif record['ns'] == 'users':
+                self._index_activity(record['key'], None)
+        elif op == 'setfield' and record['key'] in namespace:
+            namespace[record['key']][record['field']] = record['value']
+            if record['ns'] == 'payments':
+                self._index_payment(record['key'], namespace[record['key']])
+            elif record['ns'] == 'users' and record['field'] == 'last_activity':
+                self._index_activity(record['key'], namespace[record['key']])
+        elif op == 'setpath' and record['key'] in namespace:
+            item = namespace[record['key']]
+            item[record['field']] = set_config_path(item.get(record['field']), record['path'], record['value'])
+
+    def _save_data(self) -> bool:
+        """Regrava os shards alterados (False se algum não pôde ser gravado)"""
+        saved = True
+        for namespace, bucket in list(self._dirty_shards):
+            path = self._shard_path(namespace, bucket)
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_file = f"{path}.tmp"
+                with open(tmp_file, 'wb') as f:
+                    f.write(codec.dumps(self._shards[(namespace, bucket)]))
+                os.replace(tmp_file, path)
+                self._shard_stats[(namespace, bucket)] = self._shard_stat(namespace, bucket)
+                self._dirty_shards.discard((namespace, bucket))
+            except Exception as e:
+                print(f"Erro ao salvar dados: {e}")
+                saved = False
+        return saved
+
+    def _compact(self):
+        """Grava os shards alterados e zera o journal"""
+        if not self._save_data():
+            # O journal continua sendo a única cópia das alterações
+            return
+        if self._journal is not None:
+            self._journal.close()
+        open(self.journal_file, 'w').close()
+        if self.mode == 'journal':
+            self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        self._journal_records = 0
+
+    def _persist(self, record: Dict[str, Any]):
+        """Persiste uma alteração conforme o modo configurado"""
+        if self._batch is not None:
+            # Dentro de um pipeline: persistido junto com o lote
+            self._batch.append(record)
+            return
+        self._persist_many([record])
+
+    def _persist_many(self, records: List[Dict[str, Any]]):
+        """Persiste um lote de alterações com uma única gravação"""
+        if not records:
+            return
+
+        if self.mode == 'write_behind':
+            for record in records:
+                self._mark_dirty(record['ns'], record['key'])
+            return
+
+        if self.mode != 'journal':
             self._save_data()
-    
-    def _save_data(self):
-        """Salva dados no arquivo"""
+            return
+
         try:
-            os.makedirs(os.path.dirname(self.data_file), exist_ok=True)
-            with open(self.data_file, 'w') as f:
-                json.dump(self.data, f, indent=2)
-        except Exception as e:
-            print(f"Erro ao salvar dados: {e}")
-    
+            self._journal.write(''.join(codec.json_dumps(record) + "\n" for record in records))
+            self._journal.flush()
+            self._journal_records += len(records)
+            if self._journal_records >= self.compact_every:
+                self._compact()
+        except Exception:
+            logger.exception("Erro ao gravar no journal")
+            raise
+
+    def _mark_dirty(self, namespace: str, key: str):
+        """Registra uma chave pendente e agenda a gravação"""
+        self._dirty.add((namespace, key))
+        if len(self._dirty) >= self.max_dirty:
+            self._flush_dirty()
+        elif self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _flush_dirty(self):
+        """Grava os shards se houver alterações pendentes"""
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        # Se a gravação falhar, as chaves continuam pendentes
+        if self._dirty and self._save_data():
+            self._dirty.clear()
+
+    def flush(self):
+        """Grava imediatamente as alterações pendentes"""
+        with self._lock:
+            self._flush_dirty()
+
+    def _get(self, namespace: str, key: str) -> Any:
+        """Lê uma chave, tratando como ausente se já venceu"""
+        with self._lock:
+            expires_at = self._expires_at(namespace, key)
+            if expires_at is not None and expires_at <= time.time():
+                self._delete(namespace, key)
+                return None
+            return self._shard(namespace, key).get(key)
+
+    def _set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None):
+        """Grava uma chave em um namespace, com vencimento opcional"""
+        with self._lock:
+            self._refresh_key(namespace, key)
+            record = {'op': 'set', 'ns': namespace, 'key': key, 'value': value}
+            if ttl:
+                record['expires_at'] = time.time() + ttl
+            self._apply_record(record)
+            self._persist(record)
+
+    def _delete(self, namespace: str, key: str):
+        """Remove uma chave de um namespace"""
+        with self._lock:
+            self._refresh_key(namespace, key)
+            if key not in self._shard(namespace, key):
+                return
+            record = {'op': 'del', 'ns': namespace, 'key': key}
+            self._apply_record(record)
+            self._persist(record)
+
+    def sweep_expired(self) -> int:
+        """Remove as chaves vencidas e retorna quantas foram removidas"""
+        removed = 0
+        now = time.time()
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                expires_at, namespace, key = heapq.heappop(self._expiry_heap)
+                self._refresh_key(namespace, key)
+                # Chave regravada ou removida depois de entrar no heap
+                if self._expires_at(namespace, key) != expires_at:
+                    continue
+                record = {'op': 'del', 'ns': namespace, 'key': key}
+                self._apply_record(record)
+                if self.mode in ('journal', 'write_behind'):
+                    self._persist(record)
+                removed += 1
+
+            # No modo snapshot, cada shard é gravado uma vez para toda a limpeza
+            if removed and self.mode not in ('journal', 'write_behind'):
+                self._save_data()
+        return removed
+
+    def _set_field(self, namespace: str, key: str, field: str, value: Any):
+        """Grava um só campo de um registro
+
+        O journal recebe o valor resultante, não a operação: reaplicar um
+        registro que já estava no snapshot (queda entre a gravação do
+        snapshot e a limpeza do journal) não altera o resultado.
+        """
+        record = {'op': 'setfield', 'ns': namespace, 'key': key, 'field': field, 'value': value}
+        self._apply_record(record)
+        self._persist(record)
+
+    def _increment(self, namespace: str, key: str, field: str, amount: float) -> bool:
+        """Incrementa um campo numérico de forma atômica (HINCRBYFLOAT)"""
+        with self._lock:
+            self._refresh_key(namespace, key)
+            item = self._shard(namespace, key).get(key)
+            if item is None:
+                return False
+            self._set_field(namespace, key, field, item.get(field, 0) + amount)
+            return True
+
+    def close(self):
+        """Grava pendências, compacta o journal e libera o arquivo"""
+        self._sweeper.stop()
+        if self._watcher is not None:
+            self._watcher.stop()
+        with self._lock:
+            self._flush_dirty()
+            if self._journal is None:
+                return
+            self._compact()
+            self._journal.close()
+            self._journal = None
+
+    def pipeline(self) -> StorePipeline:
+        """Agrupa escritas em uma única gravação"""
+        return StorePipeline(self)
+
+    async def _execute_pipeline(self, ops: List[Tuple[str, tuple, Dict[str, Any]]]) -> List[Any]:
+        """Executa as operações de um StorePipeline sob o mesmo lock"""
+        with self._lock:
+            self._batch = []
+            try:
+                # Os métodos do serviço em arquivo não suspendem, então o
+                # lock não fica preso entre corrotinas
+                results = [await getattr(self, method)(*args, **kwargs) for method, args, kwargs in ops]
+            finally:
+                records, self._batch = self._batch, None
+                self._persist_many(records)
+        return results
+
+    async def get_many(self, namespace: str, keys: Iterable) -> Dict[Any, Optional[Dict[str, Any]]]:
+        """Lê vários usuários ('users') ou bots ('bots')"""
+        if namespace not in SAVE_METHODS:
+            raise ValueError(f"Namespace não suportado: {namespace}")
+        with self._lock:
+            return {key: self._get(namespace, str(key)) for key in keys}
+
+    async def save_many(self, namespace: str, items: Dict[Any, Dict[str, Any]]) -> bool:
+        """Grava vários usuários ('users') ou bots ('bots') em uma gravação"""
+        if namespace not in SAVE_METHODS:
+            raise ValueError(f"Namespace não suportado: {namespace}")
+        async with self.pipeline() as pipe:
+            for key, data in items.items():
+                getattr(pipe, SAVE_METHODS[namespace])(key, data)
+        return True
+
+    async def ping(self) -> bool:
+        """Verifica se o diretório de dados está acessível para escrita"""
+        return os.access(self.data_dir, os.W_OK)
+
+    async def get_cache_stats(self) -> Dict[str, Any]:
+        """Obtém os contadores do cache de bots (os dados já ficam em memória)"""
+        return {}
+
+    async def get_platform_metrics(self) -> Dict[str, Any]:
+        """Obtém os contadores da plataforma (usuários, bots, vendas, receita)"""
+        with self._lock:
+            metrics = {
+                'users': self._count('users'),
+                'bots': self._count('bots')
+            }
+        metrics.update(self.sales.summary())
+        return metrics
+
     async def get_user_data(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Obtém dados do usuário"""
-        return self.data.get('users', {}).get(str(user_id))
-    
+        return self._get('users', str(user_id))
+
     async def save_user_data(self, user_id: int, data: Dict[str, Any]) -> bool:
         """Salva dados do usuário"""
-        if 'users' not in self.data:
-            self.data['users'] = {}
-        self.data['users'][str(user_id)] = data
-        self._save_data()
+        self._set('users', str(user_id), data)
         return True
-    
+
     async def get_bot_data(self, token: str) -> Optional[Dict[str, Any]]:
         """Obtém dados do bot"""
-        return self.data.get('bots', {}).get(token)
-    
-    async def save_bot_data(self, token: str, data: Dict[str, Any]) -> bool:
-        """Salva dados do bot"""
-        if 'bots' not in self.data:
-            self.data['bots'] = {}
-        self.data['bots'][token] = data
-        self._save_data()
+        return self._get('bots', token)
+
+    async def save_bot_data(self, token: str, data: Dict[str, Any],
+                            expected_version: Optional[int] = None) -> bool:
+        """Salva dados do bot, incrementando data['version']
+
+        Com expected_version, só grava se a versão atual for essa (compare-and-set)
+        """
+        with self._lock:
+            self._refresh_key('bots', token)
+            previous = self._get('bots', token)
+            version = previous.get('version', 0) if previous else 0
+            if expected_version is not None and version != expected_version:
+                return False
+            previous = previous and {field: previous.get(field) for field in ('owner_id', 'username')}
+            data['version'] = version + 1
+            self._set('bots', token, data)
+            self._index_bot(token, data, previous)
         return True
-    
+
+    async def update_bot_config(self, token: str, path: str, value: Any,
+                                expected_version: Optional[int] = None) -> bool:
+        """Altera um campo de config (path 'plans' ou 'a.b') sem regravar o bot inteiro"""
+        return await self.update_bot_config_many(token, {path: value}, expected_version)
+
+    async def update_bot_config_many(self, token: str, values: Dict[str, Any],
+                                     expected_version: Optional[int] = None) -> bool:
+        """Altera vários campos de config ({path: valor}) com um só incremento de versão"""
+        with self._lock:
+            self._refresh_key('bots', token)
+            bot_data = self._get('bots', token)
+            if bot_data is None:
+                return False
+            version = bot_data.get('version', 0)
+            if expected_version is not None and version != expected_version:
+                return False
+            # Journal recebe só os campos alterados e a nova versão, em uma gravação
+            records = [
+                {'op': 'setpath', 'ns': 'bots', 'key': token, 'field': 'config', 'path': path, 'value': value}
+                for path, value in values.items()
+            ]
+            records.append({'op': 'setfield', 'ns': 'bots', 'key': token, 'field': 'version', 'value': version + 1})
+            for record in records:
+                self._apply_record(record)
+            if self._batch is not None:
+                self._batch.extend(records)
+            else:
+                self._persist_many(records)
+        return True
+
+    def _index_bot(self, token: str, data: Dict[str, Any], previous: Optional[Dict[str, Any]]):
+        """Atualiza os índices de um bot; só grava as entradas que mudaram"""
+        bot_id = get_bot_id(token)
+        if bot_id is None:
+            return
+        previous = previous or {}
+        if self._get('bot_ids', str(bot_id)) != token:
+            self._set('bot_ids', str(bot_id), token)
+
+        owner_id, old_owner_id = data.get('owner_id'), previous.get('owner_id')
+        if old_owner_id is not None and old_owner_id != owner_id:
+            bot_ids = [i for i in self._get('owner_bots', str(old_owner_id)) or [] if i != bot_id]
+            if bot_ids:
+                self._set('owner_bots', str(old_owner_id), bot_ids)
+            else:
+                self._delete('owner_bots', str(old_owner_id))
+        if owner_id is not None:
+            bot_ids = self._get('owner_bots', str(owner_id)) or []
+            if bot_id not in bot_ids:
+                self._set('owner_bots', str(owner_id), bot_ids + [bot_id])
+
+        username = normalize_username(data.get('username'))
+        old_username = normalize_username(previous.get('username'))
+        if old_username and old_username != username and self._get('bot_usernames', old_username) == bot_id:
+            self._delete('bot_usernames', old_username)
+        if username and self._get('bot_usernames', username) != bot_id:
+            self._set('bot_usernames', username, bot_id)
+
+    async def get_bot_token_by_id(self, bot_id: int) -> Optional[str]:
+        """Busca o token de um bot pelo id numérico"""
+        return self._get('bot_ids', str(bot_id))
+
+    async def get_bot_id_by_username(self, username: str) -> Optional[int]:
+        """Busca o id de um bot pelo username (com ou sem '@')"""
+        return self._get('bot_usernames', normalize_username(username))
+
+    async def get_owner_bot_ids(self, owner_id: int) -> List[int]:
+        """Ids dos bots de um dono, em ordem de cadastro"""
+        return list(self._get('owner_bots', str(owner_id)) or [])
+
+    async def get_owner_bots(self, owner_id: int) -> Dict[str, Dict[str, Any]]:
+        """Bots de um dono (token -> dados)"""
+        bots = {}
+        with self._lock:
+            for bot_id in self._get('owner_bots', str(owner_id)) or []:
+                token = self._get('bot_ids', str(bot_id))
+                bot_data = token and self._get('bots', token)
+                if bot_data:
+                    bots[token] = bot_data
+        return bots
+
     async def get_bot_by_token(self, token: str) -> Optional[Dict[str, Any]]:
         """Busca bot pelo token"""
         return await self.get_bot_data(token)
-    
+
+    async def get_all_bots(self) -> Dict[str, Dict[str, Any]]:
+        """Obtém todos os bots"""
+        with self._lock:
+            return dict(self._items('bots'))
+
     async def get_user_state(self, user_id: int) -> Optional[str]:
         """Obtém estado do usuário"""
-        return self.data.get('states', {}).get(str(user_id))
-    
-    async def set_user_state(self, user_id: int, state: str) -> bool:
-        """Define estado do usuário"""
-        if 'states' not in self.data:
-            self.data['states'] = {}
-        self.data['states'][str(user_id)] = state
-        self._save_data()
+        return self._get('states', str(user_id))
+
+    async def set_user_state(self, user_id: int, state: str, ttl: Optional[int] = None) -> bool:
+        """Define estado do usuário (expira em STATE_TTL por padrão)"""
+        self._set('states', str(user_id), state, Config.STATE_TTL if ttl is None else ttl)
         return True
-    
+
     async def clear_user_state(self, user_id: int) -> bool:
         """Limpa estado do usuário"""
-        if 'states' in self.data and str(user_id) in self.data['states']:
-            del self.data['states'][str(user_id)]
-            self._save_data()
+        self._delete('states', str(user_id))
         return True
-    
+
     async def get_channel_code(self, code: str) -> Optional[Dict[str, Any]]:
         """Obtém código de canal"""
-        return self.data.get('codes', {}).get(code)
-    
-    async def save_channel_code(self, code: str, data: Dict[str, Any]) -> bool:
-        """Salva código de canal"""
-        if 'codes' not in self.data:
-            self.data['codes'] = {}
-        self.data['codes'][code] = data
-        self._save_data()
+        return self._get('codes', code)
+
+    async def save_channel_code(self, code: str, data: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """Salva código de canal (expira em CHANNEL_CODE_TTL por padrão)"""
+        self._set('codes', code, data, Config.CHANNEL_CODE_TTL if ttl is None else ttl)
         return True
-    
+
     async def delete_channel_code(self, code: str) -> bool:
         """Remove código de canal"""
-        if 'codes' in self.data and code in self.data['codes']:
-            del self.data['codes'][code]
-            self._save_data()
+        self._delete('codes', code)
         return True
-    
+
     async def get_all_users(self) -> Dict[int, Dict[str, Any]]:
         """Obtém todos os usuários"""
-        return {int(k): v for k, v in self.data.get('users', {}).items()}
-    
+        with self._lock:
+            return {int(k): v for k, v in self._items('users')}
+
+    async def iter_users(self, page_size: int = 500,
+                         fields: Optional[Iterable[str]] = None) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """Percorre os usuários em páginas, shard por shard, com projeção opcional de campos"""
+        fields = list(fields) if fields else None
+        for bucket in range(self.shard_count):
+            # Lista só de chaves: o shard pode mudar entre as páginas
+            with self._lock:
+                user_ids = list(self._load_shard('users', bucket))
+
+            for position in range(0, len(user_ids), page_size):
+                with self._lock:
+                    users = self._load_shard('users', bucket)
+                    page = [
+                        (user_id, users[user_id])
+                        for user_id in user_ids[position:position + page_size]
+                        if user_id in users
+                    ]
+
+                for user_id, user_data in page:
+                    if fields:
+                        user_data = {field: user_data[field] for field in fields if field in user_data}
+                    yield int(user_id), user_data
+                # Libera o event loop entre páginas
+                await asyncio.sleep(0)
+
     async def get_payment_data(self, user_id: int, payment_id: str) -> Optional[Dict[str, Any]]:
         """Obtém dados de pagamento"""
         key = f"{user_id}:{payment_id}"
-        return self.data.get('payments', {}).get(key)
-    
-    async def save_payment_data(self, user_id: int, payment_data: Dict[str, Any]) -> bool:
-        """Salva dados de pagamento"""
+        return self._get('payments', key)
+
+    async def save_payment_data(self, user_id: int, payment_data: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """Salva dados de pagamento (pendentes expiram em PENDING_PAYMENT_TTL)"""
         payment_id = payment_data.get('payment_id', '')
         key = f"{user_id}:{payment_id}"
-        
-        if 'payments' not in self.data:
-            self.data['payments'] = {}
-        
-        self.data['payments'][key] = payment_data
-        self._save_data()
+
+        self._set('payments', key, payment_data, payment_ttl(payment_data, ttl))
         return True
-    
+
+    def _index_payment(self, key: str, payment_data: Optional[Dict[str, Any]]):
+        """Atualiza os índices de pagamentos, se já montados"""
+        if self._payment_ids is None:
+            return
+        for entries in self._payment_status.values():
+            entries.pop(key, None)
+        payment_id = key.split(':', 1)[1]
+        if payment_data is None:
+            if self._payment_ids.get(payment_id) == key:
+                del self._payment_ids[payment_id]
+            return
+        self._payment_ids[payment_id] = key
+        status = payment_data.get('status')
+        if status:
+            self._payment_status.setdefault(status, {})[key] = timestamp_score(payment_data.get('created_at'))
+
+    def _payment_indexes(self) -> Tuple[Dict[str, str], Dict[str, Dict[str, float]]]:
+        """Índices payment_id -> chave e status -> {chave: created_at}"""
+        if self._payment_ids is None:
+            self._payment_ids = {}
+            self._payment_status = {}
+            for key, payment_data in self._items('payments'):
+                self._index_payment(key, payment_data)
+        return self._payment_ids, self._payment_status
+
+    async def get_payment_by_id(self, payment_id: str) -> Optional[Dict[str, Any]]:
+        """Busca um pagamento só pelo payment_id (webhooks e verificações em lote)"""
+        with self._lock:
+            key = self._payment_indexes()[0].get(payment_id)
+            payment_data = self._get('payments', key) if key else None
+        if payment_data is None:
+            return None
+        return dict(payment_data, user_id=int(key.split(':', 1)[0]))
+
+    async def get_payments_by_status(self, status: str, limit: Optional[int] = None,
+                                     created_before: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Pagamentos com um status, do mais antigo ao mais recente (created_at)"""
+        high = created_before.timestamp() if created_before else float('inf')
+        payments = []
+        with self._lock:
+            entries = self._payment_indexes()[1].get(status, {})
+            for key, score in sorted(entries.items(), key=lambda entry: entry[1]):
+                if score >= high or (limit is not None and len(payments) >= limit):
+                    break
+                # _get descarta pagamentos vencidos (e os tira do índice)
+                payment_data = self._get('payments', key)
+                if payment_data is not None:
+                    payments.append(dict(payment_data, user_id=int(key.split(':', 1)[0])))
+        return payments
+
+    async def record_payment_checks(self, checks: List[Dict[str, Any]]) -> int:
+        """Grava next_check_at/check_attempts dos pagamentos ainda pendentes em uma gravação
+
+        Só os dois campos vão para o journal; o vencimento do pagamento não
+        muda, então o heap de vencimentos não recebe entradas novas.
+        """
+        updated = 0
+        with self._lock:
+            self._batch = []
+            try:
+                for check in checks:
+                    key = f"{check['user_id']}:{check['payment_id']}"
+                    self._refresh_key('payments', key)
+                    payment_data = self._get('payments', key)
+                    if payment_data is None or payment_data.get('status') != 'pending':
+                        continue
+                    self._set_field('payments', key, 'next_check_at', check['next_check_at'])
+                    self._set_field('payments', key, 'check_attempts', check['attempts'])
+                    updated += 1
+            finally:
+                records, self._batch = self._batch, None
+                self._persist_many(records)
+        return updated
+
+    def _index_activity(self, key: str, user_data: Optional[Dict[str, Any]]):
+        """Move o usuário para o bucket do seu último acesso, se o índice já existe"""
+        if self._activity is None:
+            return
+        previous = self._activity.pop(key, None)
+        if previous is not None:
+            bucket = self._activity_buckets.get(int(previous // 60))
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._activity_buckets[int(previous // 60)]
+        last_activity = (user_data or {}).get('last_activity')
+        if not last_activity:
+            return
+        seen = timestamp_score(last_activity)
+        self._activity[key] = seen
+        self._activity_buckets.setdefault(int(seen // 60), set()).add(key)
+
+    def _activity_index(self) -> Dict[int, Set[str]]:
+        """Índice minuto -> usuários vistos naquele minuto"""
+        if self._activity is None:
+            self._activity = {}
+            self._activity_buckets = {}
+            for key, user_data in self._items('users'):
+                self._index_activity(key, user_data)
+        return self._activity_buckets
+
+    async def record_activity(self, last_seen: Dict[int, float]) -> int:
+        """Grava o último acesso (timestamp) de vários usuários em uma gravação
+
+        Só o campo last_activity vai para o journal, não o registro inteiro.
+        """
+        updated = 0
+        with self._lock:
+            self._batch = []
+            try:
+                for user_id, seen in last_seen.items():
+                    key = str(user_id)
+                    self._refresh_key('users', key)
+                    if self._get('users', key) is None:
+                        continue
+                    self._set_field('users', key, 'last_activity', datetime.fromtimestamp(seen).isoformat())
+                    updated += 1
+            finally:
+                records, self._batch = self._batch, None
+                self._persist_many(records)
+        return updated
+
     async def get_active_users(self, minutes: int = 5) -> List[Dict[str, Any]]:
-        """Obtém usuários ativos nos últimos X minutos"""
-        # Simulação para testes
-        return list(self.data.get('users', {}).values())
-    
-    async def add_user_sale(self, user_id: int, sale_data: Dict[str, Any]) -> bool:
-        """Adiciona uma venda ao histórico do usuário"""
-        user_data = await self.get_user_data(user_id)
-        if not user_data:
-            return False
-        
-        if 'sales' not in user_data:
-            user_data['sales'] = []
-        
-        user_data['sales'].append(sale_data)
-        return await self.save_user_data(user_id, user_data)
-    
+        """Obtém usuários ativos nos últimos X minutos, do mais recente ao mais antigo"""
+        since = time.time() - minutes * 60
+        with self._lock:
+            buckets = self._activity_index()
+            seen = [
+                (self._activity[key], key)
+                for minute in range(int(since // 60), int(time.time() // 60) + 1)
+                for key in buckets.get(minute, ())
+                if self._activity[key] >= since
+            ]
+            seen.sort(reverse=True)
+            users = [self._get('users', key) for _, key in seen]
+        return [user_data for user_data in users if user_data is not None]
+
+    async def add_user_sale(self, user_id: int, sale_data: Dict[str, Any], credit: float = 0.0) -> bool:
+        """Registra uma venda do usuário no livro de vendas
+
+        `credit` vai para o saldo do usuário sob o mesmo lock, só se a venda
+        foi registrada (uma venda repetida pelo sale_key não credita de novo).
+        """
+        with self._lock:
+            if self._get('users', str(user_id)) is None:
+                return False
+            sale_data = dict(sale_data, owner_id=sale_data.get('owner_id', user_id))
+            if not self.sales.append(sale_data):
+                return False
+            if credit:
+                self._increment('users', str(user_id), 'balance', credit)
+            return True
+
+    async def get_sales(self, owner_id: Optional[int] = None, bot_token: Optional[str] = None,
+                        start: Optional[datetime] = None, end: Optional[datetime] = None,
+                        limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Obtém vendas em ordem cronológica, filtradas por dono, bot e período"""
+        return self.sales.query(owner_id, bot_token, start, end, limit)
+
+    async def get_sales_totals(self) -> Dict[int, float]:
+        """Obtém o total vendido por dono de bot"""
+        return self.sales.totals()
+
     async def increment_user_stats(self, user_id: int, field: str, amount: float = 1.0) -> bool:
         """Incrementa estatísticas do usuário"""
-        user_data = await self.get_user_data(user_id)
-        if not user_data:
-            return False
-        
-        if field not in user_data:
-            user_data[field] = 0
-        
-        user_data[field] += amount
-        return await self.save_user_data(user_id, user_data)
\ No newline at end of file
+        return self._increment('users', str(user_id), field, amount)
+
+
+def create_redis_service():
+    """Cria o serviço de persistência definido em STORAGE_BACKEND"""
+    if Config.STORAGE_BACKEND == 'redis':
+        from services.async_redis_service import AsyncRedisService
+        return AsyncRedisService()
+    if Config.STORAGE_BACKEND == 'sqlite':
+        from services.sqlite_service import SQLiteService
+        return SQLiteService()
+    return RedisService()
+
+
+_shared_service = None
+_shared_service_lock = threading.Lock()
+
+def get_redis_service():
+    """Retorna a instância única do serviço de persistência no processo
+
+    Todos os handlers compartilham o mesmo objeto, então os dados são
+    carregados uma só vez e as escritas de um módulo são vistas pelos outros.
+    """
+    global _shared_service
+    if _shared_service is None:
+        with _shared_service_lock:
+            if _shared_service is None:
+                _shared_service = create_redis_service()
+    return _shared_service
@@ -0,0 +1,181 @@
+"""
+Livro de vendas append-only para o serviço em arquivo
+"""
+
+import bisect
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Tuple
+
+from services.codec import json_dumps, json_loads
+
+logger = logging.getLogger(__name__)
+
+def timestamp_score(timestamp: Optional[str]) -> float:
+    """Converte um timestamp ISO em segundos (o momento atual, se ausente)"""
+    if timestamp:
+        try:
+            return datetime.fromisoformat(timestamp).timestamp()
+        except (ValueError, TypeError):
+            pass
+    return time.time()
+
+def sale_score(sale_data: Dict[str, Any]) -> float:
+    """Converte o timestamp ISO da venda em segundos (ordenação do livro)"""
+    return timestamp_score(sale_data.get('timestamp'))
+
+def range_scores(start: Optional[datetime], end: Optional[datetime]) -> Tuple[float, float]:
+    """Converte um intervalo de datas em limites de score"""
+    return (
+        start.timestamp() if start else float('-inf'),
+        end.timestamp() if end else float('inf')
+    )
+
+class SalesLedger:
+    """Vendas em ordem de tempo, indexadas por dono e por bot
+
+    Cada venda é uma linha JSON anexada ao arquivo; os índices ficam em
+    memória como listas ordenadas de (score, posição). Outro processo pode
+    anexar ao mesmo arquivo: `refresh` indexa as linhas novas a partir da
+    última posição lida.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._sales: List[Dict[str, Any]] = []
+        self._all: List[Tuple[float, int]] = []
+        self._by_owner: Dict[int, List[Tuple[float, int]]] = {}
+        self._by_bot: Dict[str, List[Tuple[float, int]]] = {}
+        self._totals: Dict[int, float] = {}
+        self._revenue = 0.0
+        self._keys = set()
+        # Bytes do arquivo já indexados
+        self._offset = 0
+        self._file = None
+        self._load()
+
+    def _load(self):
+        """Carrega o livro e reconstrói os índices"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._read_new()
+
+    def _reset(self):
+        self._sales = []
+        self._all = []
+        self._by_owner = {}
+        self._by_bot = {}
+        self._totals = {}
+        self._revenue = 0.0
+        self._keys = set()
+        self._offset = 0
+
+    def _read_new(self):
+        """Indexa as linhas completas anexadas desde a última leitura"""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return
+        if size < self._offset:
+            # Arquivo recriado: reindexar do início
+            self._reset()
+        if size == self._offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        # Uma linha sem '\n' ainda está sendo escrita por outro processo
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._index(json_loads(line))
+            except ValueError:
+                logger.warning("Venda inválida ignorada no livro de vendas")
+        self._offset += end
+
+    def refresh(self):
+        """Indexa as vendas anexadas por outro processo"""
+        with self._lock:
+            self._read_new()
+
+    def _index(self, sale_data: Dict[str, Any]):
+        position = len(self._sales)
+        entry = (sale_score(sale_data), position)
+        self._sales.append(sale_data)
+
+        bisect.insort(self._all, entry)
+        amount = float(sale_data.get('amount', 0) or 0)
+        self._revenue += amount
+        owner_id = sale_data.get('owner_id')
+        if owner_id is not None:
+            bisect.insort(self._by_owner.setdefault(owner_id, []), entry)
+            self._totals[owner_id] = self._totals.get(owner_id, 0.0) + amount
+        bot_token = sale_data.get('bot_token')
+        if bot_token:
+            bisect.insort(self._by_bot.setdefault(bot_token, []), entry)
+        if sale_data.get('sale_key'):
+            self._keys.add(sale_data['sale_key'])
+
+    def append(self, sale_data: Dict[str, Any]) -> bool:
+        """Anexa uma venda ao livro (False se já há uma venda com o mesmo sale_key)"""
+        with self._lock:
+            self._read_new()
+            if sale_data.get('sale_key') in self._keys:
+                return False
+            self._file.write(json_dumps(sale_data) + "\n")
+            self._file.flush()
+            # Indexa pelo arquivo, na ordem em que as linhas foram gravadas
+            self._read_new()
+            return True
+
+    def query(self, owner_id: Optional[int] = None, bot_token: Optional[str] = None,
+              start: Optional[datetime] = None, end: Optional[datetime] = None,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Vendas no intervalo [start, end], em ordem cronológica"""
+        with self._lock:
+            if bot_token is not None:
+                entries = self._by_bot.get(bot_token, [])
+            elif owner_id is not None:
+                entries = self._by_owner.get(owner_id, [])
+            else:
+                entries = self._all
+
+            low, high = range_scores(start, end)
+            first = bisect.bisect_left(entries, (low, -1))
+            last = bisect.bisect_right(entries, (high, len(self._sales)))
+
+            sales = []
+            for _, position in entries[first:last]:
+                sale_data = self._sales[position]
+                if owner_id is not None and sale_data.get('owner_id') != owner_id:
+                    continue
+                sales.append(sale_data)
+                if limit and len(sales) >= limit:
+                    break
+            return sales
+
+    def totals(self) -> Dict[int, float]:
+        """Total vendido por dono de bot"""
+        with self._lock:
+            return dict(self._totals)
+
+    def summary(self) -> Dict[str, Any]:
+        """Quantidade de vendas, receita e donos com vendas"""
+        with self._lock:
+            return {
+                'sales': len(self._sales),
+                'revenue': self._revenue,
+                'paying_users': len(self._totals)
+            }
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
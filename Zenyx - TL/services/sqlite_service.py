@@ -0,0 +1,694 @@
+"""
+Serviço de persistência em SQLite (modo WAL) com tabelas indexadas
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Optional, List, AsyncIterator, Iterable, Tuple
+
+from config.config import Config
+from services.cache import LRUCache
+from services.change_feed import PollingWatcher
+from services.expiry import ExpirySweeper, payment_ttl
+from services.pipeline import SAVE_METHODS, StorePipeline
+from services.sales_ledger import sale_score, range_scores
+from utils.helpers import get_bot_id, normalize_username, set_config_path
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+
+-- Último acesso de cada usuário (índice de presença)
+CREATE TABLE IF NOT EXISTS activity (
+    user_id INTEGER PRIMARY KEY,
+    last_seen REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_activity_last_seen ON activity(last_seen);
+
+CREATE TABLE IF NOT EXISTS bots (
+    token TEXT PRIMARY KEY,
+    owner_id INTEGER,
+    bot_id INTEGER,
+    username TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_bots_owner ON bots(owner_id);
+
+CREATE TABLE IF NOT EXISTS states (
+    user_id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    expires_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS codes (
+    code TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS payments (
+    user_id INTEGER NOT NULL,
+    payment_id TEXT NOT NULL,
+    status TEXT,
+    bot_token TEXT,
+    created_at TEXT,
+    data TEXT NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (user_id, payment_id)
+);
+CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_payments_payment_id ON payments(payment_id);
+CREATE INDEX IF NOT EXISTS idx_payments_bot ON payments(bot_token);
+
+CREATE TABLE IF NOT EXISTS sales (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner_id INTEGER NOT NULL,
+    bot_token TEXT,
+    amount REAL NOT NULL DEFAULT 0,
+    timestamp TEXT,
+    score REAL NOT NULL DEFAULT 0,
+    sale_key TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sales_owner ON sales(owner_id, score);
+CREATE INDEX IF NOT EXISTS idx_sales_bot ON sales(bot_token, score);
+CREATE INDEX IF NOT EXISTS idx_sales_score ON sales(score);
+
+-- Contadores da plataforma, mantidos por triggers a cada escrita.
+-- INSERT OR IGNORE só calcula o valor inicial na primeira abertura.
+CREATE TABLE IF NOT EXISTS metrics (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO metrics (name, value) SELECT 'users', COUNT(*) FROM users;
+INSERT OR IGNORE INTO metrics (name, value) SELECT 'bots', COUNT(*) FROM bots;
+INSERT OR IGNORE INTO metrics (name, value) SELECT 'sales', COUNT(*) FROM sales;
+INSERT OR IGNORE INTO metrics (name, value) SELECT 'revenue', COALESCE(SUM(amount), 0) FROM sales;
+INSERT OR IGNORE INTO metrics (name, value) SELECT 'paying_users', COUNT(DISTINCT owner_id) FROM sales;
+
+CREATE TRIGGER IF NOT EXISTS trg_users_insert AFTER INSERT ON users BEGIN
+    UPDATE metrics SET value = value + 1 WHERE name = 'users';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_users_delete AFTER DELETE ON users BEGIN
+    UPDATE metrics SET value = value - 1 WHERE name = 'users';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_bots_insert AFTER INSERT ON bots BEGIN
+    UPDATE metrics SET value = value + 1 WHERE name = 'bots';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_bots_delete AFTER DELETE ON bots BEGIN
+    UPDATE metrics SET value = value - 1 WHERE name = 'bots';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_sales_insert AFTER INSERT ON sales BEGIN
+    UPDATE metrics SET value = value + 1 WHERE name = 'sales';
+    UPDATE metrics SET value = value + NEW.amount WHERE name = 'revenue';
+    UPDATE metrics SET value = value + 1 WHERE name = 'paying_users'
+        AND NOT EXISTS (SELECT 1 FROM sales WHERE owner_id = NEW.owner_id AND id <> NEW.id);
+END;
+
+-- Feed de alterações lido pelos outros processos para invalidar o cache
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ns TEXT NOT NULL,
+    key TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS trg_bots_change_insert AFTER INSERT ON bots BEGIN
+    INSERT INTO changes (ns, key, created_at) VALUES ('bot', NEW.token, (julianday('now') - 2440587.5) * 86400.0);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_bots_change_update AFTER UPDATE ON bots BEGIN
+    INSERT INTO changes (ns, key, created_at) VALUES ('bot', NEW.token, (julianday('now') - 2440587.5) * 86400.0);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_bots_change_delete AFTER DELETE ON bots BEGIN
+    INSERT INTO changes (ns, key, created_at) VALUES ('bot', OLD.token, (julianday('now') - 2440587.5) * 86400.0);
+END;
+"""
+
+# Por quanto tempo o feed de alterações é mantido (segundos)
+CHANGES_RETENTION = 3600
+
+# Tabelas com TTL; criadas antes da coluna expires_at recebem ALTER TABLE
+EXPIRING_TABLES = ('states', 'codes', 'payments')
+
+def _expires_at(ttl: Optional[float]) -> Optional[float]:
+    return time.time() + ttl if ttl else None
+
+class SQLiteService:
+    """Implementação SQLite da mesma interface do RedisService
+
+    As vendas ficam apenas na tabela sales (livro de vendas), fora do
+    registro do usuário. Estados, códigos e pagamentos pendentes têm a
+    coluna expires_at: leituras ignoram linhas vencidas e um sweeper
+    periódico as apaga. Alterações de bots entram na tabela changes (por
+    trigger), que cada processo lê para invalidar o próprio cache.
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or Config.SQLITE_PATH
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+
+        # Uma conexão por processo, protegida por lock: os bots de usuários
+        # rodam em threads diferentes
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate_expiry()
+        self._migrate_sale_keys()
+        self._migrate_bot_indexes()
+        self.bot_cache = LRUCache(Config.BOT_CACHE_SIZE, Config.BOT_CACHE_TTL)
+        self._last_change_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM changes").fetchone()[0]
+        self._watcher = None
+        if Config.CHANGE_NOTIFICATIONS:
+            self._watcher = PollingWatcher(self.poll_changes)
+            self._watcher.start()
+
+        self._sweeper = ExpirySweeper(self.sweep_expired)
+        self._sweeper.start()
+
+    def _migrate_expiry(self):
+        """Adiciona expires_at (e seu índice) às tabelas que ainda não têm"""
+        for table in EXPIRING_TABLES:
+            columns = [row['name'] for row in self._conn.execute(f"PRAGMA table_info({table})")]
+            if 'expires_at' not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN expires_at REAL")
+            self._conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_expires ON {table}(expires_at) "
+                "WHERE expires_at IS NOT NULL"
+            )
+
+    def _migrate_bot_indexes(self):
+        """Adiciona bot_id e username (e seus índices) a bancos antigos"""
+        columns = [row['name'] for row in self._conn.execute("PRAGMA table_info(bots)")]
+        for column, column_type in (('bot_id', 'INTEGER'), ('username', 'TEXT')):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE bots ADD COLUMN {column} {column_type}")
+
+        rows = self._conn.execute("SELECT token, data FROM bots WHERE bot_id IS NULL").fetchall()
+        if rows:
+            self._conn.executemany(
+                "UPDATE bots SET bot_id = ?, username = ? WHERE token = ?",
+                [
+                    (get_bot_id(row['token']), normalize_username(json.loads(row['data']).get('username')), row['token'])
+                    for row in rows
+                ]
+            )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_bots_bot_id ON bots(bot_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_bots_username ON bots(username)")
+
+    def _migrate_sale_keys(self):
+        """Adiciona sale_key (chave única opcional das vendas) a bancos antigos"""
+        columns = [row['name'] for row in self._conn.execute("PRAGMA table_info(sales)")]
+        if 'sale_key' not in columns:
+            self._conn.execute("ALTER TABLE sales ADD COLUMN sale_key TEXT")
+        self._conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_key ON sales(sale_key) WHERE sale_key IS NOT NULL"
+        )
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    @contextmanager
+    def _transaction(self):
+        """Transação de escrita (BEGIN IMMEDIATE); dentro de um pipeline, usa a já aberta"""
+        with self._lock:
+            if self._conn.in_transaction:
+                yield
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _fetchone(self, sql: str, params: tuple = ()) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def _fetchall(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def poll_changes(self) -> None:
+        """Invalida o cache das chaves alteradas desde a última leitura do feed"""
+        rows = self._fetchall(
+            "SELECT id, ns, key FROM changes WHERE id > ? ORDER BY id",
+            (self._last_change_id,)
+        )
+        for row in rows:
+            if row['ns'] == 'bot':
+                self.bot_cache.invalidate(row['key'])
+        if rows:
+            self._last_change_id = rows[-1]['id']
+
+    def sweep_expired(self) -> int:
+        """Apaga as linhas vencidas e retorna quantas foram removidas"""
+        now = time.time()
+        removed = 0
+        with self._lock:
+            for table in EXPIRING_TABLES:
+                cursor = self._conn.execute(
+                    f"DELETE FROM {table} WHERE expires_at IS NOT NULL AND expires_at <= ?",
+                    (now,)
+                )
+                removed += cursor.rowcount
+            self._conn.execute("DELETE FROM changes WHERE created_at < ?", (now - CHANGES_RETENTION,))
+        return removed
+
+    def close(self) -> None:
+        """Fecha a conexão com o banco"""
+        self._sweeper.stop()
+        if self._watcher is not None:
+            self._watcher.stop()
+        with self._lock:
+            self._conn.close()
+
+    async def ping(self) -> bool:
+        """Verifica acesso ao banco"""
+        return self._fetchone("SELECT 1") is not None
+
+    # Lotes
+    def pipeline(self) -> StorePipeline:
+        """Agrupa escritas em uma única transação"""
+        return StorePipeline(self)
+
+    async def _execute_pipeline(self, ops: List[Tuple[str, tuple, Dict[str, Any]]]) -> List[Any]:
+        """Executa as operações de um StorePipeline em uma transação"""
+        with self._transaction():
+            # As escritas do SQLite não suspendem, então o lock não fica
+            # preso entre corrotinas
+            results = [await getattr(self, method)(*args, **kwargs) for method, args, kwargs in ops]
+        return results
+
+    async def get_many(self, namespace: str, keys: Iterable) -> Dict[Any, Optional[Dict[str, Any]]]:
+        """Lê vários usuários ('users') ou bots ('bots') em uma consulta"""
+        if namespace not in SAVE_METHODS:
+            raise ValueError(f"Namespace não suportado: {namespace}")
+        keys = list(keys)
+        if not keys:
+            return {}
+        table, column = ('users', 'id') if namespace == 'users' else ('bots', 'token')
+        placeholders = ', '.join('?' for _ in keys)
+        rows = self._fetchall(
+            f"SELECT {column} AS key, data FROM {table} WHERE {column} IN ({placeholders})",
+            tuple(keys)
+        )
+        found = {row['key']: json.loads(row['data']) for row in rows}
+        return {key: found.get(key) for key in keys}
+
+    async def save_many(self, namespace: str, items: Dict[Any, Dict[str, Any]]) -> bool:
+        """Grava vários usuários ('users') ou bots ('bots') em uma transação"""
+        if namespace not in SAVE_METHODS:
+            raise ValueError(f"Namespace não suportado: {namespace}")
+        async with self.pipeline() as pipe:
+            for key, data in items.items():
+                getattr(pipe, SAVE_METHODS[namespace])(key, data)
+        return True
+
+    async def get_cache_stats(self) -> Dict[str, Any]:
+        """Obtém os contadores do cache de bots"""
+        return self.bot_cache.stats()
+
+    async def get_platform_metrics(self) -> Dict[str, Any]:
+        """Obtém os contadores da plataforma (usuários, bots, vendas, receita)"""
+        metrics = {row['name']: row['value'] for row in self._fetchall("SELECT name, value FROM metrics")}
+        return {
+            'users': int(metrics.get('users', 0)),
+            'bots': int(metrics.get('bots', 0)),
+            'sales': int(metrics.get('sales', 0)),
+            'revenue': metrics.get('revenue', 0.0),
+            'paying_users': int(metrics.get('paying_users', 0))
+        }
+
+    # Usuários
+    async def get_user_data(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Obtém dados do usuário"""
+        row = self._fetchone("SELECT data FROM users WHERE id = ?", (user_id,))
+        return json.loads(row['data']) if row else None
+
+    async def save_user_data(self, user_id: int, data: Dict[str, Any]) -> bool:
+        """Salva dados do usuário"""
+        # Vendas são gravadas somente na tabela sales
+        record = {k: v for k, v in data.items() if k != 'sales'}
+        self._execute(
+            "INSERT INTO users (id, data) VALUES (?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+            (user_id, json.dumps(record))
+        )
+        return True
+
+    async def get_all_users(self) -> Dict[int, Dict[str, Any]]:
+        """Obtém todos os usuários"""
+        return {
+            row['id']: json.loads(row['data'])
+            for row in self._fetchall("SELECT id, data FROM users")
+        }
+
+    async def iter_users(self, page_size: int = 500,
+                         fields: Optional[Iterable[str]] = None) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+        """Percorre os usuários em páginas (keyset por id), com projeção opcional de campos"""
+        fields = list(fields) if fields else None
+        last_id = None
+        while True:
+            if last_id is None:
+                rows = self._fetchall("SELECT id, data FROM users ORDER BY id LIMIT ?", (page_size,))
+            else:
+                rows = self._fetchall(
+                    "SELECT id, data FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, page_size)
+                )
+            if not rows:
+                return
+            last_id = rows[-1]['id']
+
+            for row in rows:
+                user_data = json.loads(row['data'])
+                if fields:
+                    user_data = {field: user_data[field] for field in fields if field in user_data}
+                yield row['id'], user_data
+            if len(rows) < page_size:
+                return
+
+    async def record_activity(self, last_seen: Dict[int, float]) -> int:
+        """Grava o último acesso (timestamp) de vários usuários em uma transação"""
+        if not last_seen:
+            return 0
+        with self._transaction():
+            self._conn.executemany(
+                "INSERT INTO activity (user_id, last_seen) "
+                "SELECT ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE id = ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)",
+                [(user_id, seen, user_id) for user_id, seen in last_seen.items()]
+            )
+            cursor = self._conn.executemany(
+                "UPDATE users SET data = json_set(data, '$.last_activity', ?) WHERE id = ?",
+                [(datetime.fromtimestamp(seen).isoformat(), user_id) for user_id, seen in last_seen.items()]
+            )
+        return cursor.rowcount
+
+    async def get_active_users(self, minutes: int = 5) -> List[Dict[str, Any]]:
+        """Obtém usuários ativos nos últimos X minutos, do mais recente ao mais antigo"""
+        rows = self._fetchall(
+            "SELECT users.data FROM activity JOIN users ON users.id = activity.user_id "
+            "WHERE activity.last_seen >= ? ORDER BY activity.last_seen DESC",
+            (time.time() - minutes * 60,)
+        )
+        return [json.loads(row['data']) for row in rows]
+
+    async def add_user_sale(self, user_id: int, sale_data: Dict[str, Any], credit: float = 0.0) -> bool:
+        """Registra uma venda do usuário no livro de vendas
+
+        Com sale_key, uma venda já registrada com a mesma chave é ignorada.
+        `credit` vai para o saldo do usuário na mesma transação, só se a
+        venda foi registrada.
+        """
+        sale_data = dict(sale_data, owner_id=sale_data.get('owner_id', user_id))
+        with self._transaction():
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO sales (owner_id, bot_token, amount, timestamp, score, sale_key, data) "
+                "SELECT ?, ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE id = ?)",
+                (
+                    user_id,
+                    sale_data.get('bot_token'),
+                    float(sale_data.get('amount', 0) or 0),
+                    sale_data.get('timestamp'),
+                    sale_score(sale_data),
+                    sale_data.get('sale_key'),
+                    json.dumps(sale_data),
+                    user_id
+                )
+            )
+            inserted = cursor.rowcount > 0
+            if inserted and credit:
+                self._conn.execute(
+                    "UPDATE users SET data = json_set(data, '$.balance', "
+                    "COALESCE(json_extract(data, '$.balance'), 0) + ?) WHERE id = ?",
+                    (credit, user_id)
+                )
+        return inserted
+
+    async def get_sales(self, owner_id: Optional[int] = None, bot_token: Optional[str] = None,
+                        start: Optional[datetime] = None, end: Optional[datetime] = None,
+                        limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Obtém vendas em ordem cronológica, filtradas por dono, bot e período"""
+        low, high = range_scores(start, end)
+        sql = "SELECT data FROM sales WHERE score BETWEEN ? AND ?"
+        params = [low, high]
+        if owner_id is not None:
+            sql += " AND owner_id = ?"
+            params.append(owner_id)
+        if bot_token is not None:
+            sql += " AND bot_token = ?"
+            params.append(bot_token)
+        sql += " ORDER BY score, id"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [json.loads(row['data']) for row in self._fetchall(sql, tuple(params))]
+
+    async def get_sales_totals(self) -> Dict[int, float]:
+        """Obtém o total vendido por dono de bot"""
+        rows = self._fetchall("SELECT owner_id, SUM(amount) AS total FROM sales GROUP BY owner_id")
+        return {row['owner_id']: row['total'] for row in rows}
+
+    async def increment_user_stats(self, user_id: int, field: str, amount: float = 1.0) -> bool:
+        """Incrementa estatísticas do usuário"""
+        # Atualização em um único UPDATE, sem ler e regravar o usuário
+        path = '$."{}"'.format(field.replace('"', ''))
+        cursor = self._execute(
+            "UPDATE users SET data = json_set(data, ?, COALESCE(json_extract(data, ?), 0) + ?) "
+            "WHERE id = ?",
+            (path, path, amount, user_id)
+        )
+        return cursor.rowcount > 0
+
+    # Bots
+    async def get_bot_data(self, token: str) -> Optional[Dict[str, Any]]:
+        """Obtém dados do bot"""
+        data = self.bot_cache.get(token)
+        if data is not None:
+            return data
+
+        generation = self.bot_cache.generation()
+        row = self._fetchone("SELECT data FROM bots WHERE token = ?", (token,))
+        if row is None:
+            return None
+        data = json.loads(row['data'])
+        self.bot_cache.set(token, data, generation)
+        return data
+
+    async def save_bot_data(self, token: str, data: Dict[str, Any],
+                            expected_version: Optional[int] = None) -> bool:
+        """Salva dados do bot, incrementando data['version']
+
+        Com expected_version, só grava se a versão atual for essa (compare-and-set)
+        """
+        saved = False
+        with self._transaction():
+            row = self._conn.execute(
+                "SELECT COALESCE(json_extract(data, '$.version'), 0) AS version FROM bots WHERE token = ?",
+                (token,)
+            ).fetchone()
+            version = row['version'] if row else 0
+            if expected_version is None or version == expected_version:
+                data['version'] = version + 1
+                self._conn.execute(
+                    "INSERT INTO bots (token, owner_id, bot_id, username, data) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(token) DO UPDATE SET owner_id = excluded.owner_id, bot_id = excluded.bot_id, "
+                    "username = excluded.username, data = excluded.data",
+                    (token, data.get('owner_id'), get_bot_id(token), normalize_username(data.get('username')), json.dumps(data))
+                )
+                saved = True
+        # Depois da escrita (ou de um conflito, que indica cache desatualizado):
+        # leituras iniciadas antes não repovoam o cache
+        self.bot_cache.invalidate(token)
+        return saved
+
+    async def update_bot_config(self, token: str, path: str, value: Any,
+                                expected_version: Optional[int] = None) -> bool:
+        """Altera um campo de config (path 'plans' ou 'a.b') sem regravar o bot inteiro"""
+        return await self.update_bot_config_many(token, {path: value}, expected_version)
+
+    async def update_bot_config_many(self, token: str, values: Dict[str, Any],
+                                     expected_version: Optional[int] = None) -> bool:
+        """Altera vários campos de config ({path: valor}) com um só incremento de versão"""
+        saved = False
+        with self._transaction():
+            row = self._conn.execute("SELECT data FROM bots WHERE token = ?", (token,)).fetchone()
+            data = json.loads(row['data']) if row else None
+            if data is not None and (expected_version is None or data.get('version', 0) == expected_version):
+                for path, value in values.items():
+                    data['config'] = set_config_path(data.get('config'), path, value)
+                data['version'] = data.get('version', 0) + 1
+                self._conn.execute("UPDATE bots SET data = ? WHERE token = ?", (json.dumps(data), token))
+                saved = True
+        self.bot_cache.invalidate(token)
+        return saved
+
+    async def get_bot_by_token(self, token: str) -> Optional[Dict[str, Any]]:
+        """Busca bot pelo token"""
+        return await self.get_bot_data(token)
+
+    async def get_all_bots(self) -> Dict[str, Dict[str, Any]]:
+        """Obtém todos os bots"""
+        return {
+            row['token']: json.loads(row['data'])
+            for row in self._fetchall("SELECT token, data FROM bots")
+        }
+
+    async def get_bot_token_by_id(self, bot_id: int) -> Optional[str]:
+        """Busca o token de um bot pelo id numérico"""
+        row = self._fetchone("SELECT token FROM bots WHERE bot_id = ? ORDER BY rowid DESC", (bot_id,))
+        return row['token'] if row else None
+
+    async def get_bot_id_by_username(self, username: str) -> Optional[int]:
+        """Busca o id de um bot pelo username (com ou sem '@')"""
+        row = self._fetchone(
+            "SELECT bot_id FROM bots WHERE username = ? ORDER BY rowid DESC",
+            (normalize_username(username),)
+        )
+        return row['bot_id'] if row else None
+
+    async def get_owner_bot_ids(self, owner_id: int) -> List[int]:
+        """Ids dos bots de um dono, em ordem de cadastro"""
+        rows = self._fetchall("SELECT bot_id FROM bots WHERE owner_id = ? ORDER BY rowid", (owner_id,))
+        return [row['bot_id'] for row in rows]
+
+    async def get_owner_bots(self, owner_id: int) -> Dict[str, Dict[str, Any]]:
+        """Bots de um dono (token -> dados)"""
+        rows = self._fetchall("SELECT token, data FROM bots WHERE owner_id = ? ORDER BY rowid", (owner_id,))
+        return {row['token']: json.loads(row['data']) for row in rows}
+
+    # Estados
+    async def get_user_state(self, user_id: int) -> Optional[str]:
+        """Obtém estado do usuário"""
+        row = self._fetchone(
+            "SELECT state FROM states WHERE user_id = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (user_id, time.time())
+        )
+        return row['state'] if row else None
+
+    async def set_user_state(self, user_id: int, state: str, ttl: Optional[int] = None) -> bool:
+        """Define estado do usuário (expira em STATE_TTL por padrão)"""
+        self._execute(
+            "INSERT INTO states (user_id, state, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at",
+            (user_id, state, _expires_at(Config.STATE_TTL if ttl is None else ttl))
+        )
+        return True
+
+    async def clear_user_state(self, user_id: int) -> bool:
+        """Limpa estado do usuário"""
+        self._execute("DELETE FROM states WHERE user_id = ?", (user_id,))
+        return True
+
+    # Códigos de canal
+    async def get_channel_code(self, code: str) -> Optional[Dict[str, Any]]:
+        """Obtém código de canal"""
+        row = self._fetchone(
+            "SELECT data FROM codes WHERE code = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (code, time.time())
+        )
+        return json.loads(row['data']) if row else None
+
+    async def save_channel_code(self, code: str, data: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """Salva código de canal (expira em CHANNEL_CODE_TTL por padrão)"""
+        self._execute(
+            "INSERT INTO codes (code, data, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(code) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+            (code, json.dumps(data), _expires_at(Config.CHANNEL_CODE_TTL if ttl is None else ttl))
+        )
+        return True
+
+    async def delete_channel_code(self, code: str) -> bool:
+        """Remove código de canal"""
+        self._execute("DELETE FROM codes WHERE code = ?", (code,))
+        return True
+
+    # Pagamentos
+    async def get_payment_data(self, user_id: int, payment_id: str) -> Optional[Dict[str, Any]]:
+        """Obtém dados de pagamento"""
+        row = self._fetchone(
+            "SELECT data FROM payments WHERE user_id = ? AND payment_id = ? "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (user_id, payment_id, time.time())
+        )
+        return json.loads(row['data']) if row else None
+
+    async def save_payment_data(self, user_id: int, payment_data: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """Salva dados de pagamento (pendentes expiram em PENDING_PAYMENT_TTL)"""
+        self._execute(
+            "INSERT INTO payments (user_id, payment_id, status, bot_token, created_at, data, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(user_id, payment_id) DO UPDATE SET "
+            "status = excluded.status, bot_token = excluded.bot_token, "
+            "created_at = excluded.created_at, data = excluded.data, "
+            "expires_at = excluded.expires_at",
+            (
+                user_id,
+                payment_data.get('payment_id', ''),
+                payment_data.get('status'),
+                payment_data.get('bot_token'),
+                payment_data.get('created_at'),
+                json.dumps(payment_data),
+                _expires_at(payment_ttl(payment_data, ttl))
+            )
+        )
+        return True
+
+    async def get_payment_by_id(self, payment_id: str) -> Optional[Dict[str, Any]]:
+        """Busca um pagamento só pelo payment_id (webhooks e verificações em lote)"""
+        row = self._fetchone(
+            "SELECT user_id, data FROM payments WHERE payment_id = ? "
+            "AND (expires_at IS NULL OR expires_at > ?) ORDER BY rowid DESC",
+            (payment_id, time.time())
+        )
+        return dict(json.loads(row['data']), user_id=row['user_id']) if row else None
+
+    async def get_payments_by_status(self, status: str, limit: Optional[int] = None,
+                                     created_before: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Pagamentos com um status, do mais antigo ao mais recente (created_at)"""
+        sql = "SELECT user_id, data FROM payments WHERE status = ? AND (expires_at IS NULL OR expires_at > ?)"
+        params = [status, time.time()]
+        if created_before is not None:
+            sql += " AND created_at < ?"
+            params.append(created_before.isoformat())
+        sql += " ORDER BY created_at"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return [
+            dict(json.loads(row['data']), user_id=row['user_id'])
+            for row in self._fetchall(sql, tuple(params))
+        ]
+
+    async def record_payment_checks(self, checks: List[Dict[str, Any]]) -> int:
+        """Grava next_check_at/check_attempts dos pagamentos ainda pendentes em uma transação"""
+        if not checks:
+            return 0
+        with self._transaction():
+            cursor = self._conn.executemany(
+                "UPDATE payments SET data = json_set(data, '$.next_check_at', ?, '$.check_attempts', ?) "
+                "WHERE user_id = ? AND payment_id = ? AND status = 'pending' "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                [
+                    (check['next_check_at'], check['attempts'], check['user_id'], check['payment_id'], time.time())
+                    for check in checks
+                ]
+            )
+        return cursor.rowcount
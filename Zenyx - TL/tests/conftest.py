@@ -0,0 +1,76 @@
+"""
+Fixtures compartilhadas: serviços de persistência em diretórios temporários
+"""
+
+import asyncio
+import inspect
+import os
+import sys
+
+import pytest
+
+# Os módulos do projeto são importados a partir da raiz (config, services...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.config import Config
+from services import redis_service as redis_service_module
+from services.redis_service import RedisService
+from services.sqlite_service import SQLiteService
+
+BACKENDS = ('file', 'sqlite', 'redis')
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    """Executa os testes `async def` em um event loop próprio"""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**arguments))
+    return True
+
+@pytest.fixture(autouse=True)
+def test_config(monkeypatch):
+    """Sem watchers entre processos e sem sweeper em background"""
+    monkeypatch.setattr(Config, 'CHANGE_NOTIFICATIONS', False)
+    monkeypatch.setattr(Config, 'EXPIRY_SWEEP_INTERVAL', 3600.0)
+
+@pytest.fixture
+def file_store_factory(tmp_path):
+    """Abre serviços em arquivo sobre o mesmo diretório (simula reinícios)"""
+    stores = []
+
+    def create(mode: str = 'snapshot') -> RedisService:
+        store = RedisService(str(tmp_path / 'bot_data.json'), mode=mode)
+        stores.append(store)
+        return store
+
+    yield create
+    for store in stores:
+        store.close()
+
+@pytest.fixture
+def fake_redis_service():
+    """AsyncRedisService ligado a um servidor fakeredis"""
+    fakeredis = pytest.importorskip('fakeredis')
+    from services.async_redis_service import AsyncRedisService
+
+    server = fakeredis.FakeServer()
+
+    class FakeRedisService(AsyncRedisService):
+        def _client(self):
+            return fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+
+    return FakeRedisService()
+
+@pytest.fixture(params=BACKENDS)
+def store(request, tmp_path, monkeypatch):
+    """Cada backend, registrado como a instância única do processo"""
+    if request.param == 'file':
+        service = request.getfixturevalue('file_store_factory')()
+    elif request.param == 'sqlite':
+        service = SQLiteService(str(tmp_path / 'bot_data.db'))
+        request.addfinalizer(service.close)
+    else:
+        service = request.getfixturevalue('fake_redis_service')
+    monkeypatch.setattr(redis_service_module, '_shared_service', service)
+    return service
@@ -0,0 +1,330 @@
+"""
+Serviço em arquivo: shards, journal, write-behind, livro de vendas e TTL
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from config.config import Config
+from services import codec
+from services.redis_service import RedisService
+
+LEGACY_DATA = {
+    'users': {'1': {'user_id': 1, 'balance': 12.5, 'sales': [
+        {'amount': 10.0, 'timestamp': '2026-01-01T00:00:00'},
+        {'amount': 2.5, 'timestamp': '2026-01-02T00:00:00'}
+    ]}},
+    'bots': {'123456:AAAA': {'token': '123456:AAAA', 'owner_id': 1, 'config': {}}}
+}
+
+def read_shard(store, namespace: str, key: str) -> dict:
+    """Conteúdo gravado em disco do shard de uma chave"""
+    path = store._shard_path(namespace, store._bucket(key))
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as f:
+        return codec.loads(f.read())
+
+def shard_stat(store, namespace: str, bucket: int):
+    path = store._shard_path(namespace, bucket)
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns
+
+# Shards
+async def test_keys_are_spread_across_shards(file_store_factory):
+    store = file_store_factory()
+    for user_id in range(40):
+        await store.save_user_data(user_id, {'user_id': user_id})
+
+    buckets = {store._bucket(str(user_id)) for user_id in range(40)}
+    assert len(buckets) > 1
+    for user_id in range(40):
+        assert read_shard(store, 'users', str(user_id))[str(user_id)] == {'user_id': user_id}
+
+async def test_only_changed_shard_is_rewritten(file_store_factory):
+    store = file_store_factory()
+    for user_id in range(40):
+        await store.save_user_data(user_id, {'user_id': user_id})
+    before = {bucket: shard_stat(store, 'users', bucket) for bucket in range(store.shard_count)}
+
+    await store.save_user_data(7, {'user_id': 7, 'balance': 1.0})
+
+    changed = {bucket for bucket in before if shard_stat(store, 'users', bucket) != before[bucket]}
+    assert changed == {store._bucket('7')}
+
+async def test_shards_are_read_back_after_restart(file_store_factory):
+    store = file_store_factory()
+    for user_id in range(10):
+        await store.save_user_data(user_id, {'user_id': user_id})
+    store.close()
+
+    reopened = file_store_factory()
+    assert reopened.shard_count == store.shard_count
+    assert sorted(await reopened.get_all_users()) == list(range(10))
+
+# Processos compartilhando os shards (main.py e user_bot_main.py)
+async def test_snapshot_writes_keep_other_process_changes(file_store_factory):
+    main, user_bots = file_store_factory(), file_store_factory()
+    await main.save_user_data(1, {'user_id': 1, 'balance': 0.0})
+    assert (await user_bots.get_user_data(1))['balance'] == 0.0
+
+    await main.increment_user_stats(1, 'balance', 1.0)
+    await user_bots.increment_user_stats(1, 'balance', 2.0)
+    await user_bots.save_user_data(2, {'user_id': 2})
+
+    reopened = file_store_factory()
+    assert (await reopened.get_user_data(1))['balance'] == 3.0
+    assert await reopened.get_user_data(2) == {'user_id': 2}
+
+async def test_external_changes_drop_stale_shards(file_store_factory):
+    main, user_bots = file_store_factory(), file_store_factory()
+    await main.save_bot_data('token', {'token': 'token', 'owner_id': 1, 'config': {}})
+    assert (await user_bots.get_bot_data('token'))['config'] == {}
+
+    await main.save_bot_data('token', {'token': 'token', 'owner_id': 1, 'config': {'plans': []}})
+    user_bots.check_external_changes()
+    assert (await user_bots.get_bot_data('token'))['config'] == {'plans': []}
+
+# Conversão do arquivo único
+def write_legacy_file(tmp_path) -> str:
+    data_file = tmp_path / 'bot_data.json'
+    data_file.write_text(json.dumps(LEGACY_DATA))
+    return str(data_file)
+
+async def assert_converted(store):
+    assert await store.get_user_data(1) == {'user_id': 1, 'balance': 12.5}
+    assert (await store.get_bot_data('123456:AAAA'))['owner_id'] == 1
+    assert [sale['amount'] for sale in await store.get_sales(owner_id=1)] == [10.0, 2.5]
+    assert await store.get_sales_totals() == {1: 12.5}
+
+async def test_single_file_is_converted_to_shards(file_store_factory, tmp_path):
+    data_file = write_legacy_file(tmp_path)
+    store = file_store_factory()
+    await assert_converted(store)
+
+    assert not os.path.exists(data_file)
+    assert os.path.exists(data_file + '.migrated')
+    assert os.path.exists(store.manifest_file)
+    assert '1' in read_shard(store, 'users', '1')
+
+async def test_converted_bots_are_indexed(file_store_factory, tmp_path):
+    write_legacy_file(tmp_path)
+    store = file_store_factory()
+    assert await store.get_owner_bots(1) == LEGACY_DATA['bots']
+    with open(store.manifest_file, 'rb') as f:
+        assert codec.json_loads(f.read())['bot_indexes']
+
+@pytest.mark.parametrize('crash_after', ['_migrate_sales', '_save_data'])
+async def test_interrupted_conversion_is_redone(file_store_factory, tmp_path, monkeypatch, crash_after):
+    write_legacy_file(tmp_path)
+
+    # Queda depois de anexar as vendas ao livro ou de gravar os shards,
+    # antes do manifesto
+    original = getattr(RedisService, crash_after)
+    def crash(self, *args):
+        original(self, *args)
+        raise RuntimeError("queda simulada")
+    monkeypatch.setattr(RedisService, crash_after, crash)
+    with pytest.raises(RuntimeError):
+        file_store_factory()
+    monkeypatch.setattr(RedisService, crash_after, original)
+
+    await assert_converted(file_store_factory())
+
+async def test_conversion_replays_the_old_journal(file_store_factory, tmp_path):
+    data_file = write_legacy_file(tmp_path)
+    with open(data_file + '.journal', 'w', encoding='utf-8') as f:
+        f.write(json.dumps({'op': 'setfield', 'ns': 'users', 'key': '1', 'field': 'balance', 'value': 20.0}) + "\n")
+
+    store = file_store_factory('journal')
+    assert (await store.get_user_data(1))['balance'] == 20.0
+    with open(store.journal_file, 'r', encoding='utf-8') as f:
+        assert 'balance' not in f.read()
+    assert read_shard(store, 'users', '1')['1']['balance'] == 20.0
+
+# Journal
+async def test_journal_replays_records_after_crash(file_store_factory):
+    store = file_store_factory('journal')
+    await store.save_user_data(1, {'user_id': 1, 'balance': 2.5})
+    await store.save_bot_data('token', {'token': 'token', 'owner_id': 1, 'config': {}})
+    await store.set_user_state(1, 'waiting_token')
+    await store.clear_user_state(1)
+
+    # Nada foi compactado: os registros só existem no journal
+    assert '1' not in read_shard(store, 'users', '1')
+
+    reopened = file_store_factory('journal')
+    assert await reopened.get_user_data(1) == {'user_id': 1, 'balance': 2.5}
+    assert (await reopened.get_bot_data('token'))['owner_id'] == 1
+    assert await reopened.get_user_state(1) is None
+
+async def test_journal_ignores_truncated_last_record(file_store_factory):
+    store = file_store_factory('journal')
+    await store.save_user_data(1, {'user_id': 1})
+    with open(store.journal_file, 'a', encoding='utf-8') as f:
+        f.write('{"op": "set", "ns": "users", "key": "2", "val')
+
+    reopened = file_store_factory('journal')
+    assert await reopened.get_user_data(1) == {'user_id': 1}
+    assert await reopened.get_user_data(2) is None
+
+async def test_journal_compaction_writes_shards(file_store_factory, monkeypatch):
+    monkeypatch.setattr(Config, 'JOURNAL_COMPACT_RECORDS', 3)
+    store = file_store_factory('journal')
+    for user_id in range(3):
+        await store.save_user_data(user_id, {'user_id': user_id})
+
+    assert os.path.getsize(store.journal_file) == 0
+    for user_id in range(3):
+        assert str(user_id) in read_shard(store, 'users', str(user_id))
+
+async def test_replaying_increment_after_snapshot_does_not_double_it(file_store_factory):
+    store = file_store_factory('journal')
+    await store.save_user_data(1, {'user_id': 1, 'balance': 10.0})
+    await store.increment_user_stats(1, 'balance', 2.0)
+
+    # Queda entre a gravação dos shards e a limpeza do journal
+    assert store._save_data()
+    reopened = file_store_factory('journal')
+    assert (await reopened.get_user_data(1))['balance'] == 12.0
+
+async def test_activity_journals_only_last_activity(file_store_factory):
+    store = file_store_factory('journal')
+    await store.save_user_data(1, {'user_id': 1, 'balance': 5.0})
+    size = os.path.getsize(store.journal_file)
+
+    assert await store.record_activity({1: time.time()}) == 1
+    with open(store.journal_file, 'r', encoding='utf-8') as f:
+        f.seek(size)
+        records = [json.loads(line) for line in f]
+    assert [(record['op'], record['field']) for record in records] == [('setfield', 'last_activity')]
+
+    reopened = file_store_factory('journal')
+    assert [user['user_id'] for user in await reopened.get_active_users(minutes=1)] == [1]
+
+async def test_payment_checks_journal_only_counters(file_store_factory):
+    store = file_store_factory('journal')
+    await store.save_payment_data(1, {'payment_id': 'p1', 'status': 'pending'})
+    expires_at = store._expires_at('payments', '1:p1')
+    heap_size = len(store._expiry_heap)
+    size = os.path.getsize(store.journal_file)
+
+    for attempts in range(1, 4):
+        await store.record_payment_checks([{'payment_id': 'p1', 'user_id': 1, 'next_check_at': 1000.0,
+                                            'attempts': attempts}])
+    with open(store.journal_file, 'r', encoding='utf-8') as f:
+        f.seek(size)
+        fields = [json.loads(line)['field'] for line in f]
+    assert fields == ['next_check_at', 'check_attempts'] * 3
+    assert store._expires_at('payments', '1:p1') == expires_at
+    assert len(store._expiry_heap) == heap_size
+
+    reopened = file_store_factory('journal')
+    assert (await reopened.get_payment_data(1, 'p1'))['check_attempts'] == 3
+    assert reopened._expires_at('payments', '1:p1') == expires_at
+
+async def test_failed_snapshot_keeps_journal(file_store_factory, monkeypatch):
+    store = file_store_factory('journal')
+    await store.save_user_data(1, {'user_id': 1})
+    monkeypatch.setattr(store, '_save_data', lambda: False)
+    store.close()
+
+    reopened = file_store_factory('journal')
+    assert await reopened.get_user_data(1) == {'user_id': 1}
+
+# Write-behind
+async def test_write_behind_defers_until_flush(file_store_factory, monkeypatch):
+    monkeypatch.setattr(Config, 'WRITE_BEHIND_INTERVAL', 3600.0)
+    store = file_store_factory('write_behind')
+    await store.save_user_data(1, {'user_id': 1})
+    assert '1' not in read_shard(store, 'users', '1')
+
+    store.flush()
+    assert read_shard(store, 'users', '1')['1'] == {'user_id': 1}
+
+async def test_write_behind_flushes_at_max_dirty(file_store_factory, monkeypatch):
+    monkeypatch.setattr(Config, 'WRITE_BEHIND_INTERVAL', 3600.0)
+    monkeypatch.setattr(Config, 'WRITE_BEHIND_MAX_DIRTY', 3)
+    store = file_store_factory('write_behind')
+    for user_id in range(3):
+        await store.save_user_data(user_id, {'user_id': user_id})
+
+    assert not store._dirty
+    for user_id in range(3):
+        assert str(user_id) in read_shard(store, 'users', str(user_id))
+
+async def test_write_behind_pending_changes_survive_close(file_store_factory, monkeypatch):
+    monkeypatch.setattr(Config, 'WRITE_BEHIND_INTERVAL', 3600.0)
+    store = file_store_factory('write_behind')
+    await store.save_user_data(1, {'user_id': 1})
+    await store.save_bot_data('token', {'token': 'token', 'owner_id': 1, 'config': {}})
+    store.close()
+
+    reopened = file_store_factory('write_behind')
+    assert await reopened.get_user_data(1) == {'user_id': 1}
+    assert (await reopened.get_bot_data('token'))['owner_id'] == 1
+
+# Formato
+async def test_snapshot_format_can_change_between_runs(file_store_factory, monkeypatch):
+    pytest.importorskip('msgpack')
+    monkeypatch.setattr(Config, 'FILE_STORE_FORMAT', 'msgpack')
+    store = file_store_factory()
+    await store.save_user_data(1, {'user_id': 1, 'name': 'Zé'})
+    store.close()
+    with open(store._shard_path('users', store._bucket('1')), 'rb') as f:
+        assert f.read(1) != b'{'
+
+    monkeypatch.setattr(Config, 'FILE_STORE_FORMAT', 'json')
+    reopened = file_store_factory()
+    assert await reopened.get_user_data(1) == {'user_id': 1, 'name': 'Zé'}
+
+# TTL
+@pytest.fixture
+def clock(monkeypatch):
+    """Avança o relógio usado pelos vencimentos"""
+    real_time = time.time
+    offset = [0.0]
+    monkeypatch.setattr(time, 'time', lambda: real_time() + offset[0])
+
+    def advance(seconds: float):
+        offset[0] += seconds
+    return advance
+
+async def test_expired_keys_are_not_read(file_store_factory, clock):
+    store = file_store_factory()
+    await store.set_user_state(1, 'waiting_token', ttl=60)
+    assert await store.get_user_state(1) == 'waiting_token'
+
+    clock(120)
+    assert await store.get_user_state(1) is None
+
+@pytest.mark.parametrize('mode', ['snapshot', 'journal', 'write_behind'])
+async def test_sweep_removes_expired_keys(file_store_factory, clock, mode):
+    store = file_store_factory(mode)
+    for user_id in range(3):
+        await store.set_user_state(user_id, 'waiting_token', ttl=60)
+    await store.save_channel_code('permanent', {'owner_id': 1}, ttl=0)
+
+    clock(120)
+    assert store.sweep_expired() == 3
+    store.close()
+
+    reopened = file_store_factory(mode)
+    for user_id in range(3):
+        assert await reopened.get_user_state(user_id) is None
+    assert await reopened.get_channel_code('permanent') == {'owner_id': 1}
+    assert reopened.sweep_expired() == 0
+
+async def test_sweep_skips_keys_rewritten_with_new_ttl(file_store_factory, clock):
+    store = file_store_factory()
+    await store.set_user_state(1, 'first', ttl=10)
+    await store.set_user_state(1, 'second', ttl=1000)
+
+    clock(100)
+    assert store.sweep_expired() == 0
+    assert await store.get_user_state(1) == 'second'
@@ -0,0 +1,173 @@
+"""
+Migração para SQLite/Redis: leitura incremental, checkpoint e retomada
+"""
+
+import json
+import os
+
+import pytest
+
+from services.migration import StoreMigrator, iter_json_file
+from services.sqlite_service import SQLiteService
+
+SOURCE = {
+    'users': {
+        '1': {'user_id': 1, 'balance': 12.5, 'sales': [
+            {'amount': 10.0, 'timestamp': '2026-01-01T00:00:00'},
+            {'amount': 2.5, 'timestamp': '2026-01-02T00:00:00'}
+        ]},
+        '2': {'user_id': 2, 'name': 'Zé "aspas" {chaves}', 'balance': -0.75}
+    },
+    'empty': {},
+    'legacy': [1, 2, 3],
+    'bots': {
+        '123456:AAAA': {'token': '123456:AAAA', 'owner_id': 1, 'config': {'plans': [{'price': 19.9}]}}
+    },
+    'states': {'2': 'waiting_token'},
+    'payments': {
+        '2:p1': {'payment_id': 'p1', 'status': 'paid', 'bot_token': '123456:AAAA',
+                 'created_at': '2026-01-01T00:00:00'}
+    }
+}
+
+@pytest.fixture
+def source_file(tmp_path):
+    path = tmp_path / 'bot_data.json'
+    path.write_text(json.dumps(SOURCE, indent=2, ensure_ascii=False), encoding='utf-8')
+    return str(path)
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def target(request, tmp_path):
+    if request.param == 'sqlite':
+        service = SQLiteService(str(tmp_path / 'target.db'))
+        yield service
+        service.close()
+    else:
+        yield request.getfixturevalue('fake_redis_service')
+
+def expected_records():
+    return [
+        (namespace, key, value)
+        for namespace, items in SOURCE.items() if isinstance(items, dict)
+        for key, value in items.items()
+    ]
+
+# Leitura incremental
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 1 << 20])
+def test_iter_json_file_streams_every_record(source_file, chunk_size):
+    assert list(iter_json_file(source_file, chunk_size=chunk_size)) == expected_records()
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5])
+def test_iter_json_file_keeps_numbers_split_across_chunks(tmp_path, chunk_size):
+    path = tmp_path / 'numbers.json'
+    path.write_text('{"users": {"1": 12345.678, "2": -1e-3, "3": 10}}', encoding='utf-8')
+    assert list(iter_json_file(str(path), chunk_size=chunk_size)) == [
+        ('users', '1', 12345.678), ('users', '2', -1e-3), ('users', '3', 10)
+    ]
+
+def test_iter_json_file_empty_document(tmp_path):
+    path = tmp_path / 'empty.json'
+    path.write_text(' {} ', encoding='utf-8')
+    assert list(iter_json_file(str(path), chunk_size=1)) == []
+
+def test_iter_json_file_rejects_truncated_document(tmp_path):
+    path = tmp_path / 'truncated.json'
+    path.write_text('{"users": {"1": {"user_id": 1}, "2": {"user_', encoding='utf-8')
+    with pytest.raises(ValueError):
+        list(iter_json_file(str(path), chunk_size=4))
+
+# Checkpoint e retomada
+class FailingPipelineStore:
+    """Destino que cai ao abrir o pipeline de número `fail_at`"""
+
+    def __init__(self, store, fail_at: int):
+        self.store = store
+        self.fail_at = fail_at
+        self.pipelines = 0
+
+    def pipeline(self):
+        self.pipelines += 1
+        if self.pipelines == self.fail_at:
+            raise RuntimeError("queda simulada")
+        return self.store.pipeline()
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+async def assert_migrated(target, migrator):
+    report = await migrator.verify()
+    assert all(not entry['mismatches'] for entry in report.values()), report
+    assert report['sales']['target'] == 2
+    assert (await target.get_user_data(1))['balance'] == 12.5
+    assert 'sales' not in await target.get_user_data(1)
+    assert (await target.get_bot_data('123456:AAAA'))['config'] == {'plans': [{'price': 19.9}]}
+    assert await target.get_user_state(2) == 'waiting_token'
+    assert (await target.get_payment_data(2, 'p1'))['status'] == 'paid'
+    assert await target.get_sales_totals() == {1: pytest.approx(12.5)}
+
+async def test_migration_resumes_from_checkpoint(source_file, target, tmp_path):
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    interrupted = StoreMigrator(FailingPipelineStore(target, fail_at=2), source_file,
+                                batch_size=2, checkpoint_file=checkpoint_file)
+    with pytest.raises(RuntimeError):
+        await interrupted.run()
+
+    checkpoint = interrupted.load_checkpoint()
+    assert checkpoint['position'] == 2
+    assert not checkpoint['done']
+
+    migrator = StoreMigrator(target, source_file, batch_size=2, checkpoint_file=checkpoint_file)
+    result = await migrator.run()
+    assert result['done']
+    assert result['counts'] == {'users': 2, 'sales': 2, 'bots': 1, 'states': 1, 'payments': 1}
+    await assert_migrated(target, migrator)
+
+async def test_repeated_batch_does_not_duplicate_sales(source_file, target, tmp_path, monkeypatch):
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    migrator = StoreMigrator(target, source_file, batch_size=2, checkpoint_file=checkpoint_file)
+
+    # Queda entre a gravação do primeiro lote e o checkpoint
+    def crash(checkpoint):
+        raise RuntimeError("queda simulada")
+    monkeypatch.setattr(migrator, '_save_checkpoint', crash)
+    with pytest.raises(RuntimeError):
+        await migrator.run()
+
+    migrator = StoreMigrator(target, source_file, batch_size=2, checkpoint_file=checkpoint_file)
+    assert (await migrator.run())['done']
+    await assert_migrated(target, migrator)
+
+    # --restart também não duplica as vendas
+    migrator.reset()
+    await migrator.run()
+    await assert_migrated(target, migrator)
+
+async def test_checkpoint_rejects_changed_source(source_file, target, tmp_path):
+    checkpoint_file = str(tmp_path / 'checkpoint.json')
+    migrator = StoreMigrator(FailingPipelineStore(target, fail_at=2), source_file,
+                             batch_size=2, checkpoint_file=checkpoint_file)
+    with pytest.raises(RuntimeError):
+        await migrator.run()
+
+    with open(source_file, 'a', encoding='utf-8') as f:
+        f.write('\n')
+    with pytest.raises(ValueError):
+        await StoreMigrator(target, source_file, checkpoint_file=checkpoint_file).run()
+
+async def test_migration_from_shards(file_store_factory, target, tmp_path):
+    source = file_store_factory()
+    await source.save_user_data(1, {'user_id': 1})
+    await source.save_bot_data('123456:AAAA', {'token': '123456:AAAA', 'owner_id': 1, 'config': {}})
+    await source.set_user_state(1, 'waiting_token', ttl=600)
+    await source.add_user_sale(1, {'amount': 5.0, 'timestamp': '2026-01-01T00:00:00'})
+    source.close()
+
+    migrator = StoreMigrator(target, source.data_file, batch_size=2,
+                             checkpoint_file=str(tmp_path / 'checkpoint.json'))
+    result = await migrator.run()
+
+    assert result['counts'] == {'users': 1, 'bots': 1, 'states': 1, 'sales': 1}
+    report = await migrator.verify()
+    assert all(not entry['mismatches'] for entry in report.values()), report
+    assert await target.get_user_state(1) == 'waiting_token'
+    assert os.path.exists(os.path.join(source.data_dir, 'manifest.json'))
@@ -0,0 +1,45 @@
+"""
+Confirmação de pagamentos: cada pagamento gera uma venda e uma comissão
+"""
+
+import pytest
+
+from config.config import Config
+
+TOKEN = '123456:AAAA'
+
+class FakeBot:
+    """Guarda as mensagens enviadas"""
+
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id, text):
+        self.messages.append((chat_id, text))
+
+@pytest.fixture
+def handlers(store, monkeypatch):
+    from handlers import user_bot_handlers
+    monkeypatch.setattr(user_bot_handlers, 'redis_service', store)
+    return user_bot_handlers
+
+async def test_payment_confirmed_by_two_processes_is_credited_once(store, handlers, monkeypatch):
+    await store.save_user_data(1, {'user_id': 1, 'balance': 0.0})
+    bot_data = {'token': TOKEN, 'owner_id': 1, 'config': {}}
+    payment = {'payment_id': 'pay-1', 'user_id': 2, 'bot_token': TOKEN, 'status': 'pending',
+               'plan_name': 'VIP', 'plan_price': 10.0}
+    await store.save_payment_data(2, payment)
+
+    # O outro processo leu o pagamento ainda pendente
+    async def pending_payment(user_id, payment_id):
+        return dict(payment)
+
+    bot = FakeBot()
+    assert await handlers.confirm_payment(bot, dict(payment), bot_data)
+    monkeypatch.setattr(store, 'get_payment_data', pending_payment)
+    sent = len(bot.messages)
+    assert not await handlers.confirm_payment(bot, dict(payment), bot_data)
+
+    assert len(bot.messages) == sent
+    assert (await store.get_user_data(1))['balance'] == pytest.approx(10.0 * Config.COMMISSION_RATE)
+    assert len(await store.get_sales(owner_id=1)) == 1
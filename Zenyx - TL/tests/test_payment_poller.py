@@ -0,0 +1,181 @@
+"""
+Agendador de verificações de pagamentos: backoff, limite por token e retomada
+"""
+
+import asyncio
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from config.config import Config
+from services.payment_poller import PaymentPoller
+
+class RecordingStore:
+    """Guarda os agendamentos gravados pelo agendador"""
+
+    def __init__(self):
+        self.checks = []
+
+    async def record_payment_checks(self, checks):
+        self.checks.extend(checks)
+        return len(checks)
+
+@pytest.fixture
+def poller_config(monkeypatch):
+    monkeypatch.setattr(Config, 'PAYMENT_POLL_INITIAL_INTERVAL', 0.02)
+    monkeypatch.setattr(Config, 'PAYMENT_POLL_BACKOFF', 2.0)
+    monkeypatch.setattr(Config, 'PAYMENT_POLL_MAX_INTERVAL', 0.08)
+    monkeypatch.setattr(Config, 'PAYMENT_POLL_MAX_INFLIGHT_PER_TOKEN', 2)
+    monkeypatch.setattr(Config, 'PAYMENT_POLL_TIMEOUT', 60.0)
+    monkeypatch.setattr(Config, 'PAYMENT_RECOVERY_BATCH', 2)
+
+@pytest.fixture
+def make_poller(poller_config):
+    pollers = []
+
+    def create(check, store=None) -> PaymentPoller:
+        poller = PaymentPoller(check, store=store or RecordingStore())
+        pollers.append(poller)
+        return poller
+
+    yield create
+    for poller in pollers:
+        poller.stop()
+
+def wait_until(condition, timeout: float = 3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condição não atingida a tempo")
+        time.sleep(0.01)
+
+def test_interval_grows_until_max(make_poller):
+    poller = make_poller(None)
+    assert [poller._interval(attempts) for attempts in range(5)] == [0.02, 0.04, 0.08, 0.08, 0.08]
+
+def test_checks_back_off_until_done(make_poller):
+    calls = []
+
+    async def check(payment_id, user_id):
+        calls.append(time.monotonic())
+        return len(calls) == 4
+
+    store = RecordingStore()
+    poller = make_poller(check, store)
+    poller.add('p1', 1, 'token')
+    wait_until(lambda: poller.pending() == 0)
+
+    assert len(calls) == 4
+    gaps = [later - earlier for earlier, later in zip(calls, calls[1:])]
+    assert gaps[0] >= 0.04 * 0.9
+    assert gaps[-1] >= 0.08 * 0.9
+    # Cada reagendamento grava as tentativas feitas até então
+    wait_until(lambda: [check['attempts'] for check in store.checks][-1:] == [3])
+    attempts = [check['attempts'] for check in store.checks]
+    assert attempts == sorted(attempts)
+
+def test_inflight_checks_are_limited_per_token(make_poller):
+    running = {}
+    peak = {}
+    lock = threading.Lock()
+
+    async def check(payment_id, user_id):
+        token = payment_id.split('-')[0]
+        with lock:
+            running[token] = running.get(token, 0) + 1
+            peak[token] = max(peak.get(token, 0), running[token])
+        await asyncio.sleep(0.05)
+        with lock:
+            running[token] -= 1
+        return True
+
+    poller = make_poller(check)
+    for i in range(6):
+        poller.add(f"A-{i}", 1, 'A')
+    for i in range(2):
+        poller.add(f"B-{i}", 1, 'B')
+    wait_until(lambda: poller.pending() == 0)
+
+    assert peak == {'A': 2, 'B': 2}
+
+def test_discarded_and_expired_payments_stop_being_checked(make_poller, monkeypatch):
+    monkeypatch.setattr(Config, 'PAYMENT_POLL_TIMEOUT', 0.15)
+    calls = []
+
+    async def check(payment_id, user_id):
+        calls.append(payment_id)
+        return False
+
+    poller = make_poller(check)
+    poller.add('discarded', 1, 'token')
+    assert poller.discard('discarded')
+    poller.add('expired', 1, 'token')
+    wait_until(lambda: poller.pending() == 0)
+
+    assert 'discarded' not in calls
+    assert 'expired' in calls
+    checked = len(calls)
+    time.sleep(0.1)
+    assert len(calls) == checked
+
+def test_stop_ends_the_scheduler_thread(make_poller):
+    async def check(payment_id, user_id):
+        return False
+
+    poller = make_poller(check)
+    poller.add('p1', 1, 'token')
+    poller.stop()
+
+    assert not poller._thread.is_alive()
+
+def test_restore_staggers_overdue_payments(make_poller, monkeypatch):
+    monkeypatch.setattr(Config, 'PAYMENT_POLL_INITIAL_INTERVAL', 10.0)
+    never = asyncio.Event()
+
+    async def check(payment_id, user_id):
+        await never.wait()
+        return True
+
+    now = time.time()
+    entries = [
+        {'payment_id': f"p{i}", 'user_id': 1, 'token': 'token', 'created_at': now - 5,
+         'next_check_at': now - 5 + i, 'attempts': 2}
+        for i in range(5)
+    ]
+    entries.append({'payment_id': 'future', 'user_id': 1, 'token': 'token', 'created_at': now,
+                    'next_check_at': now + 30, 'attempts': 4})
+    entries.append({'payment_id': 'expired', 'user_id': 1, 'token': 'token', 'created_at': now - 120,
+                    'next_check_at': None, 'attempts': 0})
+
+    poller = make_poller(check)
+    assert poller.restore(entries) == 6
+    assert poller.restore(entries) == 0
+
+    scheduled = {payment_id: entry['next_check_at'] - now for payment_id, entry in poller._entries.items()}
+    assert [round(scheduled[f"p{i}"] / 10) for i in range(5)] == [0, 0, 1, 1, 2]
+    assert scheduled['future'] == pytest.approx(30)
+    assert poller._entries['future']['attempts'] == 4
+
+async def test_pending_payments_are_recovered_after_restart(store, make_poller, monkeypatch):
+    from handlers import user_bot_handlers
+
+    token = '123456:AAAA'
+    await store.save_user_data(1, {'user_id': 1})
+    await store.save_bot_data(token, {'token': token, 'owner_id': 1, 'config': {'pushinpay_token': 'pp'}})
+    await store.save_payment_data(2, {'payment_id': 'p1', 'status': 'pending', 'bot_token': token,
+                                      'created_at': datetime.now().isoformat()})
+    await store.record_payment_checks([{'payment_id': 'p1', 'user_id': 2, 'next_check_at': time.time() + 30,
+                                        'attempts': 3}])
+
+    poller = make_poller(user_bot_handlers.check_pending_payment, store)
+    monkeypatch.setattr(user_bot_handlers, 'redis_service', store)
+    monkeypatch.setattr(user_bot_handlers, '_payment_poller', poller)
+
+    assert await user_bot_handlers.recover_pending_payments(['999:ZZZZ']) == 0
+    assert await user_bot_handlers.recover_pending_payments([token]) == 1
+
+    entry = poller._entries['p1']
+    assert (entry['user_id'], entry['token'], entry['attempts']) == (2, 'pp', 3)
+    assert entry['next_check_at'] == pytest.approx(time.time() + 30, abs=1)
@@ -0,0 +1,262 @@
+"""
+Comportamento comum aos backends (arquivo, SQLite e Redis via fakeredis)
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from services import bot_config
+from services.bot_config import append_bot_config
+from utils.helpers import get_cache_key
+
+TOKEN = '123456:AAAA'
+
+async def create_bot(store, token: str = TOKEN, **config):
+    await store.save_user_data(1, {'user_id': 1, 'bots': [token]})
+    await store.save_bot_data(token, {
+        'token': token,
+        'owner_id': 1,
+        'username': 'zenyx_bot',
+        'config': dict(config)
+    })
+
+async def test_users_and_bots_round_trip(store):
+    await store.save_user_data(1, {'user_id': 1, 'balance': 12.5, 'bots': [TOKEN]})
+    await store.save_bot_data(TOKEN, {'token': TOKEN, 'owner_id': 1, 'config': {'plans': []}})
+
+    assert await store.get_user_data(1) == {'user_id': 1, 'balance': 12.5, 'bots': [TOKEN]}
+    assert await store.get_user_data(2) is None
+    assert (await store.get_bot_data(TOKEN))['config'] == {'plans': []}
+    assert list(await store.get_all_bots()) == [TOKEN]
+    assert list(await store.get_all_users()) == [1]
+
+async def test_states_and_channel_codes(store):
+    await store.set_user_state(1, 'waiting_token')
+    await store.save_channel_code('abc', {'owner_id': 1})
+    assert await store.get_user_state(1) == 'waiting_token'
+    assert await store.get_channel_code('abc') == {'owner_id': 1}
+
+    await store.clear_user_state(1)
+    await store.delete_channel_code('abc')
+    assert await store.get_user_state(1) is None
+    assert await store.get_channel_code('abc') is None
+
+# Índices de bots
+async def test_bot_indexes_follow_saves(store):
+    other = '654321:BBBB'
+    await store.save_bot_data(TOKEN, {'token': TOKEN, 'owner_id': 1, 'username': 'MeuBot', 'config': {}})
+    await store.save_bot_data(other, {'token': other, 'owner_id': 1, 'username': 'outro_bot', 'config': {}})
+
+    assert await store.get_bot_token_by_id(123456) == TOKEN
+    assert await store.get_bot_id_by_username('@meubot') == 123456
+    assert await store.get_owner_bot_ids(1) == [123456, 654321]
+    assert sorted(await store.get_owner_bots(1)) == [TOKEN, other]
+
+    # Troca de dono e de username
+    await store.save_bot_data(other, {'token': other, 'owner_id': 2, 'username': 'novo_bot', 'config': {}})
+    assert await store.get_owner_bot_ids(1) == [123456]
+    assert await store.get_owner_bot_ids(2) == [654321]
+    assert await store.get_bot_id_by_username('outro_bot') is None
+    assert await store.get_bot_id_by_username('novo_bot') == 654321
+
+# Índices de pagamentos
+async def test_payment_indexes_follow_status(store):
+    for user_id, payment_id, status, created_at in [
+        (1, 'p2', 'pending', '2026-01-02T00:00:00'),
+        (2, 'p1', 'pending', '2026-01-01T00:00:00'),
+        (2, 'p3', 'paid', '2026-01-03T00:00:00'),
+    ]:
+        await store.save_payment_data(user_id, {'payment_id': payment_id, 'status': status, 'created_at': created_at})
+
+    assert (await store.get_payment_by_id('p2'))['user_id'] == 1
+    assert await store.get_payment_by_id('missing') is None
+    pending = await store.get_payments_by_status('pending')
+    assert [payment['payment_id'] for payment in pending] == ['p1', 'p2']
+
+    await store.save_payment_data(2, {'payment_id': 'p1', 'status': 'paid', 'created_at': '2026-01-01T00:00:00'})
+    assert [payment['payment_id'] for payment in await store.get_payments_by_status('pending')] == ['p2']
+    assert [payment['payment_id'] for payment in await store.get_payments_by_status('paid', limit=1)] == ['p1']
+
+async def test_record_payment_checks_only_updates_pending(store):
+    await store.save_payment_data(1, {'payment_id': 'p1', 'status': 'pending', 'bot_token': TOKEN,
+                                      'created_at': '2026-01-01T00:00:00'})
+    await store.save_payment_data(1, {'payment_id': 'p2', 'status': 'paid', 'bot_token': TOKEN,
+                                      'created_at': '2026-01-01T00:00:00'})
+
+    saved = await store.record_payment_checks([
+        {'payment_id': 'p1', 'user_id': 1, 'next_check_at': 1000.0, 'attempts': 3},
+        {'payment_id': 'p2', 'user_id': 1, 'next_check_at': 1000.0, 'attempts': 3}
+    ])
+
+    assert saved == 1
+    pending = await store.get_payments_by_status('pending')
+    assert [(p['payment_id'], p['next_check_at'], p['check_attempts']) for p in pending] == [('p1', 1000.0, 3)]
+    assert 'next_check_at' not in await store.get_payment_data(1, 'p2')
+
+# Presença
+async def test_active_users_follow_recorded_activity(store):
+    for user_id in (1, 2, 3):
+        await store.save_user_data(user_id, {'user_id': user_id, 'balance': 1.0})
+    now = time.time()
+
+    assert await store.record_activity({1: now - 60, 2: now - 3600, 3: now, 4: now}) == 3
+
+    active = await store.get_active_users(minutes=5)
+    assert [user['user_id'] for user in active] == [3, 1]
+    assert active[0]['balance'] == 1.0
+    assert 'last_activity' in active[0]
+
+# Configuração versionada
+async def test_update_bot_config_many_bumps_version_once(store):
+    await create_bot(store, plans=[])
+    version = (await store.get_bot_data(TOKEN))['version']
+
+    assert await store.update_bot_config_many(TOKEN, {'media_type': 'photo', 'media_id': 'abc'})
+
+    bot_data = await store.get_bot_data(TOKEN)
+    assert bot_data['config'] == {'plans': [], 'media_type': 'photo', 'media_id': 'abc'}
+    assert bot_data['version'] == version + 1
+
+async def test_update_bot_config_rejects_stale_version(store):
+    await create_bot(store)
+    version = (await store.get_bot_data(TOKEN))['version']
+    assert await store.update_bot_config(TOKEN, 'welcome_message', 'oi', expected_version=version)
+
+    assert not await store.update_bot_config(TOKEN, 'welcome_message', 'olá', expected_version=version)
+    assert not await store.save_bot_data(TOKEN, {'token': TOKEN, 'owner_id': 1}, expected_version=version)
+    assert (await store.get_bot_data(TOKEN))['config'] == {'welcome_message': 'oi'}
+
+async def test_update_bot_config_of_missing_bot(store):
+    assert not await store.update_bot_config('999:ZZZZ', 'plans', [])
+
+async def test_append_bot_config_retries_after_concurrent_change(store, monkeypatch):
+    await create_bot(store, plans=[])
+    update = store.update_bot_config
+    attempts = []
+
+    async def racing_update(token, path, value, expected_version=None):
+        if not attempts:
+            # Outro processo anexa um plano entre a leitura e a gravação
+            await update(token, path, [{'name': 'concorrente'}])
+        attempts.append(expected_version)
+        return await update(token, path, value, expected_version)
+
+    monkeypatch.setattr(store, 'update_bot_config', racing_update)
+    assert await append_bot_config(TOKEN, 'plans', {'name': 'novo'}) is True
+
+    assert len(attempts) == 2
+    plans = (await store.get_bot_data(TOKEN))['config']['plans']
+    assert plans == [{'name': 'concorrente'}, {'name': 'novo'}]
+
+async def test_append_bot_config_gives_up_after_retries(store, monkeypatch):
+    await create_bot(store, plans=[])
+    update = store.update_bot_config
+    attempts = []
+
+    async def always_conflicting(token, path, value, expected_version=None):
+        attempts.append(expected_version)
+        await update(token, 'welcome_message', f"alteração {len(attempts)}")
+        return await update(token, path, value, expected_version)
+
+    monkeypatch.setattr(store, 'update_bot_config', always_conflicting)
+    assert await append_bot_config(TOKEN, 'plans', {'name': 'novo'}) is None
+    assert len(attempts) == bot_config.CAS_RETRIES
+    assert (await store.get_bot_data(TOKEN))['config']['plans'] == []
+
+async def test_append_bot_config_skips_duplicates(store):
+    await create_bot(store, linked_groups=[{'id': -100}])
+    result = await append_bot_config(
+        TOKEN, 'linked_groups', {'id': -100},
+        is_duplicate=lambda group: group['id'] == -100
+    )
+    assert result is False
+    assert (await store.get_bot_data(TOKEN))['config']['linked_groups'] == [{'id': -100}]
+
+# Lotes
+async def test_pipeline_and_batched_reads(store):
+    await store.save_many('users', {1: {'user_id': 1, 'balance': 0.0}, 2: {'user_id': 2}})
+    async with store.pipeline() as pipe:
+        pipe.save_payment_data(2, {'payment_id': 'p1', 'status': 'approved'})
+        pipe.add_user_sale(1, {'amount': 10.0, 'bot_token': TOKEN, 'timestamp': '2026-01-01T00:00:00'})
+        pipe.increment_user_stats(1, 'balance', 3.0)
+
+    assert pipe.results == [True, True, True]
+    users = await store.get_many('users', [1, 2, 3])
+    assert users[1]['balance'] == 3.0
+    assert users[2] == {'user_id': 2}
+    assert users[3] is None
+    assert (await store.get_payment_data(2, 'p1'))['status'] == 'approved'
+    assert [sale['amount'] for sale in await store.get_sales(owner_id=1)] == [10.0]
+
+# Contadores
+async def test_concurrent_increments_are_not_lost(store):
+    await store.save_user_data(1, {'user_id': 1, 'balance': 0.0})
+    results = await asyncio.gather(*(store.increment_user_stats(1, 'balance', 0.5) for _ in range(20)))
+
+    assert all(results)
+    assert (await store.get_user_data(1))['balance'] == pytest.approx(10.0)
+    assert not await store.increment_user_stats(2, 'balance', 1.0)
+
+async def test_iter_users_pages_with_projection(store):
+    for user_id in range(1, 8):
+        await store.save_user_data(user_id, {'user_id': user_id, 'username': f"u{user_id}", 'balance': 1.0})
+
+    users = [item async for item in store.iter_users(page_size=3, fields=['username'])]
+    assert sorted(users) == [(user_id, {'username': f"u{user_id}"}) for user_id in range(1, 8)]
+
+# Métricas
+async def test_platform_metrics_follow_writes(store):
+    await store.save_user_data(1, {'user_id': 1})
+    await store.save_user_data(2, {'user_id': 2})
+    await store.save_bot_data(TOKEN, {'token': TOKEN, 'owner_id': 1, 'config': {}})
+    await store.add_user_sale(1, {'amount': 10.0, 'bot_token': TOKEN, 'timestamp': '2026-01-01T00:00:00'})
+    await store.add_user_sale(1, {'amount': 2.5, 'bot_token': TOKEN, 'timestamp': '2026-01-02T00:00:00'})
+
+    metrics = await store.get_platform_metrics()
+    assert (metrics['users'], metrics['bots'], metrics['sales'], metrics['paying_users']) == (2, 1, 2, 1)
+    assert metrics['revenue'] == pytest.approx(12.5)
+
+# Vendas
+async def test_sale_key_is_recorded_once(store):
+    await store.save_user_data(1, {'user_id': 1})
+    sale = {'amount': 10.0, 'timestamp': '2026-01-01T00:00:00', 'sale_key': 'migration:1:0'}
+
+    assert await store.add_user_sale(1, sale)
+    assert not await store.add_user_sale(1, sale)
+    assert await store.add_user_sale(1, dict(sale, sale_key=None))
+
+    metrics = await store.get_platform_metrics()
+    assert metrics['sales'] == 2
+    assert metrics['revenue'] == pytest.approx(20.0)
+    assert (await store.get_sales_totals())[1] == pytest.approx(20.0)
+
+async def test_sale_credit_is_applied_once(store):
+    await store.save_user_data(1, {'user_id': 1, 'balance': 1.0})
+    sale = {'amount': 10.0, 'timestamp': '2026-01-01T00:00:00', 'sale_key': 'pay-1'}
+
+    assert await store.add_user_sale(1, sale, credit=0.5)
+    async with store.pipeline() as pipe:
+        pipe.add_user_sale(1, sale, credit=0.5)
+
+    assert pipe.results == [False]
+    assert (await store.get_user_data(1))['balance'] == pytest.approx(1.5)
+    assert not await store.add_user_sale(2, dict(sale, sale_key='pay-2'), credit=0.5)
+
+# Vencimentos
+async def test_state_ttl(store, monkeypatch):
+    await store.set_user_state(1, 'waiting_token', ttl=60)
+    await store.save_channel_code('permanent', {'owner_id': 1}, ttl=0)
+
+    if hasattr(store, 'sweep_expired'):
+        real_time = time.time
+        monkeypatch.setattr(time, 'time', lambda: real_time() + 120)
+        assert store.sweep_expired() == 1
+        assert await store.get_user_state(1) is None
+    else:
+        # No Redis o vencimento é do próprio servidor (EXPIRE)
+        client = store._client()
+        assert 0 < await client.ttl(get_cache_key('state', '1')) <= 60
+        assert await client.ttl(get_cache_key('code', 'permanent')) == -1
+    assert await store.get_channel_code('permanent') == {'owner_id': 1}
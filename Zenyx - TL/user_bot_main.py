@@ -4,6 +4,7 @@ BOT ZENYX - Inicializador para bots dos usuários
 Este script é responsável por inicializar os bots criados pelos usuários
 """
 
+import asyncio
 import logging
 import os
 import sys
@@ -26,11 +27,17 @@ from handlers.user_bot_handlers import (
     handle_media_message,
     handle_config_callback,
     handle_plan_purchase,
-    check_payment_status
+    check_payment_status,
+    handle_payment_webhook,
+    get_payment_poller,
+    recover_pending_payments
 )
 
 # Importar serviço Redis
-from services.redis_service import RedisService
+from services.redis_service import get_redis_service
+from services.payment_service import close_http_session
+from services.payment_webhook import PaymentWebhookServer
+from config.config import Config
 
 # Configurar logging
 logging.basicConfig(
@@ -43,7 +50,7 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # Inicializar serviço Redis
-redis_service = RedisService()
+redis_service = get_redis_service()
 
 class UserBot:
     """Classe para inicializar os bots dos usuários"""
@@ -67,10 +74,14 @@ class UserBot:
             except Exception:
                 pass
     
+    async def on_shutdown(self, application):
+        """Fecha as conexões HTTP do event loop deste bot"""
+        await close_http_session()
+    
     def run(self):
         """Iniciar o bot"""
         # Criar a aplicação
-        application = Application.builder().token(self.token).build()
+        application = Application.builder().token(self.token).post_shutdown(self.on_shutdown).build()
         
         # Adicionar handlers
         
@@ -108,6 +119,18 @@ def start_user_bot(token):
         logger.error(f"Erro ao iniciar bot com token {token[:10]}...: {e}")
 
 
+async def recover_payments(tokens=None):
+    """Retoma a verificação dos pagamentos pendentes de antes do reinício
+
+    A retomada roda no event loop do agendador; aqui só se espera por ela,
+    sem bloquear o event loop de quem chamou.
+    """
+    try:
+        await asyncio.wrap_future(get_payment_poller().submit(recover_pending_payments(tokens)))
+    except Exception as e:
+        logger.error(f"Erro ao retomar pagamentos pendentes: {e}")
+
+
 def start_bot_in_thread(token):
     """Inicia um bot em uma thread separada"""
     thread = threading.Thread(target=start_user_bot, args=(token,))
@@ -137,7 +160,10 @@ async def start_all_user_bots():
     tokens = await get_all_bot_tokens()
     if not tokens:
         logger.warning("Nenhum bot registrado encontrado.")
-        return
+        return []
+    
+    # Checkouts em andamento antes do reinício voltam para o agendador
+    await recover_payments(tokens)
     
     logger.info(f"Iniciando {len(tokens)} bots de usuários...")
     
@@ -150,15 +176,35 @@ async def start_all_user_bots():
         time.sleep(0.5)
     
     logger.info(f"{len(threads)} bots de usuários iniciados com sucesso!")
+    return threads
 
 
 if __name__ == '__main__':
     # Se o script for executado diretamente
-    if len(sys.argv) > 1:
-        # Se um token foi fornecido como argumento, iniciar apenas esse bot
-        token = sys.argv[1]
-        start_user_bot(token)
-    else:
-        # Se nenhum token foi fornecido, iniciar todos os bots registrados
-        import asyncio
-        asyncio.run(start_all_user_bots())
\ No newline at end of file
+    
+    # Confirmação imediata dos pagamentos via webhook da PushinPay: as
+    # cobranças enviam webhook_url sempre que PUSHINPAY_WEBHOOK_URL existe,
+    # então o servidor sobe com um bot só ou com todos
+    webhook_server = None
+    if Config.PUSHINPAY_WEBHOOK_URL:
+        webhook_server = PaymentWebhookServer(handle_payment_webhook)
+        webhook_server.start()
+    try:
+        if len(sys.argv) > 1:
+            # Se um token foi fornecido como argumento, iniciar apenas esse bot
+            token = sys.argv[1]
+            # Antes do event loop do bot, então a espera não bloqueia ninguém
+            asyncio.run(recover_payments([token]))
+            start_user_bot(token)
+        else:
+            # Se nenhum token foi fornecido, iniciar todos os bots registrados
+            threads = asyncio.run(start_all_user_bots())
+            
+            # Os bots rodam em threads daemon: manter o processo vivo enquanto rodarem
+            for thread in threads:
+                thread.join()
+    finally:
+        # Encerrar os event loops auxiliares fecha as sessões HTTP deles
+        if webhook_server is not None:
+            webhook_server.stop()
+        get_payment_poller().stop()
@@ -33,6 +33,27 @@ def is_valid_token(token: str) -> bool:
     pattern = r'^\d+:[A-Za-z0-9_-]{35}$'
     return bool(re.match(pattern, token))
 
+def get_bot_id(token: str) -> Optional[int]:
+    """Extrai o id numérico do bot (parte do token antes de ':')"""
+    bot_id = token.split(':', 1)[0]
+    return int(bot_id) if bot_id.isdigit() else None
+
+def normalize_username(username: Optional[str]) -> str:
+    """Username sem '@' e em minúsculas, como chave de índice"""
+    return (username or '').lstrip('@').lower()
+
+def set_config_path(config: Optional[Dict[str, Any]], path: str, value: Any) -> Dict[str, Any]:
+    """Cópia de config com `value` em `path` ('plans' ou 'a.b'), criando os níveis que faltam"""
+    config = dict(config or {})
+    parts = path.split('.')
+    target = config
+    for part in parts[:-1]:
+        child = target.get(part)
+        target[part] = dict(child) if isinstance(child, dict) else {}
+        target = target[part]
+    target[parts[-1]] = value
+    return config
+
 def is_valid_pushinpay_token(token: str) -> bool:
     """Verifica se o token PushinPay é válido"""
     pattern = r'^\d+\|[A-Za-z0-9]{40,}$'
@@ -402,14 +423,18 @@ def truncate_text(text: str, max_length: int = 4096) -> str:
     return text[:max_length-3] + "..."
 
 # Funções de validação de negócio
-def can_create_bot(user_data: Dict[str, Any]) -> Tuple[bool, str]:
-    """Verifica se usuário pode criar um novo bot"""
-    if not user_data:
-        return True, "Pode criar bot"
-        
-    current_bots = len(user_data.get('bots', []))
+def can_create_bot(user_data: Dict[str, Any], bot_count: Optional[int] = None) -> Tuple[bool, str]:
+    """Verifica se usuário pode criar um novo bot
+
+    `bot_count` vem do índice de bots do dono; sem ele, conta a lista
+    de tokens do usuário.
+    """
+    if bot_count is None:
+        if not user_data:
+            return True, "Pode criar bot"
+        bot_count = len(user_data.get('bots', []))
     
-    if hasattr(Config, 'MAX_BOTS_PER_USER') and current_bots >= Config.MAX_BOTS_PER_USER:
+    if hasattr(Config, 'MAX_BOTS_PER_USER') and bot_count >= Config.MAX_BOTS_PER_USER:
         return False, f"Limite máximo de {Config.MAX_BOTS_PER_USER} bots atingido"
     
     return True, "Pode criar bot"
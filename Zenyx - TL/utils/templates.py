@@ -259,7 +259,20 @@ Este código expira em 1 hora.""",
     # Mensagens administrativas
     'admin_menu': """👨‍💼 *MENU ADMINISTRATIVO*
 
-Escolha uma opção:""",
+Escolha uma opção:
+
+🔍 Para buscar um bot: /bot <id ou @username>""",
+
+    'bot_lookup': """🤖 *BOT* `@{username}`
+
+ID: `{bot_id}`
+Dono: `{owner_id}`
+Ativo: {active}
+Planos: {plans}
+Grupos vinculados: {groups}
+Criado em: {created_at}
+
+Bots do dono ({owner_bot_count}): {owner_bots}""",
 
     'sales_metrics': """📊 *MÉTRICAS DE VENDAS*
 